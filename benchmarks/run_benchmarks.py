@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# ==== Per-module benchmark suite with process, CIB I/O and wall-time budgets ====
+#
+# usage: python benchmarks/run_benchmarks.py [--module NAME ...] [--primitives N]
+#                                             [--os-family RedHat --os-version 8]
+#                                             [--check-time] [--update-baseline --reason TEXT] [--json FILE]
+#
+# Runs the create, idempotent no-op, memoized no-op, update and delete steps of benchmarks/scenarios.json
+# for each module against the simulated toolchain (simulator/), starting from a copy of
+# benchmarks/fixtures/cib.xml padded with N extra primitives. For every step it reports:
+#   spawns       processes started by the module (each pipeline stage counts, plus the shell)
+#   cib_read     bytes of CIB read, by the module directly and by the tools it ran
+#   cib_written  bytes of CIB written, by the module directly and by the tools it ran
+#   wall_time    seconds the module took, including interpreter start-up
+# and fails when a step regresses past benchmarks/baseline.json. Requires ansible.
+#
+# The counters are deterministic, so they are compared on every run. wall_time depends on the machine and its
+# load, so it is only compared with --check-time, on the machine the baseline's times were recorded on.
+# The baseline is recorded once and only changed on purpose: --update-baseline requires a --reason, which is kept
+# under "history" in baseline.json with the steps whose counters changed, and only rewrites wall_time with
+# --check-time. Commits changing the baseline should say why as well.
+# A scenario's os_args give the arguments that differ by OS family, e.g. pcs flags, over its args.
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+BENCH_DIR       = os.path.dirname(os.path.abspath(__file__))
+REPO            = os.path.dirname(BENCH_DIR)
+SCENARIOS_PATH  = os.path.join(BENCH_DIR, "scenarios.json")
+BASELINE_PATH   = os.path.join(BENCH_DIR, "baseline.json")
+FIXTURE_PATH    = os.path.join(BENCH_DIR, "fixtures", "cib.xml")
+
+# Allowed growth over the baseline before a step counts as a regression
+BYTES_TOLERANCE = 0.10  # fraction
+TIME_TOLERANCE  = 0.50  # fraction
+TIME_SLACK      = 0.25  # seconds, absorbs interpreter start-up noise
+
+# Measurements compared on every run
+COUNTERS        = ("spawns", "cib_read", "cib_written")
+
+
+# Writes the fixture CIB, padded with extra primitives, to path
+def write_fixture(path, primitives):
+    tree = ET.parse(FIXTURE_PATH)
+    resources = tree.getroot().find("configuration/resources")
+    for index in range(primitives):
+        name = "bench_pad%d" % index
+        primitive = ET.SubElement(resources, "primitive", id=name, provider="heartbeat", type="Dummy")
+        primitive.set("class", "ocf")
+        instance = ET.SubElement(primitive, "instance_attributes", id=name + "-instance_attributes")
+        ET.SubElement(instance, "nvpair", id=name + "-instance_attributes-state", name="state", value="/run/%s.state" % name)
+    tree.write(path)
+
+# Runs one scenario step and returns its measurements
+def run_step(module_name, args, workdir, os_family, os_version):
+    args_path = os.path.join(workdir, "..", "args.json")
+    counters_path = os.path.join(workdir, "..", "counters.json")
+    log_path = os.path.join(workdir, "commands.jsonl")
+    with open(args_path, "w") as args_file:
+        json.dump(dict(ANSIBLE_MODULE_ARGS=dict(args, os_family=os_family, os_version=os_version)), args_file)
+    if os.path.isfile(log_path):
+        os.remove(log_path)
+
+    environment = dict(os.environ,
+                       PATH=os.path.join(REPO, "simulator", "bin") + os.pathsep + os.environ.get("PATH", ""),
+                       CIB_file=os.path.join(workdir, "cib.xml"),
+                       CIB_shadow_dir=workdir,
+                       CLUSTER_PCSD_DIR=os.path.dirname(workdir),
+                       CLUSTER_MODULES_CACHE_DIR=os.path.dirname(workdir),
+                       FAKE_PCMK_NODES="benchnode1 benchnode2",
+                       FAKE_PCMK_OS_VERSION=os_version,
+                       FAKE_PCMK_LOG=log_path)
+    command = [sys.executable, os.path.join(BENCH_DIR, "run_module.py"),
+               os.path.join(REPO, "library", module_name + ".py"), args_path, counters_path, workdir]
+    start = time.time()
+    process = subprocess.run(command, cwd=workdir, env=environment, capture_output=True, text=True)
+    wall_time = time.time() - start
+
+    with open(counters_path) as counters_file:
+        counters = json.load(counters_file)
+    tools = []
+    if os.path.isfile(log_path):
+        with open(log_path) as log_file:
+            tools = [json.loads(line) for line in log_file]
+    try:
+        output = json.loads(process.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        output = dict(failed=True, msg=process.stderr.strip()[-500:])
+
+    return dict(spawns=counters["spawns"],
+                cib_read=counters["cib_read"] + sum(tool["cib_read"] for tool in tools),
+                cib_written=counters["cib_written"] + sum(tool["cib_written"] for tool in tools),
+                wall_time=round(wall_time, 4),
+                changed=output.get("changed"),
+                failed=bool(output.get("failed")) or process.returncode != 0,
+                msg=output.get("msg", ""),
+                commands=counters["commands"])
+
+# Returns the reasons a measurement regressed past its baseline; wall_time only counts with check_time
+def regressions(measured, baseline, check_time=False):
+    reasons = []
+    if measured["spawns"] > baseline["spawns"]:
+        reasons.append("spawns %d > %d" % (measured["spawns"], baseline["spawns"]))
+    for counter in ("cib_read", "cib_written"):
+        if measured[counter] > baseline[counter] * (1 + BYTES_TOLERANCE):
+            reasons.append("%s %d > %d" % (counter, measured[counter], baseline[counter]))
+    if check_time and measured["wall_time"] > baseline["wall_time"] * (1 + TIME_TOLERANCE) + TIME_SLACK:
+        reasons.append("wall_time %.3fs > %.3fs" % (measured["wall_time"], baseline["wall_time"]))
+    return reasons
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cluster modules against the simulator")
+    parser.add_argument("--module", action="append", help="only run this module (repeatable)")
+    parser.add_argument("--primitives", type=int, default=100, help="extra primitives to pad the fixture CIB with")
+    parser.add_argument("--os-family", default="RedHat", choices=["RedHat", "Suse"])
+    parser.add_argument("--os-version", default="8")
+    parser.add_argument("--check-time", action="store_true", help="also compare wall_time with the baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="record the results as the new baseline")
+    parser.add_argument("--reason", help="why the baseline changes, required with --update-baseline")
+    parser.add_argument("--json", help="also write the results to this file")
+    options = parser.parse_args()
+    if options.update_baseline and not options.reason:
+        parser.error("--update-baseline requires a --reason")
+
+    with open(SCENARIOS_PATH) as scenarios_file:
+        scenarios = json.load(scenarios_file)
+    baseline = {}
+    if os.path.isfile(BASELINE_PATH):
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)
+    profile = "%s%s-%d" % (options.os_family, options.os_version, options.primitives)
+    profile_baseline = baseline.get(profile, {})
+
+    results = {}
+    failures = []
+    print("%-20s %-9s %7s %10s %11s %9s  %s" % ("module", "step", "spawns", "cib_read", "cib_written", "wall_time", "status"))
+    for module_name in sorted(scenarios):
+        if options.module and module_name not in options.module:
+            continue
+        root = tempfile.mkdtemp(prefix="bench-")
+        workdir = os.path.join(root, "cib")
+        os.mkdir(workdir)
+        try:
+            write_fixture(os.path.join(workdir, "cib.xml"), options.primitives)
+            for scenario in scenarios[module_name]:
+                key = "%s/%s" % (module_name, scenario["step"])
+                args = dict(scenario["args"], **scenario.get("os_args", {}).get(options.os_family, {}))
+                measured = run_step(module_name, args, workdir, options.os_family, options.os_version)
+                results[key] = measured
+                status = "ok"
+                if measured["failed"]:
+                    status = "FAILED: " + str(measured["msg"])
+                    failures.append(key)
+                elif key in profile_baseline and not options.update_baseline:
+                    reasons = regressions(measured, profile_baseline[key], options.check_time)
+                    if reasons:
+                        status = "REGRESSED: " + ", ".join(reasons)
+                        failures.append(key)
+                print("%-20s %-9s %7d %10d %11d %9.3f  %s" % (module_name, scenario["step"], measured["spawns"],
+                      measured["cib_read"], measured["cib_written"], measured["wall_time"], status))
+        finally:
+            shutil.rmtree(root)
+
+    if options.json:
+        with open(options.json, "w") as json_file:
+            json.dump(results, json_file, indent=4, sort_keys=True)
+    if options.update_baseline:
+        changed = []
+        for key, value in sorted(results.items()):
+            if value["failed"]:
+                continue
+            previous = profile_baseline.get(key)
+            recorded = dict((counter, value[counter]) for counter in COUNTERS)
+            recorded["wall_time"] = value["wall_time"] if options.check_time or previous is None else previous["wall_time"]
+            if recorded != previous:
+                changed.append(key)
+                profile_baseline[key] = recorded
+        baseline[profile] = profile_baseline
+        if changed:
+            baseline.setdefault("history", []).append(dict(profile=profile, reason=options.reason, steps=changed,
+                                                           wall_time_recorded=options.check_time))
+        with open(BASELINE_PATH, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+            baseline_file.write("\n")
+        print("Baseline %s updated in %s" % (profile, BASELINE_PATH))
+    if failures:
+        print("%d step(s) failed or regressed: %s" % (len(failures), " ".join(failures)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# ==== Runs one module under instrumentation for the benchmark harness ====
+#
+# usage: python run_module.py <module.py> <args.json> <counters.json> <cib_dir>
+#
+# Runs the module the way Ansible does (arguments from a JSON file) and records, in the
+# counters file, every command it runs, the processes those commands spawn and the bytes
+# of CIB files under <cib_dir> it reads and writes directly.
+
+import atexit
+import builtins
+import json
+import os
+import runpy
+import sys
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import ansible.module_utils
+ansible.module_utils.__path__.append(os.path.join(repo, "module_utils"))
+from ansible.module_utils.basic import AnsibleModule
+
+module_path, args_path, counters_path, cib_dir = sys.argv[1:5]
+cib_dir = os.path.realpath(cib_dir)
+counters = dict(commands=[], spawns=0, cib_read=0, cib_written=0)
+
+
+# Counts the processes a command spawns: one per pipeline stage, plus the shell itself
+def count_spawns(args, use_unsafe_shell):
+    if use_unsafe_shell and not isinstance(args, list):
+        return args.count("|") + 2
+    return 1
+
+original_run_command = AnsibleModule.run_command
+
+def run_command(self, args, *positional, **keywords):
+    counters["commands"].append(args if isinstance(args, str) else " ".join(args))
+    counters["spawns"] += count_spawns(args, keywords.get("use_unsafe_shell", False))
+    return original_run_command(self, args, *positional, **keywords)
+
+AnsibleModule.run_command = run_command
+
+
+# Wraps an open CIB file so the bytes actually read from or written to it are counted
+class CountingFile:
+
+    def __init__(self, wrapped, counter):
+        self.wrapped = wrapped
+        self.counter = counter
+
+    def _count(self, data):
+        counters[self.counter] += len(data)
+        return data
+
+    def read(self, *args):
+        return self._count(self.wrapped.read(*args))
+
+    def readline(self, *args):
+        return self._count(self.wrapped.readline(*args))
+
+    def readlines(self, *args):
+        return [self._count(line) for line in self.wrapped.readlines(*args)]
+
+    def write(self, data):
+        self._count(data)
+        return self.wrapped.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.wrapped.__exit__(*exc_info)
+
+    def __iter__(self):
+        return (self._count(line) for line in self.wrapped)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+original_open = builtins.open
+
+def counting_open(file, mode="r", *positional, **keywords):
+    handle = original_open(file, mode, *positional, **keywords)
+    if isinstance(file, (str, bytes, os.PathLike)) and os.path.realpath(file).startswith(cib_dir + os.sep):
+        return CountingFile(handle, "cib_read" if "r" in mode and "+" not in mode else "cib_written")
+    return handle
+
+builtins.open = counting_open
+
+
+def write_counters():
+    with original_open(counters_path, "w") as counters_file:
+        json.dump(counters, counters_file)
+
+atexit.register(write_counters)
+
+sys.argv = [module_path, args_path]
+runpy.run_path(module_path, run_name="__main__")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# ==== Microbenchmark of read-only CIB lookups: ElementTree XPath, CibSnapshot and lxml compiled XPath ====
+#
+# usage: python benchmarks/xpath_benchmark.py [--elements N] [--lookups N] [--repeat N]
+#
+# Writes a CIB of about N elements (primitives with their attribute sets, and one order and one colocation
+# constraint per four primitives, as the fixture plus padding of run_benchmarks.py) and measures, for each way
+# of answering lookups, the time to read the file and make the given number of constraint and id lookups:
+#   etree        ET.parse and a findall with the values formatted into the XPath, as the modules once did
+#   snapshot     CibSnapshot.from_file, which scans for its first lookup of each kind and indexes for the later
+#                ones, used by the modules without lxml
+#   lxml         CibQuery.from_file and its compiled XPath with variables, used by the modules with lxml
+# Each figure is the best of --repeat runs. Requires ansible; the lxml row is skipped without lxml.
+#
+# The default of one lookup of each kind is what cluster_order and cluster_colocation make per run, and there
+# lxml wins by parsing faster, while CibSnapshot, building no index for a single lookup, keeps up with etree.
+# Each lxml lookup scans the tree, so with many lookups per run (--lookups 10) the indexes of CibSnapshot, built
+# once, win instead; that is why the patch planning, which looks up every element it changes, keeps using CibSnapshot.
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+BENCH_DIR       = os.path.dirname(os.path.abspath(__file__))
+REPO            = os.path.dirname(BENCH_DIR)
+FIXTURE_PATH    = os.path.join(BENCH_DIR, "fixtures", "cib.xml")
+
+import ansible.module_utils
+ansible.module_utils.__path__.append(os.path.join(REPO, "module_utils"))
+from ansible.module_utils.cib_snapshot import CibSnapshot
+from ansible.module_utils.cib_query import CibQuery, HAS_LXML
+
+# Elements added to the CIB per padding primitive: the primitive, its attribute set and nvpair, and half an order
+# and half a colocation constraint
+ELEMENTS_PER_PRIMITIVE = 4
+
+
+# Writes the fixture CIB, padded to about the given number of elements, to path
+# Returns the names of the padding primitives
+def write_cib(path, elements):
+    tree = ET.parse(FIXTURE_PATH)
+    resources = tree.getroot().find("configuration/resources")
+    constraints = tree.getroot().find("configuration/constraints")
+    names = ["bench_pad%d" % index for index in range(max(2, elements // ELEMENTS_PER_PRIMITIVE))]
+    for name in names:
+        primitive = ET.SubElement(resources, "primitive", id=name, provider="heartbeat", type="Dummy")
+        primitive.set("class", "ocf")
+        instance = ET.SubElement(primitive, "instance_attributes", id=name + "-instance_attributes")
+        ET.SubElement(instance, "nvpair", id=name + "-instance_attributes-state", name="state", value="/run/%s.state" % name)
+    for first, then in zip(names[0::2], names[1::2]):
+        ET.SubElement(constraints, "rsc_order", {"id": "order-%s-%s" % (first, then), "first": first, "then": then,
+                                                 "first-action": "start", "then-action": "start"})
+        ET.SubElement(constraints, "rsc_colocation", {"id": "colocation-%s-%s" % (then, first), "rsc": then,
+                                                      "with-rsc": first, "score": "INFINITY"})
+    tree.write(path)
+    return names
+
+# Returns the (first, then) pairs and ids looked up: the last constraints and primitives, so a scan reads everything
+def lookup_values(names, lookups):
+    pairs = list(zip(names[0::2], names[1::2]))[-lookups:]
+    return pairs, names[-lookups:]
+
+def lookups_etree(path, pairs, ids):
+    root = ET.parse(path).getroot()
+    for first, then in pairs:
+        root.findall(".//rsc_order[@first='%s'][@then='%s']" % (first, then))
+        root.findall(".//rsc_colocation[@rsc='%s'][@with-rsc='%s']" % (then, first))
+    for element_id in ids:
+        root.find(".//primitive[@id='%s']" % element_id)
+
+def lookups_snapshot(path, pairs, ids):
+    snapshot = CibSnapshot.from_file(path)
+    for first, then in pairs:
+        snapshot.get_orders(first, then)
+        snapshot.get_colocations(then, first)
+    for element_id in ids:
+        snapshot.get(element_id, "primitive")
+
+def lookups_lxml(path, pairs, ids):
+    query = CibQuery.from_file(path)
+    for first, then in pairs:
+        query.get_orders(first, then)
+        query.get_colocations(then, first)
+    for element_id in ids:
+        query.get(element_id, "primitive")
+
+# Returns the best wall time of each method over repeated runs, in seconds, as a list in the order of the methods
+# The methods take turns, so load that comes and goes affects them alike; the garbage collector is off, as with timeit
+def best_times(methods, repeat, *args):
+    times = [[] for _ in methods]
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for index, (name, function) in enumerate(methods):
+                start = time.perf_counter()
+                function(*args)
+                times[index].append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return [min(method_times) for method_times in times]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark of read-only CIB lookups")
+    parser.add_argument("--elements", type=int, default=10000, help="approximate number of elements in the CIB")
+    parser.add_argument("--lookups", type=int, default=1, help="constraint pairs and ids looked up per run")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per method, the best of which is reported")
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="xpath_bench.") as workdir:
+        path = os.path.join(workdir, "cib.xml")
+        names = write_cib(path, options.elements)
+        pairs, ids = lookup_values(names, options.lookups)
+        count = sum(1 for _ in ET.parse(path).getroot().iter())
+        print("CIB of %d elements, %d bytes; %d order, %d colocation and %d id lookups per run"
+              % (count, os.path.getsize(path), len(pairs), len(pairs), len(ids)))
+
+        methods = [("etree", lookups_etree), ("snapshot", lookups_snapshot)]
+        if HAS_LXML:
+            methods.append(("lxml", lookups_lxml))
+        times = best_times(methods, options.repeat, path, pairs, ids)
+        print("%-10s %10s %8s" % ("method", "time_ms", "speedup"))
+        for (name, function), elapsed in zip(methods, times):
+            print("%-10s %10.1f %7.1fx" % (name, elapsed * 1000, times[0] / elapsed))
+        if not HAS_LXML:
+            print("lxml is not installed: skipped the lxml lookups")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, William Sheehan <willksheehan@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cluster_apply
+
+short_description: reconciles the whole cluster configuration with one desired-state document
+
+version_added: "1.0"
+
+description:
+    - brings cluster properties, resource and operation defaults, resources (primitives, groups and clones) and constraints to a declared desired state
+    - the desired state is read with one CIB query and every change is applied as one CIB patch, which the cluster validates and applies as a whole or not at all
+    - declared resources are made exactly as declared; existing elements and their ids are kept where they do not change
+    - declared properties and defaults are set; other properties and defaults are left alone
+    - constraints are matched to existing ones by their resources, actions, roles and node, as with cluster_constraints
+    - for RHEL or SUSE operating systems
+
+options:
+    config:
+        description:
+            - the desired state as a dictionary with any of the following keys
+            - "properties: a dictionary of cluster property names and values, kept in the cib-bootstrap-options set"
+            - "rsc_defaults / op_defaults: dictionaries of resource / operation default names and values, kept in the first defaults set without a rule"
+            - "resources: a list of resources, each a dictionary with a kind of primitive (the default), group or clone"
+            - "primitive: id, type, class (ocf), provider (heartbeat for ocf), description, instance_attributes, meta_attributes and operations, a list of dictionaries with a name, an interval (0s) and other op attributes such as timeout"
+            - "group: id, resources (a list of primitives, in start order) and meta_attributes"
+            - "clone: resource (a primitive or group), id (<resource>-clone), promotable (false) and meta_attributes"
+            - "constraints: a list of constraints, declared as for the cluster_constraints module"
+            - a null property or default value unsets it
+        required: false
+        type: dict
+    xml:
+        description:
+            - the desired state as a CIB configuration fragment, a <cib>, a <configuration> or a single section of one
+            - supported sections are crm_config, rsc_defaults, op_defaults, resources and constraints
+            - attribute sets are matched by id and get the listed nvpairs set; a set that does not exist is created with its rule
+            - constraints built from resource sets or rules are not supported
+            - can be combined with config
+        required: false
+        type: str
+    purge:
+        description:
+            - if true, every top-level resource and every order, colocation and location constraint that is not declared is removed
+            - constraints that cannot be declared (built from resource sets or rules, or matching resources by pattern) are kept, unless they reference a removed resource
+            - if false, undeclared resources are kept, at the top level if they were members of a declared group or clone
+        required: false
+        default: false
+        type: bool
+    verify:
+        description:
+            - "memo" skips the run when the same parameters already converged at the current CIB version, with one cibadmin query of the CIB version and without starting pcs or crm
+            - "full" always checks the cluster configuration
+        required: false
+        choices: ["memo", "full"]
+        default: "memo"
+        type: str
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
+
+author:
+    - William Sheehan (@wksheehan)
+'''
+
+EXAMPLES = r'''
+- name: Converge the whole cluster configuration in one CIB update
+  cluster_apply:
+    config:
+      properties:
+        stonith-timeout: 900
+        concurrent-fencing: true
+      rsc_defaults:
+        resource-stickiness: 1000
+        migration-threshold: 5000
+      op_defaults:
+        timeout: 600
+      resources:
+        - kind: group
+          id: g_ip_HA1
+          resources:
+            - id: rsc_ip_HA1
+              type: IPaddr2
+              instance_attributes:
+                ip: 10.0.0.10
+              operations:
+                - name: monitor
+                  interval: 10s
+                  timeout: 20s
+        - kind: clone
+          promotable: true
+          meta_attributes:
+            notify: true
+          resource:
+            id: rsc_SAPHana_HA1
+            provider: suse
+            type: SAPHana
+            instance_attributes:
+              SID: HA1
+              InstanceNumber: "00"
+      constraints:
+        - type: colocation
+          source_resource: g_ip_HA1
+          target_resource: rsc_SAPHana_HA1-clone
+          target_role: Promoted
+          score: 4000
+
+- name: Converge the resources and constraints of an exported CIB fragment, removing everything else
+  cluster_apply:
+    xml: "{{ lookup('file', 'cluster-configuration.xml') }}"
+    purge: true
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.helper_functions import get_os_name_and_version, start_trace
+from ansible.module_utils.converge_memo import skip_if_converged, record_if_converged, VERIFY_CHOICES
+from ansible.module_utils.cib_patch import update_cib
+from ansible.module_utils.cib_apply import empty_desired_state, read_dict_document, read_xml_document, plan_desired_state
+from distutils.spawn import find_executable
+
+
+def run_module():
+
+    # ==== SETUP ====
+
+    module_args = dict(
+        config=dict(required=False, type="dict"),
+        xml=dict(required=False),
+        purge=dict(required=False, type="bool", default=False),
+        verify=dict(required=False, default="memo", choices=VERIFY_CHOICES),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = dict(
+        changed=False,
+        message=""
+    )
+
+    start_trace(module, result)
+    os, version = get_os_name_and_version(module, result)
+    config      = module.params["config"]
+    xml         = module.params["xml"]
+    purge       = module.params["purge"]
+
+
+    # ==== SET ID DICTIONARY ====
+
+    # Ids pcs and crm give the defaults set they create when none exists, by defaults section
+    set_ids                                         = {}
+    set_ids["RedHat"]                               = {}
+    set_ids["Suse"  ]                               = {}
+    set_ids["RedHat"]["rsc_defaults"]               = "rsc_defaults-options" if version == "7" else "rsc_defaults-meta_attributes"
+    set_ids["Suse"  ]["rsc_defaults"]               = "rsc-options"
+    set_ids["RedHat"]["op_defaults" ]               = "op_defaults-options" if version == "7" else "op_defaults-meta_attributes"
+    set_ids["Suse"  ]["op_defaults" ]               = "op-options"
+
+    # Promotable clones are <master> elements on RHEL 7, whose pacemaker has no promotable meta attribute
+    master = os == "RedHat" and version == "7"
+
+
+    # Nothing to do if these parameters already converged at the current CIB version
+    skip_if_converged(module, result, "cluster_apply")
+
+
+    # ==== INITIAL CHECKS ====
+
+    if find_executable("cibadmin") is None:
+        module.fail_json(msg="'cibadmin' executable not found. Install 'pacemaker-cli'.")
+    if config is None and xml is None:
+        module.fail_json(msg="one of config or xml must be supplied")
+
+    desired = empty_desired_state()
+    try:
+        if xml is not None:
+            read_xml_document(desired, xml)
+        if config is not None:
+            read_dict_document(desired, config, master)
+    except ValueError as error:
+        module.fail_json(msg=str(error), **result)
+
+
+    # ==== FUNCTIONS ====
+
+    # Adds every change bringing the configuration to the desired state to the patch
+    def plan_changes(snapshot, patch):
+        try:
+            plan_desired_state(snapshot, patch, desired, set_ids[os], purge)
+        except ValueError as error:
+            module.fail_json(msg=str(error), **result)
+
+
+    # ==== MAIN CODE ====
+
+    patch, rc, out, err = update_cib(module, plan_changes)
+    if patch is None:
+        module.fail_json(msg="Cluster is not running on current node!", **result)
+    result["changes"] = patch.details
+    if rc != 0:
+        result["stdout"] = out
+        result["error_message"] = err
+        module.fail_json(msg="Failed to apply the desired state to the cluster configuration", **result)
+    if patch.details:
+        result["changed"] = True
+        result["message"] += "Successfully applied %d changes to the cluster configuration in one CIB update. " % len(patch.details)
+    else:
+        result["message"] += "No changes needed: cluster configuration already in the desired state. "
+
+    # Success
+    record_if_converged(module, result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
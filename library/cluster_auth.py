@@ -14,7 +14,11 @@ short_description: authenticates nodes that will constitute a cluster
 
 version_added: "1.0"
 
-description: authenticates the user on one or more nodes to be used in a cluster on RHEL operating system 
+description:
+    - authenticates the user on one or more nodes to be used in a cluster on RHEL operating system
+    - nodes that already hold a token in the local pcsd token store are left alone, only the missing nodes are authenticated
+    - with verify_tokens, tokens in the store are checked with pcsd first, so nodes that no longer accept theirs are authenticated again
+    - before authenticating, the missing nodes are checked for a reachable pcsd concurrently
 
 options:
     state:
@@ -43,6 +47,51 @@ options:
             - required when state is present
         required: false
         type: str
+    check_reachable:
+        description:
+            - if true, checks that pcsd is reachable on every node to authenticate before running pcs, failing early otherwise
+            - nodes already in the token store are checked at the address and port recorded there
+        required: false
+        default: true
+        type: bool
+    verify_tokens:
+        description:
+            - if true, asks pcsd whether the tokens in the local token store are still accepted before trusting them, with one pcs command over the network
+            - if false, any node holding a token counts as authenticated, so a run where all nodes are known starts no process
+        required: false
+        default: false
+        type: bool
+    connect_timeout:
+        description:
+            - the number of seconds to wait for each node's pcsd to accept a connection
+        required: false
+        default: 5
+        type: int
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
 
 author:
     - William Sheehan (@wksheehan)
@@ -54,12 +103,21 @@ EXAMPLES = r'''
     nodes: node1 node2
     username: hacluster
     password: testpass
+
+- name: Authenticate again the nodes whose stored token pcsd no longer accepts, e.g. after pcsd was reinstalled
+  cluster_auth:
+    nodes: node1 node2
+    password: testpass
+    verify_tokens: true
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command
+from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command, run_command, start_trace
+from ansible.module_utils.node_fanout import fan_out, check_reachable, PCSD_PORT
+from ansible.module_utils.pcsd_tokens import read_known_hosts, parse_pcsd_status
 from distutils.spawn import find_executable
 
+
 def run_module():
 
     # ==== SETUP ====
@@ -68,7 +126,14 @@ def run_module():
         state=dict(required=False, default="present", choices=["present", "absent"]),
         nodes=dict(required=True),
         username=dict(required=False, default="hacluster"),
-        password=dict(required=False, no_log=True)
+        password=dict(required=False, no_log=True),
+        check_reachable=dict(required=False, type="bool", default=True),
+        verify_tokens=dict(required=False, type="bool", default=False),
+        connect_timeout=dict(required=False, type="int", default=5),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
     )
 
     module = AnsibleModule(
@@ -81,11 +146,20 @@ def run_module():
         message=""
     )
 
+    start_trace(module, result)
     os, version = get_os_name_and_version(module, result)
     state       = module.params["state"]
     nodes       = module.params["nodes"]
     username    = module.params["username"]
     password    = module.params["password"]
+    reachable   = module.params["check_reachable"]
+    timeout     = module.params["connect_timeout"]
+    verify      = module.params["verify_tokens"]
+
+    node_list   = nodes.split()
+    known_hosts = read_known_hosts(version)
+    missing     = [node for node in node_list if node not in known_hosts]
+    known       = [node for node in node_list if node in known_hosts]
 
 
     # ==== INITIAL CHECKS ====
@@ -94,43 +168,63 @@ def run_module():
         module.fail_json(msg="'pcs' executable not found. Install 'pcs'.")
     if state == "present" and password is None:
         module.fail_json(msg="Must specify password when state is present", **result)
+    # A token in the store may no longer be accepted, e.g. after pcsd was reinstalled on the node: authenticate those again
+    if state == "present" and verify and len(known) > 0:
+        rc, out, err = run_command(module, "pcs cluster pcsd-status %s" % " ".join(known))
+        stale = parse_pcsd_status(out, known) if rc != 0 else []
+        if stale:
+            result["stale_tokens"] = stale
+            missing = [node for node in node_list if node in stale or node not in known_hosts]
+            known   = [node for node in known if node not in stale]
     
 
     # ==== COMMAND DICTIONARY ==== 
 
     commands                                        = {}
     commands["RedHat"]                              = {}
-    commands["RedHat"]["status"]                    = "pcs cluster pcsd-status %s" % nodes
     commands["RedHat"]["7"]                         = {}
     commands["RedHat"]["8"]                         = {}
-    commands["RedHat"]["7"]["authenticate"]         = "pcs cluster auth %s -u %s -p %s" % (nodes, username, password)
-    commands["RedHat"]["8"]["authenticate"]         = "pcs host auth %s -u %s -p %s" % (nodes, username, password)
-    commands["RedHat"]["7"]["deauthenticate"]       = "pcs cluster deauth %s" % nodes
-    commands["RedHat"]["8"]["deauthenticate"]       = "pcs host deauth %s" % nodes
-    
+    commands["RedHat"]["7"]["authenticate"]         = "pcs cluster auth %s -u %s -p %s" % (" ".join(missing), username, password)
+    commands["RedHat"]["8"]["authenticate"]         = "pcs host auth %s -u %s -p %s" % (" ".join(missing), username, password)
+    commands["RedHat"]["7"]["deauthenticate"]       = "pcs cluster deauth %s" % " ".join(known)
+    commands["RedHat"]["8"]["deauthenticate"]       = "pcs host deauth %s" % " ".join(known)
 
-    # ==== MAIN CODE ====
 
-    rc, out, err = module.run_command(commands[os]["status"])
-    nodes_online = rc == 0
+    # ==== FUNCTIONS ====
+
+    # Fails unless pcsd accepts connections on every node, checking the nodes concurrently
+    # Nodes in the token store are checked at the address and port pcs would use for them
+    def check_nodes_reachable(nodes_to_check):
+        errors = fan_out(nodes_to_check, lambda node: check_reachable(*known_hosts.get(node, (node, PCSD_PORT)), timeout=timeout))
+        unreachable = dict((node, error) for node, error in errors.items() if error is not None)
+        if unreachable:
+            result["unreachable"] = unreachable
+            module.fail_json(msg="pcsd is not reachable on %s" % ", ".join(sorted(unreachable)), **result)
+
+
+    # ==== MAIN CODE ====
 
     if state == "present":
-        if nodes_online:
+        if len(missing) == 0:
             result["message"] = "Nodes %s are all authenticated" % nodes
         else:
+            if reachable and not module.check_mode:
+                check_nodes_reachable(missing)
             result["changed"] = True
+            result["authenticated"] = missing
             if not module.check_mode:
                 cmd = commands[os][version]["authenticate"]
                 execute_command(module, result, cmd, 
-                            "Nodes were successfully authenticated", 
+                            "Nodes %s were successfully authenticated" % " ".join(missing), 
                             "Failed to authenticate one or more nodes")
     if state == "absent":
-        if nodes_online:    
+        if len(known) > 0:
             result["changed"] = True
+            result["deauthenticated"] = known
             if not module.check_mode:
                 cmd = commands[os][version]["deauthenticate"]
                 execute_command(module, result, cmd, 
-                            "Nodes were successfully deauthenticated", 
+                            "Nodes %s were successfully deauthenticated" % " ".join(known), 
                             "Failed to deauthenticate one or more nodes")
         else:
             result["message"] = "Nodes %s are already unauthenticated" % nodes
@@ -50,6 +50,60 @@ options:
             - the clone options
         required: false
         type: str
+    backend:
+        description:
+            - "cli" creates and renders the clone with pcs or crm
+            - "native" builds the clone pcs or crm would create in-process and applies it with cibadmin, without starting pcs or crm
+            - clones of resources inside a group, or with options the native backend cannot build, are created with pcs or crm; clones are always removed with them
+        required: false
+        choices: ["cli", "native"]
+        default: "cli"
+        type: str
+    verify:
+        description:
+            - "memo" skips the run when the same parameters already converged at the current CIB version, with one cibadmin query of the CIB version and without starting pcs or crm
+            - "full" always checks the cluster configuration
+        required: false
+        choices: ["memo", "full"]
+        default: "memo"
+        type: str
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    cib_cache:
+        description:
+            - if true, looks up the resource and the existing clone through the local CIB cache daemon, starting it if needed
+            - the daemon keeps the parsed CIB in memory between module runs; direct reads are used when it cannot be reached
+            - can also be enabled with the CLUSTER_CIB_CACHE environment variable
+        required: false
+        default: false
+        type: bool
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
+
+notes:
+    - the resource and the existing clone are looked up with lxml and compiled XPath when lxml is installed on the managed node, unless backend is native (or, for properties, in bulk mode), which plans a CIB patch on ElementTree elements
+
 author:
     - William Sheehan (@wksheehan)
 '''
@@ -64,12 +118,14 @@ EXAMPLES = r'''
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command
+from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command, cluster_running, start_trace
+from ansible.module_utils.converge_memo import skip_if_converged, record_if_converged, VERIFY_CHOICES
+from ansible.module_utils.cib_diff import diff_elements, RESOURCE_TAGS
+from ansible.module_utils.cib_patch import query_cib, update_cib
+from ansible.module_utils.cib_cache import get_cib_lookup
+from ansible.module_utils.cib_shadow import ShadowWorkspace
+from ansible.module_utils.cib_native import build_clone, id_in_use, BACKEND_CHOICES, CLONE_TAGS
 from distutils.spawn import find_executable
-import xml.etree.ElementTree as ET
-import uuid
-import os as OS
-import tempfile
 
 
 def run_module():
@@ -81,7 +137,14 @@ def run_module():
         clone_name=dict(required=False),
         resource_name=dict(required=True),
         clone_type=dict(required=False, default="clone", choices=["clone", "promotable"]),
-        options=dict(required=False, default="")
+        options=dict(required=False, default=""),
+        backend=dict(required=False, default="cli", choices=BACKEND_CHOICES),
+        verify=dict(required=False, default="memo", choices=VERIFY_CHOICES),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        cib_cache=dict(required=False, type="bool", default=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
     )
 
     module = AnsibleModule(
@@ -94,15 +157,14 @@ def run_module():
         message=""
     )
 
+    start_trace(module, result)
     os, version         = get_os_name_and_version(module, result)
     state               = module.params["state"]
     clone_name          = module.params["clone_name"]
     resource_name       = module.params["resource_name"]
     clone_type          = module.params["clone_type"]
     options             = module.params["options"]
-
-    curr_cib_path       = "/var/lib/pacemaker/cib/cib.xml"
-    new_cib_name        = "shadow-cib" + str(uuid.uuid4())
+    backend             = module.params["backend"]
 
     if clone_name is None:
         clone_name = resource_name + "-clone"
@@ -113,42 +175,27 @@ def run_module():
     commands                                                    = {}
     commands["RedHat"]                                          = {}
     commands["Suse"  ]                                          = {}
-    commands["RedHat"]["status"]                                = "pcs status"
-    commands["Suse"  ]["status"]                                = "crm status"
-
-    commands["RedHat"]["cib"]                                   = {}
-    commands["Suse"  ]["cib"]                                   = {}
-    commands["RedHat"]["cib"]["create"]                         = f"pcs cluster cib {new_cib_name}"
-    commands["Suse"  ]["cib"]["create"]                         = f"crm cib new {new_cib_name}"
-    commands["RedHat"]["cib"]["push"]                           = f"pcs cluster cib-push --config {new_cib_name}"
-    commands["Suse"  ]["cib"]["push"]                           = f"crm cib commit {new_cib_name}"
-    commands["RedHat"]["cib"]["delete"]                         = f"rm -f {new_cib_name}"
-    commands["Suse"  ]["cib"]["delete"]                         = f"crm cib delete {new_cib_name}"
-    
+
     commands["RedHat"]["clone"]                                 = {}
     commands["Suse"  ]["clone"]                                 = {}
     commands["RedHat"]["clone"]["delete"]                       = f"pcs resource unclone {resource_name}"
     commands["Suse"  ]["clone"]["delete"]                       = f"crm configure delete --force {clone_name}"
-    commands["RedHat"]["clone"]["shadow_delete"]                = f"pcs -f {new_cib_name} resource unclone {resource_name}"
-    commands["Suse"  ]["clone"]["shadow_delete"]                = f"crm -F -c {new_cib_name} configure delete --force {clone_name}"
+    commands["RedHat"]["clone"]["shadow_delete"]                = f"resource unclone {resource_name}"              # run against the shadow
+    commands["Suse"  ]["clone"]["shadow_delete"]                = f"configure delete --force {clone_name}"         # run against the shadow
 
     
     commands["RedHat"]["7"  ]                                   = {}
     commands["RedHat"]["8"  ]                                   = {}
     commands["Suse"  ]["all"]                                   = {}
-    commands["RedHat"]["7"  ]["read"]                           = "pcs resource show %s"    # % resource_name or clone_name
-    commands["RedHat"]["8"  ]["read"]                           = "pcs resource config %s"  # % resource_name or clone_name
-    commands["Suse"  ]["all"]["read"]                           = "crm config show %s"      # % resource_name or clone_name
-
     commands["RedHat"]["7"  ]["clone"]                          = {}
     commands["RedHat"]["8"  ]["clone"]                          = {}
     commands["Suse"  ]["all"]["clone"]                          = {}
     commands["RedHat"]["7"  ]["clone"]["create"]                = f"pcs resource clone {resource_name} {options}"
     commands["RedHat"]["8"  ]["clone"]["create"]                = f"pcs resource clone {resource_name} {options}"
     commands["Suse"  ]["all"]["clone"]["create"]                = f"crm configure clone {clone_name} {resource_name} meta {options}"
-    commands["RedHat"]["7"  ]["clone"]["shadow_create"]         = f"pcs -f {new_cib_name} resource clone {resource_name} {options}"
-    commands["RedHat"]["8"  ]["clone"]["shadow_create"]         = f"pcs -f {new_cib_name} resource clone {resource_name} {options}"
-    commands["Suse"  ]["all"]["clone"]["shadow_create"]         = f"crm -F -c {new_cib_name} configure clone {clone_name} {resource_name} meta {options}"
+    commands["RedHat"]["7"  ]["clone"]["shadow_create"]         = f"resource clone {resource_name} {options}"
+    commands["RedHat"]["8"  ]["clone"]["shadow_create"]         = f"resource clone {resource_name} {options}"
+    commands["Suse"  ]["all"]["clone"]["shadow_create"]         = f"configure clone {clone_name} {resource_name} meta {options}"
     
     commands["RedHat"]["7"  ]["promotable"]                     = {}
     commands["RedHat"]["8"  ]["promotable"]                     = {}
@@ -156,34 +203,42 @@ def run_module():
     commands["RedHat"]["7"  ]["promotable"]["create"]           = f"pcs resource master {clone_name} {resource_name} {options}"
     commands["RedHat"]["8"  ]["promotable"]["create"]           = f"pcs resource promotable {resource_name} {options}"
     commands["Suse"  ]["all"]["promotable"]["create"]           = f"crm configure clone {clone_name} {resource_name} meta promotable=true {options}"
-    commands["RedHat"]["7"  ]["promotable"]["shadow_create"]    = f"pcs -f {new_cib_name} resource master {clone_name} {resource_name} {options}"
-    commands["RedHat"]["8"  ]["promotable"]["shadow_create"]    = f"pcs -f {new_cib_name} resource promotable {resource_name} {options}"
-    commands["Suse"  ]["all"]["promotable"]["shadow_create"]    = f"crm -F -c {new_cib_name} configure clone {clone_name} {resource_name} meta promotable=true {options}"
+    commands["RedHat"]["7"  ]["promotable"]["shadow_create"]    = f"resource master {clone_name} {resource_name} {options}"
+    commands["RedHat"]["8"  ]["promotable"]["shadow_create"]    = f"resource promotable {resource_name} {options}"
+    commands["Suse"  ]["all"]["promotable"]["shadow_create"]    = f"configure clone {clone_name} {resource_name} meta promotable=true {options}"
     
 
+    # Nothing to do if these parameters already converged at the current CIB version
+    skip_if_converged(module, result, "cluster_clone")
+
+
     # ==== Initial checks ====
 
     if os == "RedHat" and find_executable("pcs") is None:
         module.fail_json(msg="'pcs' executable not found. Install 'pcs'.")
-    rc, out, err = module.run_command(commands[os]["status"])
-    if rc != 0:
+    # The native backend reads the cluster configuration once, which also makes sure we can communicate with the cluster
+    cib = query_cib(module) if backend == "native" else None
+    if cib is None and (backend == "native" or not cluster_running(module)):
         module.fail_json(msg="Cluster is not running on current node!", **result)
 
 
     # ==== Functions ====
 
+    # Returns the element of the cluster configuration with the given id if it has one of the given tags, or None
+    def lookup_element(element_id, tags):
+        lookup = cib if cib is not None else get_cib_lookup(module)
+        element = lookup.get(element_id)
+        return element if element is not None and element.tag in tags else None
+
     # Returns true if a clone with the given name exists
     def clone_exists():
-        rc, out, err = module.run_command(commands[os][version]["read"] % clone_name)
-        return rc == 0
+        return lookup_element(clone_name, CLONE_TAGS) is not None
 
     # Creates a new clone of a resource with the specified options
     def clone_resource():
         # Check that underlying resource exists
-        cmd = commands[os][version]["read"] % resource_name
-        execute_command(module, result, cmd,
-                        "",
-                        "Underlying resource to be cloned was not found")
+        if lookup_element(resource_name, RESOURCE_TAGS) is None:
+            module.fail_json(msg="Underlying resource to be cloned was not found", **result)
         result["changed"] = True
         if not module.check_mode:
             cmd = commands[os][version][clone_type]["create"]
@@ -191,6 +246,40 @@ def run_module():
                             "Successfully cloned the resource. ", 
                             "Failed to clone the resource")
     
+    # Returns the clone pcs or crm would create around the resource of the snapshot, built in-process
+    # Returns None if the native backend cannot build it, or the resource is not a top-level primitive or group
+    def build_native_clone(snapshot, top_level=True):
+        if backend != "native":
+            return None
+        resource = snapshot.get(resource_name)
+        if resource is None or resource.tag not in ("primitive", "group"):
+            return None
+        if top_level and snapshot.get_parent(resource).tag != "resources":
+            return None
+        return build_clone(os, version, resource, clone_name, clone_type, options)
+
+    # Clones the resource the way pcs or crm would in one CIB update, without running either
+    # Falls back to the tool if the native backend cannot build the clone
+    def clone_resource_native():
+        clone = build_native_clone(cib)
+        if clone is None or id_in_use(cib, clone.attrib["id"]):
+            return clone_resource()
+        def plan_clone(snapshot, patch):
+            clone = build_native_clone(snapshot)
+            if clone is None or id_in_use(snapshot, clone.attrib["id"]):
+                module.fail_json(msg="Resource %s was changed while it was being cloned" % resource_name, **result)
+            patch.delete(snapshot.get(resource_name))
+            patch.create(snapshot.root.find("configuration/resources"), clone)
+        result["changed"] = True
+        patch, rc, out, err = update_cib(module, plan_clone, cib)
+        if patch is None or rc != 0:
+            result["changed"] = False
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg="Failed to clone the resource", **result)
+        if not module.check_mode:
+            result["message"] += "Successfully cloned the resource. "
+
     # Unclones a cloned resource (does not delete the underlying resource)
     def unclone_resource():
         result["changed"] = True
@@ -201,84 +290,53 @@ def run_module():
                             "Failed to unclone the resource")
 
     # Updates an existing clone to match the configuration specified exactly
+    # The clone is built natively or recreated in a shadow copy of the live cib, and only the differences are applied to the live CIB as a patch
     def update_clone():
-        # Make sure current cib exists
-        if not OS.path.isfile(curr_cib_path):
-            module.fail_json(msg="Unable to find CIB file for existing resource", **result)
-
-        # Initialize a shadow cib file
-        cmd = commands[os]["cib"]["create"]
-        execute_command(module, result, cmd,
-                        "",
-                        "Error creating temporary (shadow) cib file before updating clone")
-        
-        # Remove the existing clone using shadow cib
-        cmd = commands[os]["clone"]["shadow_delete"]
-        execute_command(module, result, cmd,
-                        "",
-                        "Error deleting existing clone using the temporary (shadow) cib file")
-
-        # Create the desired resource using shadow cib
-        cmd = commands[os][version][clone_type]["shadow_create"]
-        execute_command(module, result, cmd,
-                        "",
-                        "Error updating the clone using the temporary (shadow) cib file")
-        
-        new_cib_path = f"/var/lib/pacemaker/cib/shadow.{new_cib_name}" if os == "Suse" else f"./{new_cib_name}"
-
-        # Get the current and new resource XML objects   
-        curr_cib        = ET.parse(curr_cib_path)
-        new_cib         = ET.parse(new_cib_path)
-        curr_clone      = curr_cib.getroot().find(f".//primitive[@id='{resource_name}']..")
-        new_clone       = new_cib.getroot().find(f".//primitive[@id='{resource_name}']..")
-
-        is_different    = compare_clones(curr_clone, new_clone)
-
-        if is_different:
+        snapshot = cib
+        new_clone = build_native_clone(cib, top_level=False)
+        native = new_clone is not None
+        if not native:
+            with ShadowWorkspace(module, os, result) as workspace:
+                snapshot = workspace.open()
+                # Remove the existing clone, then create the desired one
+                workspace.edit(commands[os]["clone"]["shadow_delete"],
+                               "Error deleting existing clone using the temporary (shadow) cib file")
+                workspace.edit(commands[os][version][clone_type]["shadow_create"],
+                               "Error updating the clone using the temporary (shadow) cib file")
+                new_clone = workspace.locate(lambda element: any(child.tag == "primitive" and child.attrib.get("id") == resource_name
+                                                                 for child in element))
+
+        # Adds the changes turning the current clone into the desired one to the patch
+        def plan_update(snapshot, patch):
+            resource = snapshot.get(resource_name, "primitive")
+            curr_clone = snapshot.get_parent(resource) if resource is not None else None
+            desired_clone = build_native_clone(snapshot, top_level=False) if native else new_clone
+            if compare_clones(curr_clone, desired_clone):
+                patch.update_element(curr_clone, desired_clone)
+
+        patch, rc, out, err = update_cib(module, plan_update, snapshot)
+        if patch is None:
+            module.fail_json(msg="Cluster is not running on current node!", **result)
+        if rc != 0:
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg="Failed to update the clone", **result)
+        if len(patch) > 0:
             result["changed"] = True
             if not module.check_mode:
-                # Update the live cluster with the shadow cib
-                cmd = commands[os]["cib"]["push"]
-                rc, out, err = module.run_command(cmd)
-                if rc == 0:
-                    result["message"] += "Successfully updated the clone. "
-                else:
-                    result["changed"] = False
-                    result["stdout"] = out
-                    result["error_message"] = err
-                    result["command_used"] = cmd
-                    # Delete shadow configuration
-                    module.run_command(commands[os]["cib"]["delete"])
-                    module.fail_json(msg="Failed to update the clone", **result)
+                result["message"] += "Successfully updated the clone. "
         # No differences
         else:
             result["message"] += "No updates necessary: clone already configured as desired. "
-        
-        # Delete shadow configuration
-        rc, out, err = module.run_command(commands[os]["cib"]["delete"])
     
-    # Compare two primitive object xmls for differences
-    # Returns 1 (True) if there is a difference, 0 (False) if not
+    # Compare two clone object xmls for differences
+    # Returns True if there is a difference, False if not, and records the differences found
     def compare_clones(resource1, resource2):
         if resource1 is None or resource2 is None:
             module.fail_json(msg="Atleast one of the resource xml objects is None", **result)
-        # Write the clone xml to a file
-        r1_file_fd, r1_file_path = tempfile.mkstemp()
-        r2_file_fd, r2_file_path = tempfile.mkstemp()
-        r1_file = open(r1_file_path, 'w')
-        r2_file = open(r2_file_path, 'w')
-        r1_file.write(ET.tostring(resource1, "unicode"))
-        r2_file.write(ET.tostring(resource2, "unicode"))
-        r1_file.close()
-        r2_file.close()
-        
-        # Compare difference
-        rc, diff, err = module.run_command(f"diff -w {r1_file_path} {r2_file_path}")
-
-        # Delete temporary files
-        module.run_command(f"rm -f {r1_file_path} {r2_file_path}")
-
-        return rc
+        differences = diff_elements(resource1, resource2)
+        result["differences"] = differences
+        return len(differences) > 0
 
 
     # ==== Main code ====
@@ -286,6 +344,8 @@ def run_module():
     if state == "present":
         if clone_exists():
             update_clone()
+        elif backend == "native":
+            clone_resource_native()
         else:
             clone_resource()
     else:
@@ -295,6 +355,7 @@ def run_module():
             result["message"] += f"No changes needed: clone {clone_name} does not exist. "
 
     # Success
+    record_if_converged(module, result)
     module.exit_json(**result)
 
 
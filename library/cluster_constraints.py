@@ -0,0 +1,197 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, William Sheehan <willksheehan@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cluster_constraints
+
+short_description: reconciles the full set of order, colocation and location constraints
+
+version_added: "1.0"
+
+description:
+    - creates, modifies and deletes order, colocation and location constraints from one declared list
+    - existing constraints are read with one CIB query and all changes are applied in a single CIB update
+    - settings of an existing constraint (kind, symmetrical, score) are modified in place
+    - for RHEL or SUSE operating systems
+
+options:
+    state:
+        description:
+            - "present" ensures the declared constraints exist as declared
+            - "absent" ensures the declared constraints do not exist
+        required: false
+        choices: ["present", "absent"]
+        default: present
+        type: str
+    constraints:
+        description:
+            - the list of constraints, each a dictionary with a type of order, colocation or location
+            - "order: first_resource, second_resource, first_action (start), second_action (start), kind (Mandatory), symmetrical (true)"
+            - "colocation: source_resource, target_resource, source_role (Started), target_role (Started), score (INFINITY)"
+            - "location: resource, node, role (any), score (INFINITY)"
+            - an optional name sets the id of a new constraint, otherwise the id the cluster_order / cluster_colocation modules use is generated
+            - constraints are matched to existing ones by their resources, actions, roles and node, not by name
+        required: true
+        type: list
+    purge:
+        description:
+            - if true and state is present, every order, colocation and location constraint that is not declared is removed
+            - this includes the location constraints left behind by resource move or ban commands, unless they have a lifetime (a rule)
+            - constraints that cannot be declared are kept, i.e. ones built from resource sets, location constraints with rules and ones matching resources by pattern
+        required: false
+        default: false
+        type: bool
+    verify:
+        description:
+            - "memo" skips the run when the same parameters already converged at the current CIB version, with one cibadmin query of the CIB version and without starting pcs or crm
+            - "full" always checks the cluster configuration
+        required: false
+        choices: ["memo", "full"]
+        default: "memo"
+        type: str
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
+
+author:
+    - William Sheehan (@wksheehan)
+'''
+
+EXAMPLES = r'''
+- name: Ensure exactly these constraints exist
+  cluster_constraints:
+    state: present
+    purge: true
+    constraints:
+      - type: order
+        first_resource: rsc1
+        second_resource: rsc2
+        kind: Optional
+      - type: colocation
+        source_resource: rsc2
+        target_resource: rsc1
+        score: 1000
+      - type: location
+        resource: rsc1
+        node: node1
+        score: 100
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.helper_functions import get_os_name_and_version, start_trace
+from ansible.module_utils.converge_memo import skip_if_converged, record_if_converged, VERIFY_CHOICES
+from ansible.module_utils.cib_patch import update_cib
+from ansible.module_utils.cib_constraints import plan_constraints
+from distutils.spawn import find_executable
+
+
+def run_module():
+
+    # ==== SETUP ====
+
+    module_args = dict(
+        state=dict(required=False, default="present", choices=["present", "absent"]),
+        constraints=dict(required=True, type="list"),
+        purge=dict(required=False, type="bool", default=False),
+        verify=dict(required=False, default="memo", choices=VERIFY_CHOICES),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = dict(
+        changed=False,
+        message=""
+    )
+
+    start_trace(module, result)
+    os, version     = get_os_name_and_version(module, result)
+    state           = module.params["state"]
+    constraints     = module.params["constraints"]
+    purge           = module.params["purge"]
+
+
+    # Nothing to do if these parameters already converged at the current CIB version
+    skip_if_converged(module, result, "cluster_constraints")
+
+
+    # ==== INITIAL CHECKS ====
+
+    if find_executable("cibadmin") is None:
+        module.fail_json(msg="'cibadmin' executable not found. Install 'pacemaker-cli'.")
+    if any(not isinstance(constraint, dict) for constraint in constraints):
+        module.fail_json(msg="every entry of constraints must be a dictionary")
+
+
+    # ==== FUNCTIONS ====
+
+    # Adds the changes reconciling the constraints to the patch
+    def plan_changes(snapshot, patch):
+        try:
+            plan_constraints(snapshot, patch, constraints, state, purge)
+        except ValueError as error:
+            module.fail_json(msg=str(error), **result)
+
+
+    # ==== MAIN CODE ====
+
+    patch, rc, out, err = update_cib(module, plan_changes)
+    if patch is None:
+        module.fail_json(msg="Cluster is not running on current node!", **result)
+    result["changes"] = patch.details
+    if rc != 0:
+        result["stdout"] = out
+        result["error_message"] = err
+        module.fail_json(msg="Failed to update the cluster constraints", **result)
+    if patch.details:
+        result["changed"] = True
+        counts = dict((change, len([detail for detail in patch.details if detail["change"] == change])) for change in ("created", "modified", "removed"))
+        result["message"] += "Successfully created %(created)d, modified %(modified)d and removed %(removed)d constraints. " % counts
+    else:
+        result["message"] += "No changes needed: constraints already configured as desired. "
+
+    # Success
+    record_if_converged(module, result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
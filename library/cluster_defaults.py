@@ -16,6 +16,7 @@ version_added: "1.0"
 
 description: 
     - sets or unsets cluster resource and operation defaults
+    - reads the rsc_defaults / op_defaults meta_attributes sets straight from the CIB and applies all changes in one CIB update
     - for RHEL or SUSE operating systems 
 
 options:
@@ -30,7 +31,8 @@ options:
     name:
         description:
             - the name of the resource default to set or unset
-        required: true
+            - required unless defaults or sets is given
+        required: false
         type: str
     value:
         description:
@@ -48,12 +50,61 @@ options:
         type: str
     set_name:
         description:
-            - optional id for an attribute list the parameter and value will be added to
+            - optional id of the meta_attributes set the defaults are kept in
             - other resources can reuse this attribute list by referring to this name using $id-ref
-            - only for use with Suse operating systems
+            - if not given, the first set without a rule is used, and created with the id pcs or crm would use if there is none
+        required: false
+        type: str
+    defaults:
+        description:
+            - a dictionary of default names and values for the set chosen by defaults_type and set_name, instead of name and value
+            - a null value unsets the default; with state=absent every listed default is unset
+        required: false
+        type: dict
+    sets:
+        description:
+            - a list of named, optionally rule-based, defaults sets, each a dictionary with
+            - "set_name: the id of the meta_attributes set (required)"
+            - "defaults_type: rsc or op (defaults to the module's defaults_type)"
+            - "values: a dictionary of default names and values, a null value unsetting the default"
+            - "rule: a pacemaker <rule> element, as XML, the set applies under; ids are generated for elements without one"
+            - with state=absent the listed values are unset, or the whole set is removed if no values are given
+        required: false
+        type: list
+    verify:
+        description:
+            - "memo" skips the run when the same parameters already converged at the current CIB version, with one cibadmin query of the CIB version and without starting pcs or crm
+            - "full" always checks the cluster configuration
+        required: false
+        choices: ["memo", "full"]
+        default: "memo"
+        type: str
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
         required: false
-        default: {dtype}-options
         type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
+
 author:
     - William Sheehan (@wksheehan)
 '''
@@ -65,11 +116,28 @@ EXAMPLES = r'''
     name: resource-stickiness
     value: 100
     defaults_type: rsc
+
+- name: Set several resource and operation defaults, including a rule-based set, in one CIB update
+  cluster_defaults:
+    state: present
+    defaults:
+      resource-stickiness: 1000
+      migration-threshold: 5000
+    sets:
+      - set_name: op-monitor-defaults
+        defaults_type: op
+        values:
+          timeout: 60s
+        rule: <rule score="INFINITY"><op_expression name="monitor"/></rule>
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command
+from ansible.module_utils.helper_functions import get_os_name_and_version, start_trace
+from ansible.module_utils.converge_memo import skip_if_converged, record_if_converged, VERIFY_CHOICES
+from ansible.module_utils.cib_patch import update_cib, cib_value
+from ansible.module_utils.cib_diff import diff_elements
 from distutils.spawn import find_executable
+import xml.etree.ElementTree as ET
 
 
 def run_module():
@@ -79,10 +147,17 @@ def run_module():
     module_args = dict(
         state=dict(required=False, default="present", choices=["present", "absent"]),
         node=dict(required=False),
-        name=dict(required=True),
+        name=dict(required=False),
         value=dict(required=False),
         defaults_type=dict(required=False, default="rsc", choices=["rsc", "op"]),
-        set_name=dict(required=False)
+        set_name=dict(required=False),
+        defaults=dict(required=False, type="dict"),
+        sets=dict(required=False, type="list"),
+        verify=dict(required=False, default="memo", choices=VERIFY_CHOICES),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
     )
 
     module = AnsibleModule(
@@ -95,108 +170,197 @@ def run_module():
         message=""
     )
 
+    start_trace(module, result)
     os, version = get_os_name_and_version(module, result)
     state       = module.params["state"]
     name        = module.params["name"]
     value       = module.params["value"]
     dtype       = module.params["defaults_type"]
     set_name    = module.params["set_name"]
-    
-    if set_name is None:
-        set_name = dtype + "-options"
-    if os == "RedHat" and version == "7":
-        awk_separator = ":"
-    else:
-        awk_separator = "="
-
-
-    # ==== COMMAND DICTIONARY ====
-
-    commands                                        = {}
-    commands["RedHat"]                              = {}
-    commands["Suse"  ]                              = {}
-    commands["RedHat"]["status"]                    = "pcs status"
-    commands["Suse"  ]["status"]                    = "crm status"
-    commands["RedHat"]["rsc"]                       = {}
-    commands["Suse"  ]["rsc"]                       = {}
-    commands["RedHat"]["op"]                        = {}
-    commands["Suse"  ]["op"]                        = {}
-    commands["RedHat"]["rsc"]["set"]                = f"pcs resource defaults {name}={value}"
-    commands["Suse"  ]["rsc"]["set"]                = f"crm configure rsc_defaults \$id={set_name} {name}={value}"
-    commands["RedHat"]["op" ]["set"]                = f"pcs resource op defaults {name}={value}"
-    commands["Suse"  ]["op" ]["set"]                = f"crm configure op_defaults \$id={set_name} {name}={value}"
-    commands["RedHat"]["rsc"]["unset"]              = f"pcs resource defaults {name}="
-    commands["Suse"  ]["rsc"]["unset"]              = f"crm_attribute --type rsc_defaults --set-name {set_name} --name {name} --delete"
-    commands["RedHat"]["op" ]["unset"]              = f"pcs resource op defaults {name}="
-    commands["Suse"  ]["op" ]["unset"]              = f"crm_attribute --type op_defaults --set-name {set_name} --name {name} --delete"
-    commands["RedHat"]["rsc"]["get"]                = "pcs resource defaults | grep %s | awk -F'[%s]' '{print $2}' | tr -d '[:space:]'"  % (name, awk_separator)
-    commands["Suse"  ]["rsc"]["get"]                = f"crm_attribute --type rsc_defaults --set-name {set_name} --name {name} --query --quiet | tr -d '[:space:]'"
-    commands["RedHat"]["op" ]["get"]                = "pcs resource op defaults | grep %s | awk -F'[%s]' '{print $2}' | tr -d '[:space:]'"  % (name, awk_separator)
-    commands["Suse"  ]["op" ]["get"]                = f"crm_attribute --type op_defaults --set-name {set_name} --name {name} --query --quiet | tr -d '[:space:]'"
-    commands["RedHat"]["rsc"]["check"]              = f"pcs resource defaults | grep {name}"
-    commands["Suse"  ]["rsc"]["check"]              = f"crm_attribute --type rsc_defaults --set-name {set_name} --name {name} --query"
-    commands["RedHat"]["op" ]["check"]              = f"pcs resource op defaults | grep {name}"
-    commands["Suse"  ]["op" ]["check"]              = f"crm_attribute --type op_defaults --set-name {set_name} --name {name} --query"
+    defaults    = module.params["defaults"]
+    sets        = module.params["sets"]
+
+
+    # ==== SET ID DICTIONARY ====
+
+    # Ids pcs and crm give the defaults set they create when none exists
+    set_ids                                         = {}
+    set_ids["RedHat"]                               = {}
+    set_ids["Suse"  ]                               = {}
+    set_ids["RedHat"]["rsc"]                        = "rsc_defaults-options" if version == "7" else "rsc_defaults-meta_attributes"
+    set_ids["Suse"  ]["rsc"]                        = "rsc-options"
+    set_ids["RedHat"]["op" ]                        = "op_defaults-options" if version == "7" else "op_defaults-meta_attributes"
+    set_ids["Suse"  ]["op" ]                        = "op-options"
+
+
+    # Nothing to do if these parameters already converged at the current CIB version
+    skip_if_converged(module, result, "cluster_defaults")
 
 
     # ==== INITIAL CHECKS ====
 
-    if os == "RedHat" and find_executable("pcs") is None:
-        module.fail_json(msg="'pcs' executable not found. Install 'pcs'.")
-    if state == "present" and value is None:
+    if find_executable("cibadmin") is None:
+        module.fail_json(msg="'cibadmin' executable not found. Install 'pacemaker-cli'.")
+    if name is None and defaults is None and sets is None:
+        module.fail_json(msg="one of name, defaults or sets must be supplied")
+    if name is not None and defaults is not None:
+        module.fail_json(msg="name cannot be combined with defaults")
+    if name is not None and state == "present" and value is None:
         module.fail_json(msg="value parameter must be supplied when state is present")
-    # Make sure we can communicate with the cluster
-    rc, out, err = module.run_command(commands[os]["status"])
-    if rc != 0:
-        module.fail_json(msg="Cluster is not running on current node!", **result)
+    for entry in sets or []:
+        if not isinstance(entry, dict) or not entry.get("set_name"):
+            module.fail_json(msg="every entry of sets must be a dictionary with a set_name")
+        if entry.get("defaults_type", dtype) not in ("rsc", "op"):
+            module.fail_json(msg="defaults_type of set %s must be rsc or op" % entry["set_name"])
 
 
     # ==== FUNCTIONS ====
 
-    # Get the current value
-    def get_value():
-        rc, out, err = module.run_command(commands[os][dtype]["get"], use_unsafe_shell=True)
-        if rc != 0:
+    # Returns the requested sets as dictionaries of dtype, set_id, values and rule
+    # A set_id of None stands for the first set without a rule
+    def requested_sets():
+        requested = []
+        if name is not None:
+            requested.append(dict(dtype=dtype, set_id=set_name, values={name: value}, rule=None))
+        if defaults is not None:
+            requested.append(dict(dtype=dtype, set_id=set_name, values=defaults, rule=None))
+        for entry in sets or []:
+            rule = entry.get("rule")
+            if rule is not None:
+                try:
+                    rule = ET.fromstring(rule)
+                except ET.ParseError as error:
+                    module.fail_json(msg="rule of set %s is not valid XML: %s" % (entry["set_name"], error), **result)
+            requested.append(dict(dtype=entry.get("defaults_type", dtype), set_id=entry["set_name"], values=entry.get("values") or {}, rule=rule))
+        return requested
+
+    # Returns the meta_attributes set of a defaults section with the given id, or the first one without a rule
+    def find_set(section, set_id):
+        if section is None:
             return None
-        else:
-            return out
-    
-    # Check if a default value has been configured
-    def check_default():
-        rc, out, err = module.run_command(commands[os][dtype]["check"], use_unsafe_shell=True)
-        return rc == 0
-    
-    def set_property():
-        result["changed"] = True
-        if not module.check_mode:
-            cmd = commands[os][dtype]["set"]
-            execute_command(module, result, cmd, 
-                            "Successfully set " + name + " to " + value, 
-                            "Failed to set " + name + " to " + value)
-
-    def unset_property():
-        result["changed"] = True
-        if not module.check_mode:
-            cmd = commands[os][dtype]["unset"]
-            execute_command(module, result, cmd, 
-                            "Successfully unset " + name, 
-                            "Failed to unset " + name)
+        for attribute_set in section.findall("meta_attributes"):
+            if (set_id is None and attribute_set.find("rule") is None) or attribute_set.attrib.get("id") == set_id:
+                return attribute_set
+        return None
+
+    # Returns the set of the given type and id (or, with None, the first one without a rule) the patch creates, or None
+    def find_new_set(new_sets, new_dtype, set_id):
+        for attribute_set in new_sets.get(new_dtype, []):
+            if (set_id is None and attribute_set.find("rule") is None) or attribute_set.attrib.get("id") == set_id:
+                return attribute_set
+        return None
+
+    # Gives every element of a rule that lacks an id one based on the set id
+    def assign_rule_ids(patch, rule, set_id):
+        for element in rule.iter():
+            if "id" not in element.attrib:
+                element.set("id", patch.new_id("%s-%s" % (set_id, element.tag)))
+
+    # Adds the changes to every requested defaults set to the patch
+    def plan_changes(snapshot, patch):
+        configuration = snapshot.root.find("configuration")
+        new_sets = {}
+        for requested in requested_sets():
+            section = configuration.find(requested["dtype"] + "_defaults")
+            attribute_set = find_set(section, requested["set_id"])
+            values = requested["values"]
+            if state == "absent":
+                values = dict((default_name, None) for default_name in values)
+            set_id = requested["set_id"] or set_ids[os][requested["dtype"]]
+            detail = dict(defaults_type=requested["dtype"], set_name=set_id)
+
+            if attribute_set is None and state == "present":
+                attribute_set = find_new_set(new_sets, requested["dtype"], requested["set_id"])
+                # Another request already creates this set: merge the values and the rule into it
+                if attribute_set is not None:
+                    detail["set_name"] = attribute_set.attrib["id"]
+                    current_rule = attribute_set.find("rule")
+                    if requested["rule"] is not None and current_rule is None:
+                        assign_rule_ids(patch, requested["rule"], detail["set_name"])
+                        attribute_set.insert(0, requested["rule"])
+                    elif requested["rule"] is not None and diff_elements(current_rule, requested["rule"]):
+                        module.fail_json(msg="Set %s is requested with two different rules" % detail["set_name"], **result)
+                    current = dict((nvpair.attrib["name"], nvpair) for nvpair in attribute_set.findall("nvpair"))
+                    for default_name, default_value in sorted(values.items()):
+                        nvpair, after = current.get(default_name), cib_value(default_value)
+                        if nvpair is None or nvpair.attrib["value"] == after:
+                            continue
+                        patch.details.append(dict(detail, name=default_name, before=nvpair.attrib["value"], after=after))
+                        if after is None:
+                            attribute_set.remove(nvpair)
+                        else:
+                            nvpair.set("value", after)
+                    values = dict((default_name, default_value) for default_name, default_value in values.items() if default_name not in current)
+                    changes = patch.set_nvpairs(attribute_set, values, new=True)
+                    patch.details.extend(dict(detail, **change) for change in changes)
+                    continue
+
+            if attribute_set is None:
+                if state == "absent":
+                    continue
+                attribute_set = ET.Element("meta_attributes", id=patch.new_id(set_id))
+                if requested["rule"] is not None:
+                    assign_rule_ids(patch, requested["rule"], set_id)
+                    attribute_set.append(requested["rule"])
+                changes = patch.set_nvpairs(attribute_set, values, new=True)
+                new_sets.setdefault(requested["dtype"], []).append(attribute_set)
+                patch.details.append(dict(detail, set_name=attribute_set.attrib["id"], change="created"))
+                patch.details.extend(dict(detail, set_name=attribute_set.attrib["id"], **change) for change in changes)
+                continue
+
+            detail["set_name"] = attribute_set.attrib.get("id")
+            if state == "absent" and not values and requested["set_id"] is not None:
+                patch.delete(attribute_set)
+                patch.details.append(dict(detail, change="removed"))
+                continue
+            current_rule = attribute_set.find("rule")
+            if state == "present" and requested["rule"] is not None and (current_rule is None or diff_elements(current_rule, requested["rule"])):
+                if current_rule is not None:
+                    patch.delete(current_rule)
+                assign_rule_ids(patch, requested["rule"], detail["set_name"])
+                patch.create(attribute_set, requested["rule"], position=0)
+                patch.details.append(dict(detail, change="rule"))
+            changes = patch.set_nvpairs(attribute_set, values)
+            patch.details.extend(dict(detail, **change) for change in changes)
+
+        for new_dtype, attribute_sets in sorted(new_sets.items()):
+            section = configuration.find(new_dtype + "_defaults")
+            if section is None:
+                section = ET.Element(new_dtype + "_defaults")
+                section.extend(attribute_sets)
+                patch.create(configuration, section)
+            else:
+                for attribute_set in attribute_sets:
+                    patch.create(section, attribute_set)
 
 
     # ==== MAIN CODE ====
 
-    if state == "present":
-        if get_value() != value:
-            set_property()
-        else:
-            result["message"] += "No changes needed: %s is already set to %s. " % (name, value)
+    patch, rc, out, err = update_cib(module, plan_changes)
+    if patch is None:
+        module.fail_json(msg="Cluster is not running on current node!", **result)
+    result["changes"] = patch.details
+    if rc != 0:
+        result["stdout"] = out
+        result["error_message"] = err
+        module.fail_json(msg="Failed to update the cluster defaults", **result)
+    if patch.details and name is not None:
+        result["changed"] = True
+        if not module.check_mode:
+            result["message"] += "Successfully set %s to %s. " % (name, value) if state == "present" else "Successfully unset %s. " % name
+    elif patch.details:
+        result["changed"] = True
+        if not module.check_mode:
+            result["message"] += "Successfully applied %d changes to the cluster defaults. " % len(patch.details)
+    elif name is not None and state == "present":
+        result["message"] += "No changes needed: %s is already set to %s. " % (name, value)
+    elif name is not None:
+        result["message"] += "No changes needed: %s has not been modified. " % name
     else:
-        if check_default():
-            unset_property()
-        else:
-            result["message"] += "No changes needed: %s has not been modified. " % name
+        result["message"] += "No changes needed: all cluster defaults already have the desired values. "
 
     # Success
+    record_if_converged(module, result)
     module.exit_json(**result)
 
 
@@ -40,6 +40,9 @@ options:
             - the resources will start in the order you specify them
             - the resources will stop in the reverse order of their starting order
             - the module will add or remove any resources necessary to achieve this desired set
+            - changes to an existing group are planned as a minimal add/remove/move sequence and written in a single CIB update
+            - resources added to the group are taken out of any other group, and removed resources are kept as standalone resources
+            - a group left without resources this way is deleted, together with the constraints that reference it
         required: false
         type: str
     options:
@@ -48,6 +51,50 @@ options:
             - for use with Suse operation system
         required: true
         type: str
+    backend:
+        description:
+            - "cli" creates the group with pcs or crm
+            - "native" builds the group pcs or crm would create in-process and applies it with cibadmin, without starting pcs or crm
+            - groups of resources that are not top-level primitives, or with options the native backend cannot build, are created with pcs or crm
+            - existing groups are always updated in one CIB update, and destroyed with pcs or crm
+        required: false
+        choices: ["cli", "native"]
+        default: "cli"
+        type: str
+    verify:
+        description:
+            - "memo" skips the run when the same parameters already converged at the current CIB version, with one cibadmin query of the CIB version and without starting pcs or crm
+            - "full" always checks the cluster configuration
+        required: false
+        choices: ["memo", "full"]
+        default: "memo"
+        type: str
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
+
 author:
     - William Sheehan (@wksheehan)
 '''
@@ -61,7 +108,12 @@ EXAMPLES = r'''
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command
+from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command, start_trace
+from ansible.module_utils.converge_memo import skip_if_converged, record_if_converged, VERIFY_CHOICES
+from ansible.module_utils.cib_patch import query_cib, update_cib
+from ansible.module_utils.cib_diff import RESOURCE_TAGS, edit_plan
+from ansible.module_utils.cib_apply import remove_dangling_constraints
+from ansible.module_utils.cib_native import build_group, id_in_use, BACKEND_CHOICES
 from distutils.spawn import find_executable
 
 
@@ -73,7 +125,13 @@ def run_module():
         state=dict(required=False, default="present", choices=["present", "absent"]),
         name=dict(required=True),
         resources=dict(required=False, default=""),
-        options=dict(required=False, default="")
+        options=dict(required=False, default=""),
+        backend=dict(required=False, default="cli", choices=BACKEND_CHOICES),
+        verify=dict(required=False, default="memo", choices=VERIFY_CHOICES),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
     )
 
     module = AnsibleModule(
@@ -86,15 +144,16 @@ def run_module():
         message=""
     )
 
+    start_trace(module, result)
     os, version         = get_os_name_and_version(module, result)
     state               = module.params["state"]
     name                = module.params["name"]
     resources           = module.params["resources"]
     options             = module.params["options"]
+    backend             = module.params["backend"]
 
     resource_list       = resources.split()
     resource_set        = set(resource_list)
-    last_resource       = resource_list[-1] if len(resource_list) > 0 else ""
 
 
     # ==== Command dictionary ====
@@ -102,23 +161,15 @@ def run_module():
     commands                               = {}
     commands["RedHat"]                     = {}
     commands["Suse"  ]                     = {}
-    commands["RedHat"]["status"]           = "pcs status"
-    commands["Suse"  ]["status"]           = "crm status"
-    commands["RedHat"]["read"]             = f"pcs resource group list | grep {name}:"
-    commands["Suse"  ]["read"]             = f"crm config show type:group | grep 'group {name}'"
-    commands["RedHat"]["get"]              = "pcs resource group list | grep %s: | awk -F'[:]' '{print $2}'" % name
-    commands["Suse"  ]["get"]              = "crm config show | grep 'group %s' | cut -d' ' -f 3-" % name
     commands["RedHat"]["create"]           = f"pcs resource group add {name} {resources}"
     commands["Suse"  ]["create"]           = f"crm configure group {name} {resources} {options}"
-    commands["RedHat"]["add"]              = "pcs resource group add %s %s"           # % (name, resources_to_add)
-    commands["Suse"  ]["add"]              = "crm configure modgroup %s add '%s'"     # % (name, resources_to_add)
-    commands["RedHat"]["remove"]           = f"pcs resource group remove {name} "     # + resources_to_remove
-    commands["Suse"  ]["remove"]           = f"crm configure modgroup {name} remove " # + resources_to_remove
     commands["RedHat"]["delete"]           = f"pcs resource group remove {name} "     # + " ".join(get_group_resources())
     commands["Suse"  ]["delete"]           = f"crm configure delete --force {name}"
-    commands["RedHat"]["sort"]             = "pcs resource group add %s %s --before %s" % (name, " ".join(resource_list[:-1]), last_resource)
-    commands["Suse"  ]["sort"]             = "crm config modgroup %s add '%s' before %s"  % (name, " ".join(resource_list[:-1]), last_resource)
-    
+
+
+    # Nothing to do if these parameters already converged at the current CIB version
+    skip_if_converged(module, result, "cluster_group")
+
 
     # ==== Initial checks ====
 
@@ -126,34 +177,19 @@ def run_module():
         module.fail_json(msg="'pcs' executable not found. Install 'pcs'.")
     if state == "present" and (resources is None or len(resource_set) == 0):
         module.fail_json(msg="No resources specified. If you wish to destroy the resource group, run again with state = absent", **result)
-    rc, out, err = module.run_command(commands[os]["status"])
-    if rc != 0:
+    if len(resource_set) != len(resource_list):
+        module.fail_json(msg="Each resource may only be listed once", **result)
+    # Read the cluster configuration once, which also makes sure we can communicate with the cluster
+    cib = query_cib(module)
+    if cib is None:
         module.fail_json(msg="Cluster is not running on current node!", **result)
 
 
     # ==== Functions ====
     
-    # Returns True if a resource group with the given name exists
-    def resource_group_exists():
-        rc, out, err = module.run_command(commands[os]["read"], use_unsafe_shell=True)
-        return rc == 0
-    
-    # Returns the list of resources already in the specified resource group
-    def get_group_resources():
-        cmd = commands[os]["get"]
-        rc, out, err = module.run_command(cmd, use_unsafe_shell=True)
-        if rc == 0:
-            return out.split()
-        else:
-            result["changed"] = False
-            result["stdout"] = out
-            result["error_message"] = err
-            result["command_used"] = cmd
-            module.fail_json(msg="Error while retrieving resources in group " + name, **result)
-    
-    # Returns True if the ordering of resources is as desired, False if different
-    def is_ordered():
-        return resource_list == get_group_resources()
+    # Returns the list of resources in the resource group, or None if it does not exist
+    def get_group_resources(snapshot):
+        return snapshot.get_group_members(name)
 
     # Creates a new resource with the specified resources and options
     def create_resource_group():
@@ -163,34 +199,41 @@ def run_module():
             execute_command(module, result, cmd, 
                             "Resource group successfully created. ", 
                             "Failed to create the resource group")
-    
-    # Adds resources to an existing group
-    def add_resources(resources):
-        result["changed"] = True
-        if not module.check_mode:
-            resources_to_add = " ".join(resources)
-            cmd = commands[os]["add"] % (name, resources_to_add)
-            execute_command(module, result, cmd,
-                            "Succesfully added the following resources to the group: %s. " % resources_to_add,
-                            "Failed to add the following resources to the group: " + resources_to_add)
-    
-    # Removes resources from the resource group
-    def remove_resources(resources):
+
+    # Returns the group pcs or crm would create with the resources of the snapshot, built in-process
+    # Returns None if the native backend cannot build it, or a resource is not a primitive at the top level
+    def build_native_group(snapshot):
+        if id_in_use(snapshot, name):
+            return None
+        members = []
+        for resource_name in resource_list:
+            resource = snapshot.get(resource_name, "primitive")
+            if resource is None or snapshot.get_parent(resource).tag != "resources":
+                return None
+            members.append(resource)
+        return build_group(os, name, members, options)
+
+    # Creates the resource group pcs or crm would create in one CIB update, without running either
+    # Falls back to the tool if the native backend cannot build the group
+    def create_resource_group_native():
+        if build_native_group(cib) is None:
+            return create_resource_group()
+        def plan_create(snapshot, patch):
+            group = build_native_group(snapshot)
+            if group is None:
+                module.fail_json(msg="Resources of group %s were changed while it was being created" % name, **result)
+            for resource_name in resource_list:
+                patch.delete(snapshot.get(resource_name, "primitive"))
+            patch.create(snapshot.root.find("configuration/resources"), group)
         result["changed"] = True
+        patch, rc, out, err = update_cib(module, plan_create, cib)
+        if patch is None or rc != 0:
+            result["changed"] = False
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg="Failed to create the resource group", **result)
         if not module.check_mode:
-            if os == "RedHat":
-                resources_to_remove = " ".join(resources)
-                cmd = commands[os]["remove"] + resources_to_remove
-                execute_command(module, result, cmd,
-                                "Succesfully removed the following resources from the group: %s. " % resources_to_remove,
-                                "Failed to remove the following resources from the group: %s" % resources_to_remove)
-            # Can only remove one resource at a time when os == "Suse"
-            else:
-                for resource in resources:
-                    cmd = commands[os]["remove"] + resource
-                    execute_command(module, result, cmd,
-                                    "Succesfully removed %s from the group. " % resource,
-                                    "Failed to remove %s from the group: " % resource)
+            result["message"] += "Resource group successfully created. "
 
     # Deletes an entire resource group
     def delete_group():
@@ -198,61 +241,111 @@ def run_module():
         if not module.check_mode:
             cmd = commands[os]["delete"]
             if os == "RedHat":
-                cmd += " ".join(get_group_resources())
+                cmd += " ".join(get_group_resources(cib))
             execute_command(module, result, cmd,
                             "Succesfully destroyed the resource group. ",
                             "Failed to destroy the resource group")
 
-    # Rearranges the resources in the group to match the input order specified
-    def sort_group():
-        result["changed"] = True
-        if not module.check_mode:
-            # Can't rearrange resources already in group for os == Suse
-            # ==> remove them, then add them back in the correct order
-            if os == "Suse":
-                for resource in resource_list[:-1]:
-                    cmd = commands[os]["remove"] + resource
-                    execute_command(module, result, cmd,
-                                    "",
-                                    "Failed to remove %s from the group: " % resource)
-            cmd = commands[os]["sort"]
-            execute_command(module, result, cmd,
-                            "Successfully reordered the list. ",
-                            "Failed to reorder the list")
-
-    # Updates an existing resource to match the configuration specified exactly
+    # Adds the changes turning the group's members into resource_list to the patch, following the steps of edit_plan
+    # Kept members stay in place and moved ones are moved within the group; resources joining it are taken from where
+    # they are now, and leaving members move to the top level. A group the joining resources leave empty is deleted,
+    # with the constraints that reference it, as pcs does
+    def plan_group_update(snapshot, patch):
+        group = snapshot.get(name, "group")
+        if group is None:
+            module.fail_json(msg="Resource group %s was removed while it was being updated" % name, **result)
+        plan = edit_plan(get_group_resources(snapshot), resource_list)
+        result["plan"] = [step for step in plan if step["action"] != "keep"]
+        if not result["plan"]:
+            return
+        resources_section = snapshot.root.find("configuration/resources")
+        joining = {}
+        for step in plan:
+            if step["action"] != "add":
+                continue
+            resource = snapshot.get(step["item"], "primitive")
+            if resource is None or snapshot.get_parent(resource).tag not in ("resources", "group"):
+                module.fail_json(msg="Resource %s does not exist or is not a primitive outside of a clone" % step["item"], **result)
+            joining.setdefault(snapshot.get_parent(resource), []).append(resource)
+        emptied = []
+        for parent, members in joining.items():
+            if parent.tag == "group" and len(members) == len(parent.findall("primitive")):
+                if snapshot.get_parent(parent).tag != "resources":
+                    module.fail_json(msg="Adding the resources would leave group %s, which is part of a clone, empty" % parent.attrib.get("id"), **result)
+                emptied.append(parent)
+                patch.delete(parent)
+            else:
+                for member in members:
+                    patch.delete(member)
+        remaining = [element.attrib.get("id") for element in resources_section.iter()
+                     if element.tag in RESOURCE_TAGS and element not in emptied]
+        remove_dangling_constraints(snapshot, patch, remaining)
+        result["removed_constraints"] = [detail["id"] for detail in patch.details]
+
+        # Leaving members go first, then each added or moved member is placed right after the member preceding it in
+        # resource_list, or before the first member; children is the group's children as the patch leaves them
+        children = list(group)
+        placed = {}
+        for step in plan:
+            if step["action"] == "remove":
+                member = snapshot.get(step["item"], "primitive")
+                patch.delete(member)
+                children.remove(member)
+                patch.create(resources_section, member)
+        for step in plan:
+            if step["action"] in ("add", "move"):
+                member = snapshot.get(step["item"], "primitive")
+                if member in children:
+                    children.remove(member)
+                if step["position"] > 0:
+                    position = children.index(snapshot.get(resource_list[step["position"] - 1], "primitive")) + 1
+                else:
+                    position = next((index for index, child in enumerate(children) if child.tag == "primitive"), len(children))
+                children.insert(position, member)
+                placed[member] = step["action"]
+        # The CIB manager places created and moved elements after the deletes, in ascending position, so each placed
+        # member is given its final position among the children
+        for position, member in enumerate(children):
+            if placed.get(member) == "move":
+                patch.move(member, position)
+            elif placed.get(member) == "add":
+                patch.create(group, member, position=position)
+
+    # Updates an existing resource group to match the configuration specified exactly, with one CIB update
     def update_resource_group():
-        existing_resouces = set(get_group_resources())
-        resources_to_add = resource_set - existing_resouces
-        resources_to_remove = existing_resouces - resource_set
-        # Configuration is as desired
-        if len(resources_to_add) == 0 and len(resources_to_remove) == 0 and is_ordered():
+        patch, rc, out, err = update_cib(module, plan_group_update, cib)
+        if patch is None or rc != 0:
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg="Failed to update the resource group", **result)
+        if len(patch) == 0:
             result["message"] += "No changes needed: group is already set up with the resources specified. "
-        # Add missing resources
-        if len(resources_to_add) > 0:
-            add_resources(resources_to_add)
-        # Remove extra resources
-        if len(resources_to_remove) > 0:
-            remove_resources(resources_to_remove)
-        # Reorder the resources
-        if not is_ordered():
-            sort_group()
+            return
+        result["changed"] = True
+        if not module.check_mode:
+            result["message"] += "Successfully updated the resource group: %s. " % ", ".join(
+                "%s %s" % (step["action"], step["item"]) for step in result["plan"])
+            if result["removed_constraints"]:
+                result["message"] += "Removed the constraints referencing emptied groups: %s. " % ", ".join(result["removed_constraints"])
 
 
     # ==== Main code ====
 
     if state == "present":
-        if resource_group_exists():
+        if get_group_resources(cib) is not None:
             update_resource_group()
+        elif backend == "native":
+            create_resource_group_native()
         else:
             create_resource_group()
     else:
-        if resource_group_exists():
+        if get_group_resources(cib) is not None:
             delete_group()
         else:
             result["message"] += "No changes needed: resource group does not exist. "
 
     # Success
+    record_if_converged(module, result)
     module.exit_json(**result)
 
 
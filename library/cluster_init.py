@@ -17,7 +17,9 @@ version_added: "1.0"
 description: 
     - creates or modifies a cluster so that it contains exactly the specified node set
     - starts the cluster on all nodes (RedHat)
-    - fails if not all nodes specified are online after 120 seconds
+    - fails if not all nodes specified are online after wait_timeout seconds
+    - node membership changes are planned as one batch, and the nodes are prepared concurrently before any change is made
+    - the progress of every added or removed node is reported under node_progress
     - for use with RHEL or SUSE operating systems 
 
 options:
@@ -59,6 +61,67 @@ options:
             - the token used when setting up the cluster
         required: false
         type: str
+    wait_timeout:
+        description:
+            - the number of seconds to wait for all nodes to come online
+        required: false
+        default: 120
+        type: int
+    poll_strategy:
+        description:
+            - how often to poll the node states while waiting for nodes to come online
+            - "backoff" polls after 100ms, doubling the delay up to 5 seconds
+            - "interval" polls every 5 seconds
+        required: false
+        choices: ["backoff", "interval"]
+        default: "backoff"
+        type: str
+    parallelism:
+        description:
+            - the largest number of nodes prepared concurrently
+        required: false
+        default: 16
+        type: int
+    check_reachable:
+        description:
+            - if true, checks every node to set up the cluster on, to add or to join before changing anything
+            - on RedHat, that pcsd (port 2224) accepts connections and accepts the local token for the node, with one pcs cluster pcsd-status for all nodes
+            - on Suse, that ssh (port 22) accepts connections and root logs in without a password, as crm cluster add and ha-cluster-join need
+            - the connections and ssh logins are checked concurrently, at most parallelism nodes at a time
+        required: false
+        default: true
+        type: bool
+    connect_timeout:
+        description:
+            - the number of seconds to wait for each node to accept a connection
+        required: false
+        default: 5
+        type: int
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
 
 author:
     - William Sheehan (@wksheehan)
@@ -81,6 +144,15 @@ EXAMPLES = r'''
     tier: hana
     token: 30000
 
+- name: Grow the cluster to four nodes, checking at most two nodes at a time
+  cluster_init:
+    state: present
+    sid: SAP01
+    nodes: node1 node2 node3 node4
+    tier: hana
+    token: 30000
+    parallelism: 2
+
 - name: Remove the entire cluster
   cluster_init:
     state: absent
@@ -90,9 +162,11 @@ EXAMPLES = r'''
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command
+from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command, run_command, start_trace
+from ansible.module_utils.cluster_wait import wait_for_nodes, is_online, POLL_STRATEGIES
+from ansible.module_utils.node_fanout import fan_out, check_reachable, MAX_WORKERS, PCSD_PORT, SSH_PORT
+from ansible.module_utils.pcsd_tokens import parse_pcsd_status
 from distutils.spawn import find_executable
-from time import sleep
 import re
 import socket
 import os as OS
@@ -108,7 +182,16 @@ def run_module():
         existing_node=dict(required=False),
         nodes=dict(required=False, default=""),
         tier=dict(required=False, choices=["hana", "scs", "db2"]),
-        token=dict(required=False)
+        token=dict(required=False),
+        wait_timeout=dict(required=False, type="int", default=120),
+        poll_strategy=dict(required=False, default="backoff", choices=POLL_STRATEGIES),
+        parallelism=dict(required=False, type="int", default=MAX_WORKERS),
+        check_reachable=dict(required=False, type="bool", default=True),
+        connect_timeout=dict(required=False, type="int", default=5),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
     )
 
     module = AnsibleModule(
@@ -121,6 +204,7 @@ def run_module():
         message=""
     )
 
+    start_trace(module, result)
     os, version     = get_os_name_and_version(module, result)
     state           = module.params["state"]
     sid             = module.params["sid"]
@@ -129,6 +213,11 @@ def run_module():
     nodes_set       = set(nodes.split())
     tier            = module.params["tier"]
     token           = module.params["token"]
+    wait_timeout    = module.params["wait_timeout"]
+    poll_strategy   = module.params["poll_strategy"]
+    parallelism     = module.params["parallelism"]
+    reachable       = module.params["check_reachable"]
+    connect_timeout = module.params["connect_timeout"]
     curr_node       = socket.gethostname()
     cluster_exists  = OS.path.isfile("/etc/corosync/corosync.conf") or OS.path.isfile("/var/lib/pacemaker/cib/cib.xml")
 
@@ -149,6 +238,8 @@ def run_module():
             module.fail_json(msg="Must configure the cluster from the current node when using RedHat", **result)
     if state == "present" and len(nodes_set) == 0:
         module.fail_json(msg="No nodes will be left in the cluster. If you intend to destroy the whole cluster, re-run the module with state: absent", **result)
+    if parallelism < 1:
+        module.fail_json(msg="parallelism must be at least 1", **result)
 
     
     # ==== COMMAND DICTIONARY ====
@@ -165,9 +256,12 @@ def run_module():
     commands["RedHat"]["7"  ]["destroy"]        = "pcs cluster destroy --all"
     commands["RedHat"]["8"  ]["destroy"]        = "pcs cluster destroy --all"
     commands["Suse"  ]["all"]["destroy"]        = "crm cluster remove -y -c %s %s --force" # % (curr_node, " ".join(nodes_set))
-    commands["RedHat"]["7"  ]["add"]            = "pcs cluster node add "
-    commands["RedHat"]["8"  ]["add"]            = "pcs cluster node add "
-    commands["Suse"  ]["all"]["add"]            = "crm cluster add -y "
+    commands["RedHat"]["7"  ]["add"]            = "pcs cluster node add %s"
+    commands["RedHat"]["8"  ]["add"]            = "pcs cluster node add %s"
+    commands["Suse"  ]["all"]["add"]            = "crm cluster add -y %s"
+    commands["RedHat"]["7"  ]["batched"]        = ()                    # membership actions taking several nodes in one call
+    commands["RedHat"]["8"  ]["batched"]        = ("remove",)
+    commands["Suse"  ]["all"]["batched"]        = ("add", "remove")
     commands["RedHat"]["7"  ]["remove"]         = "pcs cluster node remove %s --force"
     commands["RedHat"]["8"  ]["remove"]         = "pcs cluster node remove %s --force"
     commands["Suse"  ]["all"]["remove"]         = "crm cluster remove -y %s --force" 
@@ -180,21 +274,22 @@ def run_module():
     commands["RedHat"]["7"  ]["status"]         = "pcs status"
     commands["RedHat"]["8"  ]["status"]         = "pcs status"
     commands["Suse"  ]["all"]["status"]         = "crm status"
-    commands["RedHat"]["7"  ]["online"]         = "pcs status | grep '^Online:'"
-    commands["RedHat"]["8"  ]["online"]         = "pcs status | grep '^  \* Online:'"
-    commands["Suse"  ]["all"]["online"]         = "crm status | grep 'Online:'"
     commands["Suse"  ]["all"]["join"]           = "ha-cluster-join -y -c %s --interface eth0" % existing_node
+    commands["RedHat"]["precheck"]              = "pcs cluster pcsd-status %s"
+    commands["Suse"  ]["precheck"]              = "ssh -o BatchMode=yes -o StrictHostKeyChecking=no -o ConnectTimeout=%d root@%%s true" % connect_timeout
     commands["RedHat"]["regex"]                 = r"ring0_addr\s*:\s*([\w.-]+)\s*"
     commands["Suse"  ]["regex"]                 = r"host\s*([\w.-]+);"
     commands["RedHat"]["file"]                  = "/etc/corosync/corosync.conf"
     commands["Suse"  ]["file"]                  = "/etc/csync2/csync2.cfg"
+    commands["RedHat"]["port"]                  = PCSD_PORT
+    commands["Suse"  ]["port"]                  = SSH_PORT
 
     
     # ==== FUNCTIONS ====
 
     # Ensure cluster is running on the current node
     def start_cluster():
-        rc, out, err = module.run_command(commands[os][version]["status"])
+        rc, out, err = run_command(module, commands[os][version]["status"])
         if rc != 0:
             result["changed"] = True
             if not module.check_mode:
@@ -217,7 +312,7 @@ def run_module():
     
     # Stop a cluster on the current node
     def stop_cluster():
-        rc, out, err = module.run_command(commands[os][version]["status"])
+        rc, out, err = run_command(module, commands[os][version]["status"])
         if rc == 0:
             result["changed"] = True
             if not module.check_mode:
@@ -229,7 +324,7 @@ def run_module():
     # Get name of existing cluster on the current node
     def get_cluster_name():
         cmd = "grep cluster_name /etc/corosync/corosync.conf | awk -F'[:]' '{print $2}' | tr -d '[:space:]'"
-        rc, out, err = module.run_command(cmd, use_unsafe_shell=True)
+        rc, out, err = run_command(module, cmd, unsafe=True)
         if rc == 0:
             return out
         else:
@@ -244,24 +339,12 @@ def run_module():
         node_names = re.compile(commands[os]["regex"], re.M)
         return set(node_names.findall(corosync_conf.read()))
 
-    # Get set of nodes that are online
+    # Get set of nodes that are online, waiting up to timeout seconds for all of them
+    # Records the number of seconds each node took to come online
     def get_nodes_online(timeout):
-        seconds = 0
-        nodes_online = set()
-        while seconds < timeout:
-            # String containing which nodes are online
-            rc, out, err = module.run_command(commands[os][version]["online"], use_unsafe_shell=True)
-            # See which nodes are online
-            for node in nodes_set:
-                if node in out:
-                    nodes_online.add(node)
-            # All nodes online
-            if nodes_online == nodes_set:
-                break
-            # Atleast one node not online
-            sleep(5)
-            seconds += 5
-        return nodes_online
+        time_to_online = wait_for_nodes(module, nodes_set, is_online, timeout, poll_strategy)
+        result["time_to_online"] = time_to_online
+        return set(time_to_online)
 
     # Set up the cluster
     def setup_cluster():
@@ -271,6 +354,7 @@ def run_module():
                 module.fail_json(msg="Must supply sid when setting up new cluster", **result)
             if os == "Suse" and tier is None:
                 module.fail_json(msg="Must supply tier when setting up a new Suse cluster", **result)
+            prepare_nodes(nodes_set - {curr_node})
             cmd = commands[os][version]["setup"]
             execute_command(module, result, cmd, 
                             "Successfully set up the cluster. ",
@@ -279,37 +363,95 @@ def run_module():
     # Current node joins a cluster running on another node (Suse)
     def join_cluster():
         result["changed"] = True
+        prepare_nodes({existing_node})
         if not module.check_mode:
             cmd = commands[os][version]["join"]
             execute_command(module, result, cmd, 
                             curr_node + " successfully joined the cluster. ",
                             "Failed to join existing cluster")
     
+    # Records the outcome of one step for a node under node_progress
+    def report_progress(node, step, outcome):
+        result.setdefault("node_progress", {}).setdefault(node, {})[step] = outcome
+
+    # Checks one node: that it accepts connections, then on Suse that root logs in over ssh without a password
+    # Returns the outcome of each step run, as a list of (step, outcome), stopping at the first step that fails
+    def prepare_node(node):
+        error = check_reachable(node, commands[os]["port"], connect_timeout)
+        if error is not None:
+            return [("reachable", error)]
+        if os == "RedHat":
+            return [("reachable", "ok")]
+        rc, out, err = run_command(module, commands[os]["precheck"] % node)
+        if rc != 0:
+            return [("reachable", "ok"), ("ssh_login", err.strip() or "ssh exited with %d" % rc)]
+        return [("reachable", "ok"), ("ssh_login", "ok")]
+
+    # Checks with one pcs command, which asks every pcsd concurrently, that the local tokens of the nodes are accepted
+    # Adds the outcome to the steps of each node
+    def check_pcsd_tokens(outcomes):
+        nodes = sorted(node for node, steps in outcomes.items() if steps[-1][1] == "ok")
+        if not nodes:
+            return
+        rc, out, err = run_command(module, commands[os]["precheck"] % " ".join(nodes))
+        unauthenticated = parse_pcsd_status(out, nodes) if rc != 0 else []
+        for node in nodes:
+            if node in unauthenticated:
+                status = [line.strip() for line in out.splitlines() if line.strip().startswith(node + ":")]
+                outcomes[node].append(("authenticated", (status or [err.strip() or "pcs cluster pcsd-status failed"])[0]))
+            else:
+                outcomes[node].append(("authenticated", "ok"))
+
+    # Prepares the nodes concurrently, at most parallelism nodes at a time, recording each node's steps
+    # Fails before any change is made if one of them is not ready
+    def prepare_nodes(nodes):
+        if not reachable or module.check_mode:
+            return
+        outcomes = fan_out(sorted(nodes), prepare_node, parallelism)
+        if os == "RedHat":
+            check_pcsd_tokens(outcomes)
+        for node, steps in sorted(outcomes.items()):
+            for step, outcome in steps:
+                report_progress(node, step, outcome)
+        unprepared = sorted(node for node, steps in outcomes.items() if steps[-1][1] != "ok")
+        if unprepared:
+            module.fail_json(msg="The following nodes are not ready to join the cluster: " + " ".join(unprepared), **result)
+
+    # Adds or removes the nodes in the order given, recording the progress of each
+    # The tool is run once for all of them where it accepts several nodes (see "batched"), and once per node otherwise
+    # The membership commands rewrite the corosync configuration shared by every node, so they never run concurrently
+    def change_nodes(nodes, action):
+        batches = [nodes] if action in commands[os][version]["batched"] else [[node] for node in nodes]
+        for batch in batches:
+            cmd = commands[os][version][action] % " ".join(batch)
+            rc, out, err = run_command(module, cmd)
+            for node in batch:
+                report_progress(node, action, "ok" if rc == 0 else "failed")
+            if rc != 0:
+                result["changed"] = False
+                result["stdout"] = out
+                result["error_message"] = err
+                result["command_used"] = cmd
+                module.fail_json(msg="Failed to %s the following nodes: %s" % (action, " ".join(batch)), **result)
+
     # Adds external nodes to existing cluster running on current node
     def add_nodes(nodes):
         result["changed"] = True
         if not module.check_mode:
             start_cluster()
-            nodes_to_add = " ".join(nodes)
-            cmd = commands[os][version]["add"] + nodes_to_add
-            execute_command(module, result, cmd, 
-                            "Successfully added the following nodes to the cluster: " + nodes_to_add + ". ",
-                            "Failed to add the following nodes to the cluster: " + nodes_to_add)
+            change_nodes(sorted(nodes), "add")
+            result["message"] += "Successfully added the following nodes to the cluster: " + " ".join(sorted(nodes)) + ". "
 
-    # Delete nodes from existing cluster
+    # Delete nodes from existing cluster, the current node last
+    # The local cluster is only stopped when the current node itself is removed
     def remove_nodes(nodes):
         result["changed"] = True
         if not module.check_mode:
-            if os == "RedHat":
+            nodes_to_remove = sorted(nodes - {curr_node}) + sorted(nodes & {curr_node})
+            if os == "RedHat" and curr_node in nodes:
                 stop_cluster()
-            if curr_node in nodes:
-                nodes_to_remove = " ".join(nodes - {curr_node}) + " " + curr_node
-            else:
-                nodes_to_remove = " ".join(nodes)
-            cmd = commands[os][version]["remove"] % nodes_to_remove
-            execute_command(module, result, cmd, 
-                            "Successfully removed the following nodes from the cluster: " + nodes_to_remove + ". ", 
-                            "Failed to remove the following nodes to the cluster: " + nodes_to_remove)
+            change_nodes(nodes_to_remove, "remove")
+            result["message"] += "Successfully removed the following nodes from the cluster: " + " ".join(nodes_to_remove) + ". "
     
     # Update an existing cluster
     def update_cluster():
@@ -321,9 +463,12 @@ def run_module():
         existing_nodes = get_nodes()
         nodes_to_add = nodes_set - existing_nodes
         nodes_to_remove = existing_nodes - nodes_set
+        result["plan"] = dict(add=sorted(nodes_to_add), remove=sorted(nodes_to_remove))
         # Configuration is as desired
         if len(nodes_to_add) == 0 and len(nodes_to_remove) == 0:
             result["message"] += "No changes needed: cluster is already set up with the nodes specified. "
+        # Check every node to add before changing the membership
+        prepare_nodes(nodes_to_add)
         # Add missing nodes
         if len(nodes_to_add) > 0:
             add_nodes(nodes_to_add)
@@ -363,11 +508,11 @@ def run_module():
             # Ensure cluster is started
             start_all() if os == "RedHat" else start_cluster()
             # Wait for all nodes to go online
-            nodes_online = get_nodes_online(120)
+            nodes_online = get_nodes_online(wait_timeout)
             result["online_nodes"] = nodes_online
             # All nodes specified should be online
             if nodes_online != nodes_set:
-                module.fail_json(msg="Could not get all nodes online after 120s. The following nodes are not online: " + " ".join(nodes_set - nodes_online), **result)
+                module.fail_json(msg="Could not get all nodes online after %ss. The following nodes are not online: " % wait_timeout + " ".join(nodes_set - nodes_online), **result)
     # Remove the cluster
     else:
         if cluster_exists:
@@ -71,6 +71,62 @@ options:
         choices: ["true","false"]
         default: "true"
         type: str
+    backend:
+        description:
+            - "cli" creates the constraint with pcs or crm
+            - "native" builds the constraint pcs or crm would create in-process and applies it with cibadmin, without starting pcs or crm
+            - constraints on resources inside a clone, which pcs only accepts from the clone, or with an id already in use are created with pcs or crm
+            - existing constraints are always modified in one CIB update, and deleted with pcs or crm
+            - with "native", existing constraints are looked up in one CIB query and cib_cache is not used
+        required: false
+        choices: ["cli", "native"]
+        default: "cli"
+        type: str
+    cib_cache:
+        description:
+            - if true, looks up the existing constraints through the local CIB cache daemon, starting it if needed
+            - the daemon keeps the parsed CIB in memory between module runs; direct reads are used when it cannot be reached
+            - can also be enabled with the CLUSTER_CIB_CACHE environment variable
+        required: false
+        default: false
+        type: bool
+    verify:
+        description:
+            - "memo" skips the run when the same parameters already converged at the current CIB version, with one cibadmin query of the CIB version and without starting pcs or crm
+            - "full" always checks the cluster configuration
+        required: false
+        choices: ["memo", "full"]
+        default: "memo"
+        type: str
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
+
+notes:
+    - the existing constraints are looked up with lxml and compiled XPath when lxml is installed on the managed node, which reads large CIBs faster
+
 author:
     - William Sheehan (@wksheehan)
 '''
@@ -86,9 +142,12 @@ EXAMPLES = r'''
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command
+from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command, cluster_running, start_trace
+from ansible.module_utils.converge_memo import skip_if_converged, record_if_converged, VERIFY_CHOICES
+from ansible.module_utils.cib_cache import get_cib_lookup
+from ansible.module_utils.cib_patch import query_cib, update_cib
+from ansible.module_utils.cib_native import build_order, id_in_use, constrainable, BACKEND_CHOICES
 from distutils.spawn import find_executable
-import xml.etree.ElementTree as ET
 
 
 def run_module():
@@ -103,7 +162,14 @@ def run_module():
         first_action=dict(required=False, choices=["start", "stop", "promote", "demote"], default="start"),
         second_action=dict(required=False, choices=["start", "stop", "promote", "demote"], default="start"),
         kind=dict(required=False, choices=["Optional", "Mandatory", "Serialize"], default="Mandatory"),
-        symmetrical=dict(required=False, choices=["true", "false"], default="true")
+        symmetrical=dict(required=False, choices=["true", "false"], default="true"),
+        backend=dict(required=False, default="cli", choices=BACKEND_CHOICES),
+        cib_cache=dict(required=False, type="bool", default=False),
+        verify=dict(required=False, default="memo", choices=VERIFY_CHOICES),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
     )
 
     module = AnsibleModule(
@@ -116,6 +182,7 @@ def run_module():
         message=""
     )
 
+    start_trace(module, result)
     os, version         = get_os_name_and_version(module, result)
     state               = module.params["state"]
     name                = module.params["name"]
@@ -125,6 +192,7 @@ def run_module():
     second_action       = module.params["second_action"]
     kind                = module.params["kind"]
     symmetrical         = module.params["symmetrical"]
+    backend             = module.params["backend"]
 
     if name is None:
         name = f"order-{first_action}-{first_resource}-{second_action}-{second_resource}-{kind}-{symmetrical}"
@@ -135,8 +203,6 @@ def run_module():
     commands                                        = {}
     commands["RedHat"]                              = {}
     commands["Suse"  ]                              = {}
-    commands["RedHat"]["status"]                    = "pcs status"
-    commands["Suse"  ]["status"]                    = "crm status"
     commands["RedHat"]["7"  ]                       = {}
     commands["RedHat"]["8"  ]                       = {}
     commands["Suse"  ]["all"]                       = {}
@@ -148,13 +214,17 @@ def run_module():
     commands["Suse"  ]["all"]["delete"]             = "crm configure delete --force %s" # % current_constraint.attrib.get("id")
 
 
+    # Nothing to do if these parameters already converged at the current CIB version
+    skip_if_converged(module, result, "cluster_order")
+
+
     # ==== INITIAL CHECKS ====
 
     if os == "RedHat" and find_executable("pcs") is None:
         module.fail_json(msg="'pcs' executable not found. Install 'pcs'.")
-    # Make sure we can communicate with the cluster
-    rc, out, err = module.run_command(commands[os]["status"])
-    if rc != 0:
+    # Make sure we can communicate with the cluster; the native backend reads the cluster configuration once for that
+    cib = query_cib(module) if backend == "native" else None
+    if cib is None and (backend == "native" or not cluster_running(module)):
         module.fail_json(msg="Cluster is not running on current node!", **result)
 
 
@@ -162,11 +232,8 @@ def run_module():
 
     # If found, returns the xml object of the existing constraint that matches the configuration, otherwise returns None
     def get_current_constraint():
-        cib = ET.parse("/var/lib/pacemaker/cib/cib.xml")
-        constraint_contenders = cib.getroot().findall(f".//rsc_order[@first='{first_resource}'][@then='{second_resource}']")
-         
-        if constraint_contenders is None or len(constraint_contenders) == 0:
-            return None
+        lookup = cib if cib is not None else get_cib_lookup(module)
+        constraint_contenders = lookup.get_orders(first_resource, second_resource)
 
         for constraint in constraint_contenders:
             if (constraint.attrib.get("first-action", "start") == first_action and 
@@ -183,6 +250,26 @@ def run_module():
                             f"Successfully created constraint {name}. ",  
                             f"Failed to create constraint {name}")
 
+    # Creates the constraint pcs or crm would create in one CIB update, without running either
+    # Falls back to the tool unless its resources can be referenced directly and its id is free
+    def create_constraint_native():
+        if id_in_use(cib, name) or not constrainable(cib, [first_resource, second_resource]):
+            return create_constraint()
+        def plan_create(snapshot, patch):
+            if id_in_use(snapshot, name) or not constrainable(snapshot, [first_resource, second_resource]):
+                module.fail_json(msg=f"Resources or id of constraint {name} were changed while it was being created", **result)
+            order = build_order(name, first_resource, first_action, second_resource, second_action, kind, symmetrical)
+            patch.create(snapshot.root.find("configuration/constraints"), order)
+        result["changed"] = True
+        patch, rc, out, err = update_cib(module, plan_create, cib)
+        if patch is None or rc != 0:
+            result["changed"] = False
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg=f"Failed to create constraint {name}", **result)
+        if not module.check_mode:
+            result["message"] += f"Successfully created constraint {name}. "
+
     def delete_constraint(current_constraint):
         result["changed"] = True
         if not module.check_mode:
@@ -192,13 +279,30 @@ def run_module():
                             f"Successfully deleted constraint {constraint_id}. ",
                             f"Failed to delete constraint {constraint_id}")
     
+    # Modifies the attributes of the existing constraint in place, in one atomic CIB update
+    def modify_constraint(constraint_id, changes):
+        def plan_changes(snapshot, patch):
+            constraint = snapshot.get(constraint_id, "rsc_order")
+            if constraint is None:
+                module.fail_json(msg=f"Constraint {constraint_id} was removed while it was being updated", **result)
+            patch.modify(constraint, changes)
+        patch, rc, out, err = update_cib(module, plan_changes, cib)
+        if patch is None or rc != 0:
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg=f"Failed to update constraint {constraint_id}", **result)
+        result["message"] += f"Successfully updated constraint {constraint_id}. "
+
     def update_constraint(current_constraint):
-        if (current_constraint.attrib.get("kind", "Mandatory") != kind or
-        current_constraint.attrib.get("symmetrical", "true") != symmetrical):
+        changes = {}
+        if current_constraint.attrib.get("kind", "Mandatory") != kind:
+            changes["kind"] = kind
+        if current_constraint.attrib.get("symmetrical", "true") != symmetrical:
+            changes["symmetrical"] = symmetrical
+        if changes:
             result["changed"] = True
             if not module.check_mode:
-                delete_constraint(current_constraint)
-                create_constraint()
+                modify_constraint(current_constraint.attrib.get("id"), changes)
         else:
             result["message"] += "No updates necessary: constraint already configured as desired. "
 
@@ -210,6 +314,8 @@ def run_module():
     if state == "present":
         if current_constraint != None:
             update_constraint(current_constraint)
+        elif backend == "native":
+            create_constraint_native()
         else:
             create_constraint()
     else:
@@ -219,6 +325,7 @@ def run_module():
             result["message"] += "No changes needed: constraint does not exist. "
 
     # Success
+    record_if_converged(module, result)
     module.exit_json(**result)
 
 
@@ -37,7 +37,8 @@ options:
     name:
         description:
             - the name of the attribute or property to set or unset
-        required: true
+            - required unless properties or node_attributes is given
+        required: false
         type: str
     value:
         description:
@@ -49,10 +50,69 @@ options:
         description:
             - optional id for an attribute list the parameter and value will be added to
             - other resources can reuse this attribute list by referring to this name using $id-ref
-            - only for use with Suse operating systems
+            - only for use with Suse operating systems; on RedHat properties always go to cib-bootstrap-options, as pcs keeps them there
+            - applies to properties given with name as well as in bulk
         required: false
         default: cib-bootstrap-options
         type: str
+    properties:
+        description:
+            - a dictionary of cluster property names and values, applied together instead of name and value
+            - a null value unsets the property; with state=absent every listed property is unset
+            - the current values are read with one CIB query and all changes are written in a single CIB update
+        required: false
+        type: dict
+    node_attributes:
+        description:
+            - a dictionary of node name to a dictionary of node attribute names and values, handled like properties
+            - may be combined with properties
+        required: false
+        type: dict
+    verify:
+        description:
+            - "memo" skips the run when the same parameters already converged at the current CIB version, with one cibadmin query of the CIB version and without starting pcs or crm
+            - "full" always checks the cluster configuration
+        required: false
+        choices: ["memo", "full"]
+        default: "memo"
+        type: str
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    cib_cache:
+        description:
+            - if true, looks up the current values of a single property or node attribute through the local CIB cache daemon, starting it if needed
+            - the daemon keeps the parsed CIB in memory between module runs; direct reads are used when it cannot be reached
+            - can also be enabled with the CLUSTER_CIB_CACHE environment variable
+        required: false
+        default: false
+        type: bool
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
+
+notes:
+    - in single mode, the current value is looked up with lxml and compiled XPath when lxml is installed on the managed node, unless backend is native (or, for properties, in bulk mode), which plans a CIB patch on ElementTree elements
+
 author:
     - William Sheehan (@wksheehan)
 '''
@@ -63,11 +123,28 @@ EXAMPLES = r'''
     state: present
     name: stonith-timeout
     value: 900
+
+- name: Set several cluster properties and node attributes in one CIB update
+  cluster_property:
+    state: present
+    properties:
+      stonith-enabled: true
+      stonith-timeout: 900
+      concurrent-fencing: null
+    node_attributes:
+      node1:
+        hana_site: SITE1
+      node2:
+        hana_site: SITE2
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command
+from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command, cluster_running, start_trace
+from ansible.module_utils.converge_memo import skip_if_converged, record_if_converged, VERIFY_CHOICES
+from ansible.module_utils.cib_patch import update_cib
+from ansible.module_utils.cib_cache import get_cib_lookup
 from distutils.spawn import find_executable
+import xml.etree.ElementTree as ET
 
 
 def run_module():
@@ -77,9 +154,17 @@ def run_module():
     module_args = dict(
         state=dict(required=False, default="present", choices=["present", "absent"]),
         node=dict(required=False),
-        name=dict(required=True),
+        name=dict(required=False),
         value=dict(required=False),
-        set_name=dict(required=False, default="cib-bootstrap-options")
+        set_name=dict(required=False, default="cib-bootstrap-options"),
+        properties=dict(required=False, type="dict"),
+        node_attributes=dict(required=False, type="dict"),
+        verify=dict(required=False, default="memo", choices=VERIFY_CHOICES),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        cib_cache=dict(required=False, type="bool", default=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
     )
 
     module = AnsibleModule(
@@ -92,12 +177,16 @@ def run_module():
         message=""
     )
 
+    start_trace(module, result)
     os, version = get_os_name_and_version(module, result)
     state       = module.params["state"]
     node        = module.params["node"]
     name        = module.params["name"]
     value       = module.params["value"]
     set_name    = module.params["set_name"]
+    properties  = module.params["properties"]
+    node_attrs  = module.params["node_attributes"]
+    bulk        = properties is not None or node_attrs is not None
     ctype       = "property" if node is None else "attribute"
 
 
@@ -118,46 +207,58 @@ def run_module():
     commands["Suse"  ]["property" ]["unset"]        = "crm_attribute --delete --set-name %s --name %s" % (set_name, name)
     commands["RedHat"]["attribute"]["unset"]        = "pcs node attribute %s %s=" % (node, name)
     commands["Suse"  ]["attribute"]["unset"]        = "crm node attribute %s delete %s" % (node, name)
-    commands["RedHat"]["property" ]["get"]          = "pcs property list --all | grep %s | awk -F'[:]' '{print $2}' | tr -d '[:space:]'" % name # If the value contains spaces there will be an issue during equality comparison
-    commands["Suse"  ]["property" ]["get"]          = "crm_attribute --set-name %s --name %s --query --quiet | tr -d '[:space:]'" % (set_name, name)
-    commands["RedHat"]["attribute"]["get"]          = "pcs node attribute --name %s | grep %s | awk -F'[=]' '{print $2}' | tr -d '[:space:]'" % (name, node)
-    commands["Suse"  ]["attribute"]["get"]          = "crm node show %s | grep %s | awk -F'[=]' '{print $2}' | tr -d '[:space:]'" % (node, name)
-    commands["RedHat"]["property" ]["check"]        = "pcs property show %s | grep %s" % (name, name)
-    commands["Suse"  ]["property" ]["check"]        = "crm configure show %s | grep %s=" % (set_name, name)
-    commands["RedHat"]["attribute"]["check"]        = "pcs node attribute --name %s | grep %s" % (name, node)
-    commands["Suse"  ]["attribute"]["check"]        = "crm node attribute %s show %s" % (node, name)
-    commands["RedHat"]["property" ]["list"]         = "pcs property list"
-    commands["Suse"  ]["property" ]["list"]         = "crm configure show type:property"
-    commands["RedHat"]["attribute"]["list"]         = "pcs node attribute"
-    commands["Suse"  ]["attribute"]["list"]         = "crm configure show type:node"
+
+    # Set pcs and crm keep cluster properties in; pcs always uses cib-bootstrap-options
+    property_sets                                   = {}
+    property_sets["RedHat"]                         = "cib-bootstrap-options"
+    property_sets["Suse"  ]                         = set_name
+
+
+    # Nothing to do if these parameters already converged at the current CIB version
+    skip_if_converged(module, result, "cluster_property")
 
 
     # ==== INITIAL CHECKS ====
 
     if os == "RedHat" and find_executable("pcs") is None:
         module.fail_json(msg="'pcs' executable not found. Install 'pcs'.")
-    if state == "present" and value is None:
+    if bulk and name is not None:
+        module.fail_json(msg="name cannot be combined with properties or node_attributes")
+    if not bulk and name is None:
+        module.fail_json(msg="one of name, properties or node_attributes must be supplied")
+    if not bulk and state == "present" and value is None:
         module.fail_json(msg="value parameter must be supplied when state is present")
-    # Make sure we can communicate with the cluster
-    rc, out, err = module.run_command(commands[os][ctype]["list"])
-    if rc != 0:
+    if node_attrs is not None and any(not isinstance(attributes, dict) for attributes in node_attrs.values()):
+        module.fail_json(msg="node_attributes must map each node name to a dictionary of attributes")
+    # Make sure we can communicate with the cluster (in bulk mode the CIB query itself does this)
+    if not bulk and not cluster_running(module):
         module.fail_json(msg="Unable to retreive cluster properties or node attributes. Is the cluster running?", **result)
 
 
     # ==== FUNCTIONS ====
 
+    # Returns the nvpair setting the property or node attribute, read from the CIB without running pcs or crm, or None
+    def get_nvpair():
+        lookup = get_cib_lookup(module)
+        if ctype == "property":
+            attribute_sets = [lookup.get(property_sets[os], "cluster_property_set")]
+        else:
+            node_element = lookup.get_node(node)
+            attribute_sets = node_element.findall("instance_attributes") if node_element is not None else []
+        for attribute_set in attribute_sets:
+            for nvpair in attribute_set.findall("nvpair") if attribute_set is not None else []:
+                if nvpair.attrib.get("name") == name:
+                    return nvpair
+        return None
+
     # Get the current property value
     def get_property():
-        rc, out, err = module.run_command(commands[os][ctype]["get"], use_unsafe_shell=True)
-        if rc != 0:
-            return None
-        else:
-            return out
+        nvpair = get_nvpair()
+        return nvpair.attrib.get("value") if nvpair is not None else None
     
     # Check if a property value is set to something other than default
     def check_property():
-        rc, out, err = module.run_command(commands[os][ctype]["check"], use_unsafe_shell=True)
-        return rc == 0
+        return get_nvpair() is not None
     
     def set_property():
         result["changed"] = True
@@ -176,9 +277,69 @@ def run_module():
                             "Failed to unset " + name)
 
 
+    # Returns the desired values of bulk properties or attributes, None meaning unset
+    def desired_values(values):
+        if state == "absent":
+            return dict((attribute_name, None) for attribute_name in values)
+        return values
+
+    # Adds the changes needed to bring the nvpairs of the cluster property set to the desired values to the patch
+    # The set is the one single properties go to (see property_sets), so either mode finds a property set by the other
+    # It is created if it does not exist yet; fails if another element already uses its id, as a set created under
+    # another id would not be found again by later runs
+    def plan_property_set(patch, crm_config, values):
+        set_id = property_sets[os]
+        attribute_set = None
+        for child in crm_config.findall("cluster_property_set"):
+            if child.attrib.get("id") == set_id:
+                attribute_set = child
+                break
+        if attribute_set is None:
+            other = patch.snapshot.get(set_id)
+            if other is not None:
+                module.fail_json(msg="Cannot create the cluster property set %s: the id is already used by a %s element" % (set_id, other.tag), **result)
+            attribute_set = ET.Element("cluster_property_set", id=patch.new_id(set_id))
+            changes = patch.set_nvpairs(attribute_set, desired_values(values), new=True)
+            if changes:
+                patch.create(crm_config, attribute_set)
+        else:
+            changes = patch.set_nvpairs(attribute_set, desired_values(values))
+        patch.details.extend(dict(change, node=None) for change in changes)
+
+    # Adds the changes to every requested property and node attribute to the patch
+    def plan_bulk_changes(snapshot, patch):
+        if properties:
+            plan_property_set(patch, snapshot.root.find("configuration/crm_config"), properties)
+        for node_name, attributes in sorted((node_attrs or {}).items()):
+            node_element = snapshot.get_node(node_name)
+            if node_element is None:
+                module.fail_json(msg="Node %s is not part of the cluster" % node_name, **result)
+            changes = patch.set_node_attributes(node_element, desired_values(attributes))
+            patch.details.extend(dict(change, node=node_name) for change in changes)
+
+    # Sets and unsets all requested properties and node attributes with one CIB query and one CIB update
+    def apply_bulk_changes():
+        patch, rc, out, err = update_cib(module, plan_bulk_changes)
+        if patch is None:
+            module.fail_json(msg="Unable to retreive cluster properties or node attributes. Is the cluster running?", **result)
+        result["changes"] = patch.details
+        if rc != 0:
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg="Failed to update %d properties or node attributes" % len(patch.details), **result)
+        if patch.details:
+            result["changed"] = True
+            if not module.check_mode:
+                result["message"] += "Successfully updated %d properties or node attributes. " % len(patch.details)
+        else:
+            result["message"] += "No changes needed: all properties and node attributes already have the desired values. "
+
+
     # ==== MAIN CODE ====
 
-    if state == "present":
+    if bulk:
+        apply_bulk_changes()
+    elif state == "present":
         if get_property() != value:
             set_property()
         else:
@@ -190,6 +351,7 @@ def run_module():
             result["message"] += "No changes needed: %s has not been modified from its default value. " % name
 
     # Success
+    record_if_converged(module, result)
     module.exit_json(**result)
 
 
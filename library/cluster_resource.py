@@ -60,6 +60,62 @@ options:
             - the module will add or remove any extraneous parameters necessary
         required: false
         type: str
+    backend:
+        description:
+            - "cli" creates and renders the resource with pcs or crm
+            - "native" builds the primitive pcs or crm would create in-process and applies it with cibadmin, without starting pcs or crm
+            - with "native", resource_class (and resource_provider for ocf agents) must be given, and only the operations in options are created
+            - on RedHat, pcs adds the default operations of the agent, which only pcs reads, so only options with --no-default-ops and an op monitor are built natively (pcs still adds a monitor without one)
+            - options or agents the native backend cannot build are created with pcs or crm; resources are always deleted with them
+        required: false
+        choices: ["cli", "native"]
+        default: "cli"
+        type: str
+    verify:
+        description:
+            - "memo" skips the run when the same parameters already converged at the current CIB version, with one cibadmin query of the CIB version and without starting pcs or crm
+            - "full" always checks the cluster configuration
+        required: false
+        choices: ["memo", "full"]
+        default: "memo"
+        type: str
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    cib_cache:
+        description:
+            - if true, looks up whether the resource exists through the local CIB cache daemon, starting it if needed
+            - the daemon keeps the parsed CIB in memory between module runs; direct reads are used when it cannot be reached
+            - can also be enabled with the CLUSTER_CIB_CACHE environment variable
+        required: false
+        default: false
+        type: bool
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
+
+notes:
+    - whether the resource exists is looked up with lxml and compiled XPath when lxml is installed on the managed node, unless backend is native (or, for properties, in bulk mode), which plans a CIB patch on ElementTree elements
+
 author:
     - William Sheehan (@wksheehan)
 '''
@@ -71,15 +127,27 @@ EXAMPLES = r'''
     name: my_stonith_resource
     resource-type: stonith
     options: login="username" password="testpass" op monitor interval=3600s
+
+- name: Create a virtual IP without starting pcs (RedHat; on Suse, leave out --no-default-ops)
+  cluster_resource:
+    state: present
+    name: rsc_ip_HA1
+    resource_class: ocf
+    resource_provider: heartbeat
+    resource_type: IPaddr2
+    backend: native
+    options: ip=10.0.0.10 cidr_netmask=24 op monitor interval=10s timeout=20s --no-default-ops
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command
+from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command, cluster_running, start_trace
+from ansible.module_utils.converge_memo import skip_if_converged, record_if_converged, VERIFY_CHOICES
+from ansible.module_utils.cib_diff import diff_elements, RESOURCE_TAGS
+from ansible.module_utils.cib_patch import query_cib, update_cib
+from ansible.module_utils.cib_cache import get_cib_lookup
+from ansible.module_utils.cib_shadow import ShadowWorkspace
+from ansible.module_utils.cib_native import build_primitive, id_in_use, BACKEND_CHOICES
 from distutils.spawn import find_executable
-import xml.etree.ElementTree as ET
-import uuid
-import os as OS
-import tempfile
 
 
 def run_module():
@@ -92,7 +160,14 @@ def run_module():
         resource_class=dict(required=False),
         resource_provider=dict(required=False),
         resource_type=dict(required=False),
-        options=dict(required=False, default="")
+        options=dict(required=False, default=""),
+        backend=dict(required=False, default="cli", choices=BACKEND_CHOICES),
+        verify=dict(required=False, default="memo", choices=VERIFY_CHOICES),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        cib_cache=dict(required=False, type="bool", default=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
     )
 
     module = AnsibleModule(
@@ -105,6 +180,7 @@ def run_module():
         message=""
     )
 
+    start_trace(module, result)
     os, version         = get_os_name_and_version(module, result)
     state               = module.params["state"]
     name                = module.params["name"]
@@ -112,6 +188,7 @@ def run_module():
     resource_provider   = module.params["resource_provider"]
     resource_type       = module.params["resource_type"]
     options             = module.params["options"]
+    backend             = module.params["backend"]
 
     # Formats the class:provider:type parameter for cluster creation
     def format_class_provider_type():
@@ -130,9 +207,6 @@ def run_module():
 
     class_provider_type = format_class_provider_type()
     read_type           = "stonith" if resource_class == "stonith" else "resource"
-    read_command        = "show" if version == "7" else "config"
-    curr_cib_path       = "/var/lib/pacemaker/cib/cib.xml"
-    new_cib_name        = "shadow-cib" + str(uuid.uuid4())
 
 
     # ==== Command dictionary ====
@@ -140,34 +214,29 @@ def run_module():
     commands                                        = {}
     commands["RedHat"]                              = {}
     commands["Suse"  ]                              = {}
-    commands["RedHat"]["status"]                    = "pcs status"
-    commands["Suse"  ]["status"]                    = "crm status"
-    commands["RedHat"]["cib"]                       = {}
-    commands["Suse"  ]["cib"]                       = {}
-    commands["RedHat"]["cib"]["push"]               = "pcs cluster cib-push --config %s" # % new_cib_name
-    commands["Suse"  ]["cib"]["push"]               = "crm cib commit %s"    # % new_cib_name
-    commands["RedHat"]["cib"]["delete"]             = "rm -f %s" # % new_cib_name
-    commands["Suse"  ]["cib"]["delete"]             = "crm cib delete %s"    # % new_cib_name
     commands["RedHat"]["resource"]                  = {}
     commands["Suse"  ]["resource"]                  = {}
-    commands["RedHat"]["resource"]["read"]          = f"pcs {read_type} {read_command} {name}"
-    commands["Suse"  ]["resource"]["read"]          = f"crm config show {name}" 
     commands["RedHat"]["resource"]["create"]        = f"pcs {read_type} create {name} {class_provider_type} {options}"
     commands["Suse"  ]["resource"]["create"]        = f"crm configure primitive {name} {class_provider_type} {options}"
-    commands["RedHat"]["resource"]["update"]        = f"pcs -f {new_cib_name} {read_type} create {name} {class_provider_type} {options}"
-    commands["Suse"  ]["resource"]["update"]        = f"crm -F -c {new_cib_name} configure primitive {name} {class_provider_type} {options}"
+    commands["RedHat"]["resource"]["update"]        = f"{read_type} create {name} {class_provider_type} {options}"       # run against the shadow
+    commands["Suse"  ]["resource"]["update"]        = f"configure primitive {name} {class_provider_type} {options}"     # run against the shadow
     commands["RedHat"]["resource"]["delete"]        = f"pcs resource delete {name}"
     commands["Suse"  ]["resource"]["delete"]        = f"crm configure delete --force {name}"
     
 
+    # Nothing to do if these parameters already converged at the current CIB version
+    skip_if_converged(module, result, "cluster_resource")
+
+
     # ==== Initial checks ====
 
     if os == "RedHat" and find_executable("pcs") is None:
         module.fail_json(msg="'pcs' executable not found. Install 'pcs'.")
     if state == "present" and resource_type is None:
         module.fail_json(msg="Must specify resource_type when state is present", **result)
-    rc, out, err = module.run_command(commands[os]["status"])
-    if rc != 0:
+    # The native backend reads the cluster configuration once, which also makes sure we can communicate with the cluster
+    cib = query_cib(module) if backend == "native" else None
+    if cib is None and (backend == "native" or not cluster_running(module)):
         module.fail_json(msg="Cluster is not running on current node!", **result)
 
 
@@ -175,8 +244,9 @@ def run_module():
     
     # Returns true if a resource with the given name exists
     def resource_exists():
-        rc, out, err = module.run_command(commands[os]["resource"]["read"])
-        return rc == 0
+        lookup = cib if cib is not None else get_cib_lookup(module)
+        resource = lookup.get(name)
+        return resource is not None and resource.tag in RESOURCE_TAGS
 
     # Creates a new resource with the specified options
     def create_resource():
@@ -187,6 +257,31 @@ def run_module():
                             "Resource successfully created. ", 
                             "Failed to create the resource")
     
+    # Returns the primitive pcs or crm would create, built in-process, or None if the native backend cannot build it
+    def build_native_resource():
+        if backend != "native":
+            return None
+        return build_primitive(os, name, resource_class, resource_provider, resource_type, options)
+
+    # Creates the resource pcs or crm would create in one CIB update, without running either
+    # Falls back to the tool if the native backend cannot build the resource
+    def create_resource_native():
+        if build_native_resource() is None or id_in_use(cib, name):
+            return create_resource()
+        def plan_create(snapshot, patch):
+            if id_in_use(snapshot, name):
+                module.fail_json(msg="Unable to create resource %s: its id is already in use" % name, **result)
+            patch.create(snapshot.root.find("configuration/resources"), build_native_resource())
+        result["changed"] = True
+        patch, rc, out, err = update_cib(module, plan_create, cib)
+        if patch is None or rc != 0:
+            result["changed"] = False
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg="Failed to create the resource", **result)
+        if not module.check_mode:
+            result["message"] += "Resource successfully created. "
+
     # Deletes an existing resource
     def remove_resource():
         result["changed"] = True
@@ -197,95 +292,46 @@ def run_module():
                             "Failed to remove the resource")
 
     # Updates an existing resource to match the configuration specified exactly
+    # The desired resource is built natively or rendered in an empty shadow cib, and only the differences are applied to the live CIB as a patch
     def update_resource():
-        # Make sure current cib exists
-        if not OS.path.isfile(curr_cib_path):
-            module.fail_json(msg="Unable to find CIB file for existing resource", **result)
-
-        if os == "Suse":
-            # Need to initialize an empty shadow cib file in os == Suse case
-            cmd = "crm cib new %s empty" % new_cib_name
-            rc, out, err = module.run_command(cmd)
-            if rc != 0:
-                result["stdout"] = out
-                result["error_message"] = err
-                result["command_used"] = cmd
-                module.fail_json(msg="Error creating shadow cib file before updating resource", **result)
-        
-        # Create the desired resource, without affecting the current cluster, by using temporary (shadow) cib file
-        cmd = commands[os]["resource"]["update"]
-        rc, out, err = module.run_command(cmd) 
+        snapshot = cib
+        new_resource = build_native_resource()
+        if new_resource is None:
+            with ShadowWorkspace(module, os, result) as workspace:
+                snapshot = workspace.open(empty=True)
+                workspace.edit(commands[os]["resource"]["update"],
+                               "Error creating resource using the temporary (shadow) cib file")
+                new_resource = workspace.locate_id(name, "primitive")
+
+        # Adds the changes turning the current resource into the desired one to the patch
+        def plan_update(snapshot, patch):
+            curr_resource = snapshot.get(name, "primitive")
+            if curr_resource is None or new_resource is None:
+                module.fail_json(msg="Unable to find the existing or the desired resource %s" % name, **result)
+            if compare_resources(curr_resource, new_resource):
+                patch.update_element(curr_resource, new_resource)
+
+        patch, rc, out, err = update_cib(module, plan_update, snapshot)
+        if patch is None:
+            module.fail_json(msg="Cluster is not running on current node!", **result)
         if rc != 0:
             result["stdout"] = out
             result["error_message"] = err
-            result["command_used"] = cmd
-            module.fail_json(msg="Error creating resource using the temporary (shadow) cib file", **result)
-        
-        new_cib_path = f"/var/lib/pacemaker/cib/shadow.{new_cib_name}" if os == "Suse" else f"./{new_cib_name}"
-
-        # Get the current and new resource XML objects
-        curr_cib        = ET.parse(curr_cib_path)
-        new_cib         = ET.parse(new_cib_path)
-        curr_resource   = curr_cib.getroot().find(f".//primitive[@id='{name}']")
-        new_resource    = new_cib.getroot().find(f".//primitive[@id='{name}']")
-
-        is_different    = compare_resources(curr_resource, new_resource)
-
-        if is_different:
+            module.fail_json(msg="Failed to update the resource", **result)
+        if len(patch) > 0:
             result["changed"] = True
             if not module.check_mode:
-                # Update the current resource to match the desired resource
-                curr_resource.clear()
-                curr_resource.text = new_resource.text
-                curr_resource.tail = new_resource.tail
-                curr_resource.tag = new_resource.tag
-                curr_resource.attrib = new_resource.attrib
-                curr_resource[:] = new_resource[:]
-                
-                # Write the new XML to shadow cib / temporary cib file
-                updated_xml = ET.ElementTree(curr_cib.getroot()) # Get the updated xml
-                updated_xml.write(new_cib_path)  # Write the xml to the temporary (shadow) cib
-
-                # Update the live cluster
-                cmd = commands[os]["cib"]["push"] % new_cib_name
-                rc, out, err = module.run_command(cmd)
-                if rc == 0:
-                    result["message"] += "Successfully updated the resource. "
-                else:
-                    result["changed"] = False
-                    result["stdout"] = out
-                    result["error_message"] = err
-                    result["command_used"] = cmd
-                    # Delete shadow configuration
-                    module.run_command(commands[os]["cib"]["delete"] % new_cib_name)
-                    module.fail_json(msg="Failed to update the resource", **result)
+                result["message"] += "Successfully updated the resource. "
         # No differences
         else:
             result["message"] += "No updates necessary: resource already configured as desired. "
-        
-        # Delete shadow configuration
-        rc, out, err = module.run_command(commands[os]["cib"]["delete"] % new_cib_name)
     
     # Compare two primitive object xmls for differences
-    # Returns 1 (True) if there is a difference, 0 (False) if not
+    # Returns True if there is a difference, False if not, and records the differences found
     def compare_resources(resource1, resource2):
-        # Write the resource xml to a file
-        r1_file_fd, r1_file_path = tempfile.mkstemp()
-        r2_file_fd, r2_file_path = tempfile.mkstemp()
-        r1_file = open(r1_file_path, 'w')
-        r2_file = open(r2_file_path, 'w')
-        r1_file.write(ET.tostring(resource1, "unicode"))
-        r2_file.write(ET.tostring(resource2, "unicode"))
-        r1_file.close()
-        r2_file.close()
-        
-        # Compare difference
-        rc, diff, err = module.run_command(f"diff -w {r1_file_path} {r2_file_path}")
-
-        # Delete temporary files
-        module.run_command(f"rm -f {r1_file_path} {r2_file_path}")
-
-        return rc
+        differences = diff_elements(resource1, resource2)
+        result["differences"] = differences
+        return len(differences) > 0
 
 
     # ==== Main code ====
@@ -293,6 +339,8 @@ def run_module():
     if state == "present":
         if resource_exists():
             update_resource()
+        elif backend == "native":
+            create_resource_native()
         else:
             create_resource()
     else:
@@ -302,6 +350,7 @@ def run_module():
             result["message"] += "No changes needed: resource does not exist. "
 
     # Success
+    record_if_converged(module, result)
     module.exit_json(**result)
 
 
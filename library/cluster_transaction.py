@@ -0,0 +1,267 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, William Sheehan <willksheehan@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cluster_transaction
+
+short_description: groups the changes of several cluster tasks into one CIB update
+
+version_added: "1.0"
+
+description:
+    - "state=begin copies the live CIB into a named shadow CIB and returns the environment (CIB_shadow, CIB_shadow_dir) that points pcs, crm and the pacemaker tools at it"
+    - the cluster_resource, cluster_clone, cluster_group, cluster_order and cluster_colocation tasks of a block run with that environment write into the shadow instead of the live cluster
+    - "state=commit validates the shadow with crm_verify and applies everything the tasks changed to the live CIB as one patch, so the cluster runs one transition instead of one per task"
+    - the commit fails, leaving the live CIB untouched, if the shadow does not validate or the cluster configuration changed since the transaction began
+    - "state=abort drops the shadow and everything the tasks changed"
+    - for RHEL or SUSE operating systems
+
+options:
+    state:
+        description:
+            - "begin" starts a transaction in a new shadow CIB
+            - "commit" validates the transaction and applies it to the live CIB, then removes the shadow
+            - "abort" removes the shadow without applying anything
+        required: true
+        choices: ["begin", "commit", "abort"]
+        type: str
+    name:
+        description:
+            - the name of the transaction and its shadow CIB
+        required: false
+        default: cluster_transaction
+        type: str
+    force:
+        description:
+            - if true, begin drops a leftover transaction of the same name instead of failing
+        required: false
+        default: false
+        type: bool
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
+        type: str
+
+notes:
+    - the shadow is a scratch file, so begin creates it in check mode as well, letting the tasks of the block run in check mode against it
+    - the transaction steps always work on the live CIB, even when run with the transaction's environment
+    - runs against a shadow are never skipped by the verify=memo check of the wrapped modules
+
+author:
+    - William Sheehan (@wksheehan)
+'''
+
+EXAMPLES = r'''
+- name: Begin the transaction
+  cluster_transaction:
+    state: begin
+    name: sap_setup
+  register: transaction
+
+- name: Configure the resources in the transaction
+  environment: "{{ transaction.environment }}"
+  block:
+    - name: Create the virtual IP
+      cluster_resource:
+        name: rsc_ip
+        resource_type: IPaddr2
+        options: ip=10.0.0.10
+    - name: Start the virtual IP after the database
+      cluster_order:
+        first_resource: rsc_db
+        second_resource: rsc_ip
+
+- name: Commit the transaction in one CIB update
+  cluster_transaction:
+    state: commit
+    name: sap_setup
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.helper_functions import run_command, start_trace
+from ansible.module_utils.cib_snapshot import CibSnapshot
+from ansible.module_utils.cib_patch import query_cib, update_cib, element_path
+from ansible.module_utils.cib_shadow import SHADOW_DIR, write_shadow, transaction_paths
+from ansible.module_utils.cib_diff import diff_elements
+from distutils.spawn import find_executable
+import xml.etree.ElementTree as ET
+import json
+import re
+import os as OS
+
+
+def run_module():
+
+    # ==== SETUP ====
+
+    module_args = dict(
+        state=dict(required=True, choices=["begin", "commit", "abort"]),
+        name=dict(required=False, default="cluster_transaction"),
+        force=dict(required=False, type="bool", default=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = dict(
+        changed=False,
+        message=""
+    )
+
+    start_trace(module, result)
+    state       = module.params["state"]
+    name        = module.params["name"]
+    force       = module.params["force"]
+
+    # The transaction steps work on the live CIB, even when run with the transaction's environment
+    OS.environ.pop("CIB_shadow", None)
+
+    shadow_path, origin_path = transaction_paths(name)
+    result["shadow"]        = name
+    result["shadow_path"]   = shadow_path
+    result["environment"]   = dict(CIB_shadow=name, CIB_shadow_dir=SHADOW_DIR)
+
+
+    # ==== INITIAL CHECKS ====
+
+    if find_executable("cibadmin") is None:
+        module.fail_json(msg="'cibadmin' executable not found. Install 'pacemaker-cli'.")
+    if state == "commit" and find_executable("crm_verify") is None:
+        module.fail_json(msg="'crm_verify' executable not found. Install 'pacemaker-cli'.")
+    if not re.match(r"^[A-Za-z0-9_.-]+$", name):
+        module.fail_json(msg="name may only contain letters, digits, '_', '.' and '-'", **result)
+
+
+    # ==== FUNCTIONS ====
+
+    # Returns the (admin_epoch, epoch, num_updates) of the live CIB the transaction's shadow was copied from
+    def read_origin():
+        try:
+            with open(origin_path, "r") as origin_file:
+                return tuple(json.load(origin_file)["version"])
+        except (IOError, OSError, ValueError, KeyError):
+            module.fail_json(msg="No transaction named %s has begun" % name, **result)
+
+    # Removes the transaction's shadow and origin files
+    def remove_transaction():
+        for path in (shadow_path, origin_path):
+            if OS.path.isfile(path):
+                OS.remove(path)
+
+    # Copies the live CIB into the transaction's shadow and records the version it was copied from
+    def begin_transaction():
+        if OS.path.exists(shadow_path) or OS.path.exists(origin_path):
+            if not force:
+                module.fail_json(msg="Transaction %s has already begun: commit or abort it, or begin it again with force" % name, **result)
+            remove_transaction()
+        snapshot = query_cib(module)
+        if snapshot is None:
+            module.fail_json(msg="Cluster is not running on current node!", **result)
+        write_shadow(shadow_path, snapshot.root)
+        with open(origin_path, "w") as origin_file:
+            json.dump(dict(version=list(snapshot.version)), origin_file)
+        result["changed"] = True
+        result["message"] += "Began transaction %s in shadow CIB %s at CIB epoch %d. " % (name, shadow_path, snapshot.version[1])
+
+    # Fails the module, keeping the transaction, if crm_verify finds errors in the shadow
+    def validate_transaction():
+        rc, out, err = run_command(module, ["crm_verify", "--xml-file", shadow_path])
+        if rc != 0:
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg="Transaction %s does not validate: fix it in the shadow or abort it" % name, **result)
+
+    # Adds the changes that turn the live configuration into the shadow's to the patch
+    # Elements are paired by id, and ones the tasks moved (e.g. into a group) are removed before they are created again
+    def plan_commit(snapshot, patch, shadow, origin):
+        if snapshot.version[:2] != origin[:2]:
+            module.fail_json(msg="The cluster configuration changed since transaction %s began (epoch %d, now %d): abort it and run it again"
+                                 % (name, origin[1], snapshot.version[1]), **result)
+        configuration = snapshot.root.find("configuration")
+        shadow_configuration = shadow.root.find("configuration")
+        shadow_elements = dict((element.attrib["id"], element) for element in shadow_configuration.iter() if "id" in element.attrib)
+        for element in configuration.iter():
+            counterpart = shadow_elements.get(element.attrib.get("id"))
+            if counterpart is not None and element_path(snapshot, element) != element_path(shadow, counterpart):
+                patch.delete(element)
+        patch.update_element(configuration, shadow_configuration, by_id=True)
+        patch.details = diff_elements(configuration, shadow_configuration) if len(patch) else []
+
+    # Validates the shadow and applies it to the live CIB in one patch, then removes the transaction
+    def commit_transaction():
+        origin = read_origin()
+        try:
+            shadow = CibSnapshot.from_file(shadow_path)
+        except (IOError, OSError, ET.ParseError) as error:
+            module.fail_json(msg="Unable to read the shadow CIB of transaction %s: %s" % (name, error), **result)
+        validate_transaction()
+        def plan_changes(snapshot, patch):
+            plan_commit(snapshot, patch, shadow, origin)
+        patch, rc, out, err = update_cib(module, plan_changes)
+        if patch is None:
+            module.fail_json(msg="Cluster is not running on current node!", **result)
+        result["changes"] = patch.details
+        if rc != 0:
+            result["stdout"] = out
+            result["error_message"] = err
+            module.fail_json(msg="Failed to commit transaction %s, which is kept for another attempt" % name, **result)
+        if module.check_mode:
+            result["changed"] = len(patch) > 0
+            result["message"] += "Transaction %s would apply %d changes to the live CIB. " % (name, len(patch))
+            return
+        remove_transaction()
+        result["changed"] = len(patch) > 0
+        if len(patch):
+            result["message"] += "Successfully committed transaction %s: %d changes applied in one CIB update. " % (name, len(patch))
+        else:
+            result["message"] += "Transaction %s made no changes to commit. " % name
+
+    # Drops the transaction without applying it
+    def abort_transaction():
+        if not (OS.path.exists(shadow_path) or OS.path.exists(origin_path)):
+            result["message"] += "No changes needed: no transaction named %s has begun. " % name
+            return
+        if not module.check_mode:
+            remove_transaction()
+        result["changed"] = True
+        result["message"] += "Aborted transaction %s. " % name
+
+
+    # ==== MAIN CODE ====
+
+    if state == "begin":
+        begin_transaction()
+    elif state == "commit":
+        commit_transaction()
+    else:
+        abort_transaction()
+
+    # Success
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
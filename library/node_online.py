@@ -26,19 +26,87 @@ options:
     node:
         description:
             - the name of the node
-        required: true
+            - required unless nodes is given
+        required: false
+        type: str
+    nodes:
+        description:
+            - a list of node names, all put online or on standby together
+            - the standby state of every node is read with one CIB query and all changes are written in a single CIB update
+        required: false
+        type: list
+    wait:
+        description:
+            - "drained" waits, after putting the nodes on standby, until no resources are running on them any more
+            - "none" returns as soon as the standby state is written
+            - ignored when bringing nodes online
+        required: false
+        choices: ["none", "drained"]
+        default: "none"
+        type: str
+    wait_timeout:
+        description:
+            - the number of seconds to wait for the nodes to drain
+        required: false
+        default: 300
+        type: int
+    poll_strategy:
+        description:
+            - how often to poll the node states while waiting for the nodes to drain
+            - "backoff" polls after 100ms, doubling the delay up to 5 seconds
+            - "interval" polls every 5 seconds
+        required: false
+        choices: ["backoff", "interval"]
+        default: "backoff"
+        type: str
+    os_family:
+        description:
+            - the os family of the managed node (Suse or RedHat), e.g. "{{ ansible_os_family }}"
+            - when given, /etc/os-release is not read
+        required: false
+        type: str
+    os_version:
+        description:
+            - the major os version of the managed node, e.g. "{{ ansible_distribution_major_version }}"
+            - required along with os_family on RedHat
+        required: false
+        type: str
+    trace:
+        description:
+            - if true, records every command run with its start offset, duration, rc and output size under "perf" in the result
+            - can also be enabled with the CLUSTER_MODULES_TRACE environment variable
+        required: false
+        default: false
+        type: bool
+    trace_file:
+        description:
+            - a local file the trace records are appended to, one JSON object per line
+            - can also be set with the CLUSTER_MODULES_TRACE_FILE environment variable
+        required: false
         type: str
+
 author:
     - William Sheehan (@wksheehan)
 '''
 
 EXAMPLES = r'''
+- name: Put both nodes on standby and wait until their resources have moved away
+  node_online:
+    online: "false"
+    nodes:
+      - node1
+      - node2
+    wait: drained
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.helper_functions import get_os_name_and_version, execute_command
+from ansible.module_utils.helper_functions import get_os_name_and_version, start_trace
+from ansible.module_utils.cib_patch import update_cib
+from ansible.module_utils.cluster_wait import wait_for_nodes, is_drained, POLL_STRATEGIES
 from distutils.spawn import find_executable
-import xml.etree.ElementTree as ET
+
+# Values pacemaker reads as true for the standby node attribute
+TRUE_VALUES = ["on", "yes", "y", "true", "1"]
 
 
 def run_module():
@@ -47,7 +115,15 @@ def run_module():
     
     module_args = dict(
         online=dict(required=False, default="true", choices=["true", "false"]),
-        node=dict(required=True)
+        node=dict(required=False),
+        nodes=dict(required=False, type="list"),
+        wait=dict(required=False, default="none", choices=["none", "drained"]),
+        wait_timeout=dict(required=False, type="int", default=300),
+        poll_strategy=dict(required=False, default="backoff", choices=POLL_STRATEGIES),
+        os_family=dict(required=False),
+        os_version=dict(required=False),
+        trace=dict(required=False, type="bool", default=False),
+        trace_file=dict(required=False)
     )
 
     module = AnsibleModule(
@@ -60,78 +136,84 @@ def run_module():
         message=""
     )
 
+    start_trace(module, result)
     os, version         = get_os_name_and_version(module, result)
     online              = module.params["online"]
     node                = module.params["node"]
+    wait                = module.params["wait"]
+    wait_timeout        = module.params["wait_timeout"]
+    poll_strategy       = module.params["poll_strategy"]
 
-
-    # ==== COMMAND DICTIONARY ====
-
-    commands                                        = {}
-    commands["RedHat"]                              = {}
-    commands["Suse"  ]                              = {}
-    commands["RedHat"]["status"]                    = "pcs status"
-    commands["Suse"  ]["status"]                    = "crm status"
-    commands["RedHat"]["7"  ]                       = {}
-    commands["RedHat"]["8"  ]                       = {}
-    commands["Suse"  ]["all"]                       = {}
-    commands["RedHat"]["7"  ]["status"]             = f"pcs node attribute --name standby | grep '{node}: standby=on'"
-    commands["RedHat"]["8"  ]["status"]             = f"pcs node attribute --name standby | grep '{node}: standby=on'"
-    commands["Suse"  ]["all"]["status"]             = f"crm config show {node} | grep standby=on"
-    commands["RedHat"]["7"  ]["online"]             = f"pcs node unstandby {node}"
-    commands["RedHat"]["8"  ]["online"]             = f"pcs node unstandby {node}"
-    commands["Suse"  ]["all"]["online"]             = f"crm node online {node}"
-    commands["RedHat"]["7"  ]["standby"]            = f"pcs node standby {node}"
-    commands["RedHat"]["8"  ]["standby"]            = f"pcs node standby {node}"
-    commands["Suse"  ]["all"]["standby"]            = f"crm node standby {node}"
+    node_list           = list(module.params["nodes"] or [])
+    if node is not None and node not in node_list:
+        node_list.append(node)
 
 
     # ==== INITIAL CHECKS ====
 
-    if os == "RedHat" and find_executable("pcs") is None:
-        module.fail_json(msg="'pcs' executable not found. Install 'pcs'.")
-    # Make sure we can communicate with the cluster
-    rc, out, err = module.run_command(commands[os]["status"])
-    if rc != 0:
-        module.fail_json(msg="Cluster is not running on current node!", **result)
+    if find_executable("cibadmin") is None:
+        module.fail_json(msg="'cibadmin' executable not found. Install 'pacemaker-cli'.")
+    if len(node_list) == 0:
+        module.fail_json(msg="one of node or nodes must be supplied")
 
 
     # ==== FUNCTIONS ====
 
-    # Checks if a node is online or not
-    def node_online():
-        rc, out, err = module.run_command(commands[os][version]["status"], use_unsafe_shell=True)
-        return rc != 0
-
-    def bring_node_online():
-        result["changed"] = True
-        if not module.check_mode:
-            cmd = commands[os][version]["online"]
-            execute_command(module, result, cmd, 
-                            f"Successfully brought node online. ",
-                            f"Failed to bring node online")
-    
-    def put_node_on_standby():
-        result["changed"] = True
-        if not module.check_mode:
-            cmd = commands[os][version]["standby"]
-            execute_command(module, result, cmd, 
-                            f"Successfully put node on standby. ",  
-                            f"Failed to put node on standby")
+    # Adds the standby attribute changes for every node to the patch
+    # Standby is set to "on"; bringing a node online removes the attribute, as pcs node unstandby does
+    def plan_changes(snapshot, patch):
+        for node_name in node_list:
+            node_element = snapshot.get_node(node_name)
+            if node_element is None:
+                module.fail_json(msg="Node %s is not part of the cluster" % node_name, **result)
+            attribute_set = node_element.find("instance_attributes")
+            standby = None
+            if attribute_set is not None:
+                standby = dict((nvpair.attrib.get("name"), nvpair.attrib.get("value")) for nvpair in attribute_set.findall("nvpair")).get("standby")
+            on_standby = standby is not None and standby.lower() in TRUE_VALUES
+            if online == "true" and on_standby:
+                patch.set_node_attributes(node_element, dict(standby=None))
+                patch.details.append(node_name)
+            elif online == "false" and not on_standby:
+                patch.set_node_attributes(node_element, dict(standby="on"))
+                patch.details.append(node_name)
+
+    # Waits until no resources are running on any of the nodes
+    def wait_until_drained():
+        time_to_drained = wait_for_nodes(module, node_list, is_drained, wait_timeout, poll_strategy)
+        result["time_to_drained"] = time_to_drained
+        still_running = [node_name for node_name in node_list if node_name not in time_to_drained]
+        if still_running:
+            module.fail_json(msg="Timed out after %d seconds waiting for resources to leave %s" % (wait_timeout, ", ".join(still_running)), **result)
 
 
     # ==== MAIN CODE ====
 
+    patch, rc, out, err = update_cib(module, plan_changes)
+    if patch is None:
+        module.fail_json(msg="Cluster is not running on current node!", **result)
+    result["nodes_changed"] = patch.details
+    if rc != 0:
+        result["stdout"] = out
+        result["error_message"] = err
+        module.fail_json(msg="Failed to change the standby state of %s" % ", ".join(patch.details), **result)
+
     if online == "true":
-        if node_online():
-            result["message"] += "No changes needed: node is already online. "
+        if patch.details:
+            result["changed"] = True
+            if not module.check_mode:
+                result["message"] += "Successfully brought %s online. " % ", ".join(patch.details)
         else:
-            bring_node_online()
+            result["message"] += "No changes needed: all nodes are already online. "
     else:
-        if node_online():
-            put_node_on_standby()
+        if patch.details:
+            result["changed"] = True
+            if not module.check_mode:
+                result["message"] += "Successfully put %s on standby. " % ", ".join(patch.details)
         else:
-            result["message"] += "No changes needed: node is already on standby. "
+            result["message"] += "No changes needed: all nodes are already on standby. "
+        if wait == "drained" and not module.check_mode:
+            wait_until_drained()
 
     # Success
     module.exit_json(**result)
@@ -0,0 +1,333 @@
+# ==== Reconciling a whole cluster configuration with one desired-state document ====
+#
+# A desired-state document declares cluster properties, resource and operation defaults, resources (primitives,
+# groups and clones) and constraints, either as a dictionary (e.g. YAML in a playbook) or as a CIB configuration
+# fragment. Everything is diffed against one CIB snapshot and the whole delta goes into one CibPatch:
+#  - attribute sets (properties and defaults) get the declared nvpairs set; other nvpairs are left alone
+#  - declared resources are made exactly as declared, keeping the ids of the elements that stay
+#  - constraints are reconciled by cib_constraints, by resources, actions, roles and node
+# With purge, undeclared top-level resources and undeclared constraints are removed as well, except constraints
+# that cannot be declared (resource sets, rules, patterns).
+
+from ansible.module_utils.cib_native import primitive_element, group_element, clone_element
+from ansible.module_utils.cib_diff import RESOURCE_TAGS, diff_elements
+from ansible.module_utils.cib_constraints import CONSTRAINT_TAGS, IDENTITY_FIELDS, SETTING_FIELDS, plan_constraints
+import xml.etree.ElementTree as ET
+import copy
+
+# Keys of a desired-state document given as a dictionary
+DOCUMENT_KEYS   = ("properties", "rsc_defaults", "op_defaults", "resources", "constraints")
+
+# Sections of a CIB configuration fragment that can be declared
+XML_SECTIONS    = ("crm_config", "rsc_defaults", "op_defaults", "resources", "constraints")
+
+# Id of the cluster property set the properties of a dictionary document go to
+PROPERTY_SET    = "cib-bootstrap-options"
+
+# Keys of the declared resources of a dictionary document, by kind
+RESOURCE_KEYS   = dict(
+    primitive   =("kind", "id", "class", "provider", "type", "description", "instance_attributes", "meta_attributes", "operations"),
+    group       =("kind", "id", "resources", "meta_attributes"),
+    clone       =("kind", "id", "resource", "promotable", "meta_attributes")
+)
+
+# Attributes of constraint elements that reference resources
+REFERENCE_ATTRIBUTES = ("rsc", "with-rsc", "first", "then")
+
+
+# ==== Building resources from a dictionary document ====
+
+# Raises ValueError unless the declared resource is a dictionary with an id (optional for clones) and only the keys of its kind
+def check_resource(spec, kind):
+    if not isinstance(spec, dict) or not (spec.get("id") or kind == "clone"):
+        raise ValueError("every declared resource must be a dictionary with an id")
+    unknown = set(spec) - set(RESOURCE_KEYS[kind])
+    if unknown:
+        raise ValueError("unsupported keys for %s %s: %s" % (kind, spec.get("id"), ", ".join(sorted(unknown))))
+
+# Returns a <primitive> element for a declared primitive, e.g.
+# dict(id="vip", type="IPaddr2", instance_attributes=dict(ip="10.0.0.1"), operations=[dict(name="monitor", interval="10s")])
+# class defaults to ocf, and provider to heartbeat for ocf resources
+def build_primitive(spec):
+    check_resource(spec, "primitive")
+    if not spec.get("type"):
+        raise ValueError("primitive %s is missing type" % spec["id"])
+    for declared in spec.get("operations") or []:
+        if not isinstance(declared, dict) or not declared.get("name"):
+            raise ValueError("every operation of primitive %s must be a dictionary with a name" % spec["id"])
+    resource_class = spec.get("class") or "ocf"
+    resource_provider = spec.get("provider") or ("heartbeat" if resource_class == "ocf" else None)
+    return primitive_element(spec["id"], resource_class, resource_provider, spec["type"], spec.get("instance_attributes"),
+                             spec.get("meta_attributes"), spec.get("operations"), description=spec.get("description"))
+
+# Returns a <group> element for a declared group, whose resources are declared primitives in start order
+def build_group(spec):
+    check_resource(spec, "group")
+    if not spec.get("resources"):
+        raise ValueError("group %s must have at least one resource" % spec["id"])
+    for member in spec["resources"]:
+        if isinstance(member, dict) and member.get("kind", "primitive") != "primitive":
+            raise ValueError("resources of group %s must be primitives" % spec["id"])
+    return group_element(spec["id"], [build_primitive(member) for member in spec["resources"]], spec.get("meta_attributes"))
+
+# Returns a clone element for a declared clone of a primitive or group, by default with the id pcs gives it
+# A promotable clone is a <master> element where the CIB schema has no promotable meta attribute (RHEL 7)
+def build_clone(spec, master=False):
+    check_resource(spec, "clone")
+    if not isinstance(spec.get("resource"), dict) or spec["resource"].get("kind", "primitive") not in ("primitive", "group"):
+        raise ValueError("clone %s must have a resource, a primitive or group" % spec.get("id"))
+    resource = build_resource(spec["resource"], master)
+    promotable = spec.get("promotable") in (True, "true", "yes")
+    master = promotable and master
+    clone_id = spec.get("id") or "%s-%s" % (resource.attrib["id"], "master" if master else "clone")
+    meta_attributes = dict(spec.get("meta_attributes") or {})
+    if promotable and not master:
+        meta_attributes = dict([("promotable", True)] + list(meta_attributes.items()))
+    return clone_element(clone_id, resource, meta_attributes, master)
+
+# Returns the element for a declared resource, by its kind: primitive (the default), group or clone
+def build_resource(spec, master=False):
+    kind = spec.get("kind", "primitive") if isinstance(spec, dict) else None
+    if kind == "clone":
+        return build_clone(spec, master)
+    if kind == "group":
+        return build_group(spec)
+    if kind == "primitive":
+        return build_primitive(spec)
+    raise ValueError("kind of a declared resource must be primitive, group or clone, got %s" % kind)
+
+
+# ==== Reading desired-state documents ====
+
+# Returns an empty desired state
+# attribute_sets holds dict(section, tag, set_id, values, element): a set_id of None stands for the first set
+# without a rule, and element is the declared set (with its rule) to create when the set does not exist
+def empty_desired_state():
+    return dict(attribute_sets=[], resources=[], constraints=[])
+
+# Adds a declared attribute set to the desired state, merging the values of sets declared more than once
+def add_attribute_set(desired, section, tag, set_id, values, element=None):
+    for declared in desired["attribute_sets"]:
+        if (declared["section"], declared["set_id"]) == (section, set_id):
+            declared["values"].update(values)
+            return
+    desired["attribute_sets"].append(dict(section=section, tag=tag, set_id=set_id, values=dict(values), element=element))
+
+# Adds the declarations of a dictionary document to the desired state
+# Raises ValueError with a readable message if the document is invalid
+def read_dict_document(desired, document, master=False):
+    unknown = set(document) - set(DOCUMENT_KEYS)
+    if unknown:
+        raise ValueError("unsupported keys in config: %s" % ", ".join(sorted(unknown)))
+    for key in ("properties", "rsc_defaults", "op_defaults"):
+        if not isinstance(document.get(key) or {}, dict):
+            raise ValueError("%s must be a dictionary of names and values" % key)
+    for key in ("resources", "constraints"):
+        if not isinstance(document.get(key) or [], list):
+            raise ValueError("%s must be a list" % key)
+    if document.get("properties"):
+        add_attribute_set(desired, "crm_config", "cluster_property_set", PROPERTY_SET, document["properties"])
+    for dtype in ("rsc", "op"):
+        if document.get(dtype + "_defaults"):
+            add_attribute_set(desired, dtype + "_defaults", "meta_attributes", None, document[dtype + "_defaults"])
+    desired["resources"].extend(build_resource(spec, master) for spec in document.get("resources") or [])
+    for constraint in document.get("constraints") or []:
+        if not isinstance(constraint, dict):
+            raise ValueError("every entry of constraints must be a dictionary")
+        desired["constraints"].append(constraint)
+
+# Returns the declaration of a constraint element, in the form cib_constraints expects
+# Raises ValueError for constraints that cannot be declared: resource sets, rules and other constraint types
+def constraint_declaration(element):
+    ctypes = dict((tag, ctype) for ctype, tag in CONSTRAINT_TAGS.items())
+    ctype = ctypes.get(element.tag)
+    if ctype is None:
+        raise ValueError("unsupported constraint element %s" % element.tag)
+    if len(element):
+        raise ValueError("%s %s: resource sets and rules are not supported" % (element.tag, element.attrib.get("id")))
+    declared = dict(type=ctype, name=element.attrib.get("id"))
+    attributes = set(["id"])
+    for field, attribute, default in IDENTITY_FIELDS[ctype] + SETTING_FIELDS[ctype]:
+        if attribute in element.attrib:
+            declared[field] = element.attrib[attribute]
+            attributes.add(attribute)
+    unknown = set(element.attrib) - attributes
+    if unknown:
+        raise ValueError("%s %s: unsupported attributes %s" % (element.tag, element.attrib.get("id"), ", ".join(sorted(unknown))))
+    return declared
+
+# Adds the declarations of a CIB configuration fragment to the desired state
+# The fragment is a <cib>, a <configuration> or a single section of one
+# Raises ValueError with a readable message if the fragment is invalid
+def read_xml_document(desired, text):
+    try:
+        root = ET.fromstring(text)
+    except ET.ParseError as error:
+        raise ValueError("xml is not a valid CIB fragment: %s" % error)
+    if root.tag == "cib":
+        root = root.find("configuration")
+        if root is None:
+            raise ValueError("xml has no configuration section")
+    sections = list(root) if root.tag == "configuration" else [root]
+    for section in sections:
+        if section.tag not in XML_SECTIONS:
+            raise ValueError("unsupported section %s in xml, expected one of %s" % (section.tag, ", ".join(XML_SECTIONS)))
+        if section.tag == "resources":
+            for resource in section:
+                if resource.tag not in RESOURCE_TAGS:
+                    raise ValueError("unsupported resource element %s in xml" % resource.tag)
+                desired["resources"].append(resource)
+        elif section.tag == "constraints":
+            desired["constraints"].extend(constraint_declaration(constraint) for constraint in section)
+        else:
+            tag = "cluster_property_set" if section.tag == "crm_config" else "meta_attributes"
+            for attribute_set in section:
+                if attribute_set.tag != tag or not attribute_set.attrib.get("id"):
+                    raise ValueError("%s may only hold %s elements with an id" % (section.tag, tag))
+                values = dict((nvpair.attrib.get("name"), nvpair.attrib.get("value")) for nvpair in attribute_set.findall("nvpair"))
+                add_attribute_set(desired, section.tag, tag, attribute_set.attrib["id"], values, attribute_set)
+
+
+# ==== Planning ====
+
+# Returns the id of the resource an element is a member of, or None for a top-level resource
+def parent_resource_id(snapshot, element):
+    parent = snapshot.get_parent(element)
+    if parent is None or parent.tag not in RESOURCE_TAGS:
+        return None
+    return parent.attrib.get("id")
+
+# Returns a copy of an existing resource without its declared descendants, or None if no resource remains in it
+def without_declared(element, declared):
+    remaining = copy.deepcopy(element)
+    def prune(parent):
+        for child in list(parent):
+            if child.tag in RESOURCE_TAGS and child.attrib.get("id") in declared:
+                parent.remove(child)
+            else:
+                prune(child)
+    prune(remaining)
+    if remaining.tag != "primitive" and not any(child.tag in RESOURCE_TAGS for child in remaining.iter() if child is not remaining):
+        return None
+    return remaining
+
+# Adds the changes that make the declared resources exist exactly as declared
+# Resources whose parent changes (grouped, ungrouped, cloned) are removed and created again under the new parent
+# Without purge, undeclared resources are kept, at the top level if they were members of a declared resource
+# Returns the ids of the resources that exist once the patch applies
+# Raises ValueError if a resource is declared twice or its id is used by an element that is not a resource
+def plan_resources(snapshot, patch, resources, purge=False):
+    section = snapshot.root.find("configuration/resources")
+    declared = {}   # Declared resource id -> id of the resource it is a member of, None at the top level
+    def declare(element, parent_id):
+        resource_id = element.attrib.get("id")
+        if resource_id in declared:
+            raise ValueError("resource %s is declared more than once" % resource_id)
+        existing = snapshot.get(resource_id)
+        if existing is not None and existing.tag not in RESOURCE_TAGS:
+            raise ValueError("id %s of a declared resource is already used by a %s element" % (resource_id, existing.tag))
+        declared[resource_id] = parent_id
+        for child in element:
+            if child.tag in RESOURCE_TAGS:
+                declare(child, resource_id)
+    for resource in resources:
+        declare(resource, None)
+
+    existing_resources = [element for element in section.iter() if element.tag in RESOURCE_TAGS]
+    for element in existing_resources:
+        resource_id = element.attrib.get("id")
+        parent_id = parent_resource_id(snapshot, element)
+        if resource_id in declared and declared[resource_id] != parent_id:
+            patch.delete(element)
+            patch.details.append(dict(section="resources", id=resource_id, change="moved", after=declared[resource_id] or "top level"))
+        elif resource_id not in declared and parent_id in declared and not purge and not patch.is_deleted(element):
+            patch.delete(element)
+            remaining = without_declared(element, declared)
+            if remaining is not None:
+                patch.ids.update(descendant.attrib["id"] for descendant in remaining.iter() if "id" in descendant.attrib)
+                patch.create(section, remaining)
+                patch.details.append(dict(section="resources", id=resource_id, change="moved", after="top level"))
+    for element in section:
+        if element.tag in RESOURCE_TAGS and element.attrib.get("id") not in declared:
+            if purge:
+                patch.delete(element)
+                patch.details.append(dict(section="resources", id=element.attrib.get("id"), change="removed"))
+            elif element.tag != "primitive" and all(patch.is_deleted(child) for child in element.iter() if child is not element and child.tag in RESOURCE_TAGS):
+                patch.delete(element)
+                patch.details.append(dict(section="resources", id=element.attrib.get("id"), change="removed", reason="no members left"))
+
+    for resource in resources:
+        resource_id = resource.attrib.get("id")
+        existing = snapshot.get(resource_id)
+        if existing is None or patch.is_deleted(existing):
+            patch.create(section, patch.copy_with_new_ids(resource))
+            patch.details.append(dict(section="resources", id=resource_id, change="created"))
+            continue
+        before = len(patch)
+        patch.update_element(existing, resource)
+        if len(patch) > before:
+            patch.details.append(dict(section="resources", id=resource_id, change="modified", differences=diff_elements(existing, resource)))
+
+    kept = set(element.attrib.get("id") for element in existing_resources if not patch.is_deleted(element))
+    moved = set(element.attrib.get("id") for change in patch.changes if change.attrib.get("operation") == "create"
+                for element in change.iter() if element.tag in RESOURCE_TAGS)
+    return kept | moved | set(declared)
+
+# Removes the constraints that reference resources the patch removes, as pcs does when it deletes a resource
+def remove_dangling_constraints(snapshot, patch, resource_ids):
+    section = snapshot.root.find("configuration/constraints")
+    removed = set(element.attrib.get("id") for element in snapshot.root.find("configuration/resources").iter()
+                  if element.tag in RESOURCE_TAGS) - set(resource_ids)
+    for constraint in list(section) if section is not None else []:
+        references = [constraint.attrib.get(attribute) for attribute in REFERENCE_ATTRIBUTES]
+        references.extend(reference.attrib.get("id") for reference in constraint.iter("resource_ref"))
+        if removed.intersection(references) and not patch.is_deleted(constraint):
+            patch.delete(constraint)
+            patch.details.append(dict(section="constraints", id=constraint.attrib.get("id"), change="removed",
+                                      reason="references a removed resource"))
+
+# Adds the changes that set the declared nvpairs of an attribute set, creating the set (and its section) if needed
+# new_set_id is the id of a created set declared without one; sets created in a missing section are collected
+# in new_sections, as section name -> sets, for the caller to create the section with
+def plan_attribute_set(snapshot, patch, declared, new_set_id, new_sections):
+    section = snapshot.root.find("configuration/" + declared["section"])
+    attribute_set = None
+    for candidate in section.findall(declared["tag"]) if section is not None else []:
+        if candidate.attrib.get("id") == declared["set_id"] or (declared["set_id"] is None and candidate.find("rule") is None):
+            attribute_set = candidate
+            break
+    if attribute_set is not None:
+        changes = patch.set_nvpairs(attribute_set, declared["values"])
+        patch.details.extend(dict(change, section=declared["section"], set_name=attribute_set.attrib.get("id")) for change in changes)
+        return
+    element = declared["element"]
+    attribute_set = ET.Element(declared["tag"], dict(element.attrib) if element is not None else {})
+    attribute_set.set("id", patch.new_id(declared["set_id"] or new_set_id))
+    for child in element if element is not None else []:
+        if child.tag != "nvpair":
+            attribute_set.append(patch.copy_with_new_ids(child))
+    changes = patch.set_nvpairs(attribute_set, declared["values"], new=True)
+    if not changes:
+        return
+    if section is None:
+        new_sections.setdefault(declared["section"], []).append(attribute_set)
+    else:
+        patch.create(section, attribute_set)
+    patch.details.append(dict(section=declared["section"], set_name=attribute_set.attrib["id"], change="created"))
+    patch.details.extend(dict(change, section=declared["section"], set_name=attribute_set.attrib["id"]) for change in changes)
+
+# Adds every change that brings the CIB configuration to the desired state to the patch
+# default_set_ids gives the ids of defaults sets to create, by section name (rsc_defaults, op_defaults)
+# Raises ValueError for invalid declarations
+def plan_desired_state(snapshot, patch, desired, default_set_ids, purge=False):
+    resource_ids = plan_resources(snapshot, patch, desired["resources"], purge)
+    plan_constraints(snapshot, patch, desired["constraints"], "present", purge, resource_ids)
+    remove_dangling_constraints(snapshot, patch, resource_ids)
+    new_sections = {}
+    for declared in desired["attribute_sets"]:
+        plan_attribute_set(snapshot, patch, declared, default_set_ids.get(declared["section"]), new_sections)
+    configuration = snapshot.root.find("configuration")
+    for section_name, attribute_sets in sorted(new_sections.items()):
+        section = ET.Element(section_name)
+        section.extend(attribute_sets)
+        patch.create(configuration, section)
@@ -0,0 +1,322 @@
+# ==== Optional local daemon keeping the parsed CIB in memory between module runs ====
+#
+# Every module run is a fresh process that would otherwise parse the whole CIB again for a few lookups.
+# With caching enabled, the first module run forks a small daemon that keeps a CibSnapshot of the CIB file
+# and answers lookups over a Unix socket; later runs only pay for a socket round trip. The snapshot is
+# dropped when inotify reports a write to the CIB file (or, without inotify, when the file's inode, size,
+# modification time or epoch changes), and the daemon exits after IDLE_TIMEOUT seconds without requests.
+# Each CIB file (the live CIB, a CIB_file or a CIB_shadow) gets its own daemon, on a socket named after its path.
+# Modules fall back to reading the CIB file directly whenever the daemon cannot be reached.
+
+from ansible.module_utils.cib_snapshot import CibSnapshot, get_cib_path, read_cib_version
+from ansible.module_utils.cib_query import get_cib_query
+import xml.etree.ElementTree as ET
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import os as OS
+from time import sleep, time
+
+CACHE_ENV       = "CLUSTER_CIB_CACHE"   # set to 1/true/yes to use the cache daemon in every module run
+CACHE_SOCKET    = OS.environ.get("CLUSTER_CIB_CACHE_SOCKET", "/run/cluster_modules/cib-cache.sock")  # see cache_socket
+IDLE_TIMEOUT    = 600   # Seconds without requests after which the daemon exits
+START_TIMEOUT   = 2     # Seconds to wait for a newly started daemon to accept connections
+CLIENT_TIMEOUT  = 5     # Seconds to wait for an answer before falling back to direct reads
+
+# inotify flags for a write to a file in the watched directory (pacemaker writes a new file and renames it)
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_CLOEXEC      = 0o2000000
+INOTIFY_EVENT   = struct.Struct("iIII")
+
+# Snapshot lookups answered by the daemon, each returning elements, a list of elements or a plain value
+LOOKUPS = dict(
+    get                 ="element",
+    get_node            ="element",
+    find_all            ="elements",
+    get_orders          ="elements",
+    get_colocations     ="elements",
+    get_locations       ="elements",
+    get_group_members   ="value"
+)
+
+
+# ==== Daemon ====
+
+# The CIB file's snapshot, re-parsed on first use after the file changed
+class CachedCib:
+
+    def __init__(self, path):
+        self.path       = path
+        self.snapshot   = None
+        self.signature  = None
+        self.stale      = True
+        self.watched    = False
+        self.lock       = threading.Lock()
+
+    # Returns what identifies a version of the CIB file without parsing it
+    def file_signature(self):
+        stat = OS.stat(self.path)
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    # Returns the current snapshot, re-parsing the file if inotify reported a change or, without inotify,
+    # if the file's signature or epoch changed
+    def get(self):
+        with self.lock:
+            if not self.watched and self.snapshot is not None:
+                signature = self.file_signature()
+                if signature != self.signature and read_cib_version(self.path) != self.snapshot.version:
+                    self.stale = True
+                self.signature = signature
+            if self.stale or self.snapshot is None:
+                self.stale = False
+                self.signature = self.file_signature()
+                self.snapshot = CibSnapshot.from_file(self.path)
+            return self.snapshot
+
+    # Marks the snapshot stale on every write to the CIB file reported by inotify, in a background thread
+    # Leaves watched False (so every lookup checks the file instead) if inotify is not available
+    def watch(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            descriptor = libc.inotify_init1(IN_CLOEXEC)
+            if descriptor < 0:
+                return
+            directory = OS.path.dirname(OS.path.abspath(self.path))
+            if libc.inotify_add_watch(descriptor, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE) < 0:
+                OS.close(descriptor)
+                return
+        except (OSError, AttributeError):
+            return
+        name = OS.path.basename(self.path).encode()
+        def read_events():
+            while True:
+                data = OS.read(descriptor, 4096)
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    event_name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0")
+                    offset += INOTIFY_EVENT.size + length
+                    if event_name == name:
+                        with self.lock:
+                            self.stale = True
+        thread = threading.Thread(target=read_events)
+        thread.daemon = True
+        thread.start()
+        self.watched = True
+
+
+# Answers the JSON lookups of one client connection, one request and one answer per line
+class LookupHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            self.server.last_request = time()
+            try:
+                request = json.loads(line)
+                answer = self.server.answer(request.get("lookup"), request.get("args") or [])
+            except (ValueError, TypeError, AttributeError, KeyError, OSError, ET.ParseError) as error:
+                answer = dict(error=str(error))
+            self.wfile.write((json.dumps(answer) + "\n").encode())
+
+
+class CacheServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, cib_path):
+        socketserver.UnixStreamServer.__init__(self, socket_path, LookupHandler)
+        self.cib            = CachedCib(cib_path)
+        self.last_request   = time()
+        self.timeout        = 1
+        self.cib.watch()
+
+    # Returns the answer to one lookup: the CIB path and version, and the serialized result
+    def answer(self, lookup, args):
+        snapshot = self.cib.get()
+        answer = dict(path=self.cib.path, version=list(snapshot.version))
+        if lookup == "version":
+            return answer
+        kind = LOOKUPS[lookup]
+        value = getattr(snapshot, lookup)(*args)
+        if kind == "element":
+            answer["value"] = None if value is None else ET.tostring(value).decode()
+        elif kind == "elements":
+            answer["value"] = [ET.tostring(element).decode() for element in value]
+        else:
+            answer["value"] = value
+        return answer
+
+    # Serves lookups until no request arrived for IDLE_TIMEOUT seconds
+    def serve_until_idle(self):
+        while time() - self.last_request < IDLE_TIMEOUT:
+            self.handle_request()
+
+
+# Runs the daemon on socket_path for the CIB file at cib_path, unless another daemon already answers there
+def serve(socket_path, cib_path):
+    if connect(socket_path) is not None:
+        return
+    directory = OS.path.dirname(socket_path)
+    if not OS.path.isdir(directory):
+        OS.makedirs(directory, 0o700)
+    if OS.path.exists(socket_path):
+        OS.remove(socket_path)
+    previous_umask = OS.umask(0o077)
+    try:
+        server = CacheServer(socket_path, cib_path)
+    finally:
+        OS.umask(previous_umask)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_until_idle()
+    finally:
+        server.server_close()
+        if OS.path.exists(socket_path):
+            OS.remove(socket_path)
+
+# Returns the number of file descriptors a process may have open, an upper bound of the ones it inherited
+def max_descriptors():
+    try:
+        return OS.sysconf("SC_OPEN_MAX")
+    except (ValueError, OSError):
+        return 1024
+
+# Starts the daemon in a detached grandchild of the module process, which keeps no descriptor of the module open
+def start_daemon(socket_path, cib_path):
+    pid = OS.fork()
+    if pid != 0:
+        OS.waitpid(pid, 0)
+        return
+    try:
+        OS.setsid()
+        if OS.fork() == 0:
+            devnull = OS.open(OS.devnull, OS.O_RDWR)
+            for descriptor in (0, 1, 2):
+                OS.dup2(devnull, descriptor)
+            # Descriptors inherited from the module run (e.g. the pipes Ansible reads its output from) would
+            # otherwise stay open for the daemon's lifetime
+            OS.closerange(3, max_descriptors())
+            serve(socket_path, cib_path)
+    finally:
+        OS._exit(0)
+
+
+# ==== Client ====
+
+# Returns the socket of the daemon serving the CIB file at cib_path: CACHE_SOCKET with a hash of the path in its name
+def cache_socket(cib_path):
+    base, extension = OS.path.splitext(CACHE_SOCKET)
+    return "%s-%s%s" % (base, hashlib.sha256(cib_path.encode()).hexdigest()[:16], extension)
+
+# Returns a connected socket to the daemon, or None if no daemon answers
+def connect(socket_path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(CLIENT_TIMEOUT)
+    try:
+        client.connect(socket_path)
+    except (socket.error, OSError):
+        client.close()
+        return None
+    return client
+
+
+# Answers the snapshot lookups the modules make through the daemon, with the same methods as CibSnapshot
+# Elements are copies parsed from the daemon's answers, so they cannot be used with get_parent or patched
+# If the daemon stops answering, the remaining lookups are made on a snapshot read directly from the file
+class CacheClient:
+
+    def __init__(self, connection, cib_path):
+        self.connection = connection
+        self.reader     = connection.makefile("rb")
+        self.path       = cib_path
+        self.fallback   = None
+        self.version    = tuple(self.request("version")["version"])
+
+    # Sends one lookup and returns the daemon's answer
+    # Raises IOError if the daemon failed to answer or serves another CIB file
+    def request(self, lookup, *args):
+        self.connection.sendall((json.dumps(dict(lookup=lookup, args=list(args))) + "\n").encode())
+        answer = json.loads(self.reader.readline() or "null")
+        if not answer or "error" in answer or answer.get("path") != self.path:
+            raise IOError("CIB cache daemon failed to answer %s: %s" % (lookup, (answer or {}).get("error")))
+        self.version = tuple(answer["version"])
+        return answer
+
+    # Returns the lookup's answer as elements, a list of elements or a plain value
+    def lookup(self, lookup, *args):
+        if self.fallback is None:
+            try:
+                value = self.request(lookup, *args)["value"]
+            except (IOError, OSError, ValueError):
+                self.close()
+                self.fallback = get_cib_query(self.path)
+        if self.fallback is not None:
+            self.version = self.fallback.version
+            return getattr(self.fallback, lookup)(*args)
+        if LOOKUPS[lookup] == "element":
+            return None if value is None else ET.fromstring(value)
+        if LOOKUPS[lookup] == "elements":
+            return [ET.fromstring(element) for element in value]
+        return value
+
+    def get(self, element_id, tag=None):
+        return self.lookup("get", element_id, tag)
+
+    def find_all(self, tag):
+        return self.lookup("find_all", tag)
+
+    def get_orders(self, first_resource, second_resource):
+        return self.lookup("get_orders", first_resource, second_resource)
+
+    def get_colocations(self, source_resource, target_resource):
+        return self.lookup("get_colocations", source_resource, target_resource)
+
+    def get_locations(self, resource):
+        return self.lookup("get_locations", resource)
+
+    def get_node(self, uname):
+        return self.lookup("get_node", uname)
+
+    def get_group_members(self, group_name):
+        return self.lookup("get_group_members", group_name)
+
+    def close(self):
+        self.reader.close()
+        self.connection.close()
+
+
+# Returns an object answering snapshot lookups on the CIB file
+# With the cib_cache option or the CLUSTER_CIB_CACHE environment variable set, that is a client of the
+# cache daemon, which is started if it is not running yet; otherwise, or if the daemon cannot be reached,
+# the file is read directly, see get_cib_query
+def get_cib_lookup(module):
+    enabled = module.params.get("cib_cache") or OS.environ.get(CACHE_ENV, "").lower() in ("1", "true", "yes")
+    cib_path = OS.path.abspath(get_cib_path())
+    if enabled:
+        socket_path = cache_socket(cib_path)
+        connection = connect(socket_path)
+        if connection is None:
+            try:
+                start_daemon(socket_path, cib_path)
+            except OSError:
+                pass
+            deadline = time() + START_TIMEOUT
+            while connection is None and time() < deadline:
+                sleep(0.01)
+                connection = connect(socket_path)
+        if connection is not None:
+            try:
+                return CacheClient(connection, cib_path)
+            except (IOError, OSError, ValueError):
+                connection.close()
+    return get_cib_query()
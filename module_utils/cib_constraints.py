@@ -0,0 +1,149 @@
+# ==== Reconciling order, colocation and location constraints against a CIB snapshot ====
+
+from ansible.module_utils.cib_patch import cib_value
+from ansible.module_utils.cib_diff import RESOURCE_TAGS
+import xml.etree.ElementTree as ET
+
+CONSTRAINT_TAGS = dict(order="rsc_order", colocation="rsc_colocation", location="rsc_location")
+
+# Fields that identify a constraint: (parameter, CIB attribute, value when the attribute is absent)
+IDENTITY_FIELDS = dict(
+    order       =[("first_resource", "first", None), ("first_action", "first-action", "start"),
+                  ("second_resource", "then", None), ("second_action", "then-action", "start")],
+    colocation  =[("source_resource", "rsc", None), ("source_role", "rsc-role", "Started"),
+                  ("target_resource", "with-rsc", None), ("target_role", "with-rsc-role", "Started")],
+    location    =[("resource", "rsc", None), ("node", "node", None), ("role", "role", None)]
+)
+
+# Fields that are modified in place on an existing constraint, with the same layout
+SETTING_FIELDS = dict(
+    order       =[("kind", "kind", "Mandatory"), ("symmetrical", "symmetrical", "true")],
+    colocation  =[("score", "score", "INFINITY")],
+    location    =[("score", "score", "INFINITY")]
+)
+
+# Parameters naming resources, which must exist in the CIB
+RESOURCE_FIELDS = ("first_resource", "second_resource", "source_resource", "target_resource", "resource")
+
+# Allowed values of the enumerated parameters
+CHOICES = dict(
+    first_action    =["start", "stop", "promote", "demote"],
+    second_action   =["start", "stop", "promote", "demote"],
+    kind            =["Optional", "Mandatory", "Serialize"],
+    symmetrical     =["true", "false"],
+    source_role     =["Master", "Slave", "Started", "Stopped", "Promoted", "Unpromoted"],
+    target_role     =["Master", "Slave", "Started", "Stopped", "Promoted", "Unpromoted"],
+    role            =["Master", "Slave", "Started", "Stopped", "Promoted", "Unpromoted"]
+)
+
+# Id formats of new constraints without a name, matching the cluster_order and cluster_colocation modules
+ID_FORMATS = dict(
+    order       ="order-{first_action}-{first_resource}-{second_action}-{second_resource}-{kind}-{symmetrical}",
+    colocation  ="colocation-{source_role}-{source_resource}-{target_role}-{target_resource}-{score}",
+    location    ="location-{resource}-{node}-{score}"
+)
+
+
+# Returns the identifying key of an existing constraint element of the given type
+def constraint_key(ctype, element):
+    return (ctype,) + tuple(element.attrib.get(attribute, default) for field, attribute, default in IDENTITY_FIELDS[ctype])
+
+
+# Validates one declared constraint and returns it as a dictionary of type, key, settings and id
+# Raises ValueError with a readable message if the declaration is incomplete or invalid
+def normalize_constraint(declared):
+    ctype = declared.get("type")
+    if ctype not in CONSTRAINT_TAGS:
+        raise ValueError("constraint type must be one of %s, got %s" % (", ".join(sorted(CONSTRAINT_TAGS)), ctype))
+    values = {}
+    for field, attribute, default in IDENTITY_FIELDS[ctype] + SETTING_FIELDS[ctype]:
+        value = cib_value(declared.get(field))
+        values[field] = default if value is None else value
+        if values[field] is None and field != "role":
+            raise ValueError("%s constraint is missing %s" % (ctype, field))
+        if field in CHOICES and values[field] is not None and values[field] not in CHOICES[field]:
+            raise ValueError("%s of %s constraint must be one of %s" % (field, ctype, ", ".join(CHOICES[field])))
+    unknown = set(declared) - set(values) - set(["type", "name"])
+    if unknown:
+        raise ValueError("unsupported fields for %s constraint: %s" % (ctype, ", ".join(sorted(unknown))))
+    return dict(type=ctype,
+                key=(ctype,) + tuple(values[field] for field, attribute, default in IDENTITY_FIELDS[ctype]),
+                identity=[(attribute, values[field]) for field, attribute, default in IDENTITY_FIELDS[ctype]],
+                settings=[(attribute, values[field], default) for field, attribute, default in SETTING_FIELDS[ctype]],
+                resources=[values[field] for field in RESOURCE_FIELDS if field in values],
+                id=declared.get("name") or ID_FORMATS[ctype].format(**values))
+
+
+# Returns True if a constraint element could have been declared: it names its resources (and node) directly,
+# without resource sets, rules or resource patterns
+def declarable(ctype, element):
+    if element.find("resource_set") is not None or element.find("rule") is not None:
+        return False
+    return all(element.attrib.get(attribute) is not None
+               for field, attribute, default in IDENTITY_FIELDS[ctype] if default is None and field != "role")
+
+
+# Returns the existing constraints that could have been declared, indexed by identifying key, in CIB order
+# Other constraints, e.g. ones built from resource sets or rule-based location constraints, are left out, so
+# they never match a declaration and are never purged
+def index_constraints(snapshot):
+    existing = {}
+    for ctype, tag in CONSTRAINT_TAGS.items():
+        for element in snapshot.find_all(tag):
+            if declarable(ctype, element):
+                existing.setdefault(constraint_key(ctype, element), []).append(element)
+    return existing
+
+
+# Adds the creations, in-place modifications and deletions that reconcile the constraints with the declared list
+# With state=absent the declared constraints are removed; with purge every undeclared constraint that could have
+# been declared is removed too, see index_constraints
+# Raises ValueError for invalid declarations or declarations naming resources that do not exist
+# resource_ids, when given, replaces the snapshot's resources as the ones that will exist once the patch applies
+def plan_constraints(snapshot, patch, declared, state="present", purge=False, resource_ids=None):
+    constraints = [normalize_constraint(entry) for entry in declared]
+    keys = [constraint["key"] for constraint in constraints]
+    duplicates = set(key for key in keys if keys.count(key) > 1)
+    if duplicates:
+        raise ValueError("constraints declared more than once: %s" % ", ".join(" ".join(str(part) for part in key) for key in sorted(duplicates)))
+    existing = index_constraints(snapshot)
+    section = snapshot.root.find("configuration/constraints")
+
+    for constraint in constraints:
+        matches = existing.get(constraint["key"], [])
+        if state == "absent":
+            for element in matches:
+                patch.delete(element)
+                patch.details.append(dict(type=constraint["type"], id=element.attrib.get("id"), change="removed"))
+            continue
+        for resource in constraint["resources"]:
+            if resource_ids is not None:
+                if resource not in resource_ids:
+                    raise ValueError("resource %s of %s constraint %s does not exist" % (resource, constraint["type"], constraint["id"]))
+                continue
+            element = snapshot.get(resource)
+            if element is None or element.tag not in RESOURCE_TAGS:
+                raise ValueError("resource %s of %s constraint %s does not exist" % (resource, constraint["type"], constraint["id"]))
+        if not matches:
+            element = ET.Element(CONSTRAINT_TAGS[constraint["type"]], id=patch.new_id(constraint["id"]))
+            for attribute, value in constraint["identity"]:
+                if value is not None:
+                    element.set(attribute, value)
+            for attribute, value, default in constraint["settings"]:
+                element.set(attribute, value)
+            patch.create(section, element)
+            patch.details.append(dict(type=constraint["type"], id=element.attrib["id"], change="created"))
+            continue
+        element = matches[0]
+        changes = dict((attribute, value) for attribute, value, default in constraint["settings"] if element.attrib.get(attribute, default) != value)
+        if changes:
+            patch.modify(element, changes)
+            patch.details.append(dict(type=constraint["type"], id=element.attrib.get("id"), change="modified",
+                                      before=dict((attribute, element.attrib.get(attribute)) for attribute in changes), after=changes))
+
+    if purge and state == "present":
+        declared_keys = set(keys)
+        for key, elements in existing.items():
+            for element in (elements[1:] if key in declared_keys else elements):
+                patch.delete(element)
+                patch.details.append(dict(type=key[0], id=element.attrib.get("id"), change="removed"))
@@ -0,0 +1,150 @@
+# ==== In-memory canonical comparison of CIB XML subtrees ====
+
+# Attributes pacemaker tools generate themselves, so they are not compared
+GENERATED_ATTRIBUTES    = ("id",)
+
+# Element tags whose id is chosen by the user and therefore identifies the element
+RESOURCE_TAGS           = ("primitive", "group", "clone", "master", "bundle")
+
+
+# Returns the key used to pair up an element with its counterpart in the other tree
+# With by_id, every element that has an id is paired by it, as between two versions of the same CIB
+def _element_key(element, occurrence, by_id=False):
+    if element.tag in RESOURCE_TAGS or (by_id and element.attrib.get("id") is not None):
+        return (element.tag, element.attrib.get("id"))
+    if element.tag == "nvpair":
+        return (element.tag, element.attrib.get("name"))
+    if element.tag == "op":
+        return (element.tag, element.attrib.get("name"), element.attrib.get("interval"), element.attrib.get("role"))
+    return (element.tag, occurrence)
+
+
+# Returns a readable path segment for an element key
+def _key_label(key):
+    tag = key[0]
+    if tag in RESOURCE_TAGS:
+        return "%s[@id='%s']" % key
+    if tag == "nvpair":
+        return "nvpair[@name='%s']" % key[1]
+    if tag == "op":
+        label = "op[@name='%s'][@interval='%s']" % (key[1], key[2])
+        return label + ("[@role='%s']" % key[3] if key[3] is not None else "")
+    return tag if key[1] == 0 else "%s[%d]" % (tag, key[1] + 1)
+
+
+# Returns the children of an element as an ordered list of (key, child) pairs
+def _keyed_children(element, by_id=False):
+    occurrences = {}
+    children = []
+    for child in element:
+        occurrence = occurrences.get(child.tag, 0)
+        occurrences[child.tag] = occurrence + 1
+        children.append((_element_key(child, occurrence, by_id), child))
+    return children
+
+
+# Returns the element's text with surrounding whitespace removed
+def _text(element):
+    return (element.text or "").strip()
+
+
+# Appends the differences between two paired elements to differences
+def _diff(element1, element2, path, ignore, differences):
+    if element1.tag != element2.tag:
+        differences.append(dict(path=path, change="modified", attribute="#tag", before=element1.tag, after=element2.tag))
+        return
+    for attribute in sorted(set(element1.attrib) | set(element2.attrib)):
+        if attribute in ignore:
+            continue
+        before = element1.attrib.get(attribute)
+        after = element2.attrib.get(attribute)
+        if before != after:
+            differences.append(dict(path=path, change="modified", attribute=attribute, before=before, after=after))
+    if _text(element1) != _text(element2):
+        differences.append(dict(path=path, change="modified", attribute="#text", before=_text(element1), after=_text(element2)))
+
+    children1 = _keyed_children(element1)
+    children2 = _keyed_children(element2)
+    lookup2 = dict(children2)
+    keys1 = set(key for key, child in children1)
+    for key, child in children1:
+        child_path = path + "/" + _key_label(key)
+        if key in lookup2:
+            _diff(child, lookup2[key], child_path, ignore, differences)
+        else:
+            differences.append(dict(path=child_path, change="removed", attribute=None, before=child.attrib.get("value"), after=None))
+    for key, child in children2:
+        if key not in keys1:
+            differences.append(dict(path=path + "/" + _key_label(key), change="added", attribute=None, before=None, after=child.attrib.get("value")))
+
+    # Member resources start in document order, so their relative order matters
+    order1 = [key for key, child in children1 if key[0] in RESOURCE_TAGS and key in lookup2]
+    order2 = [key for key, child in children2 if key[0] in RESOURCE_TAGS and key in keys1]
+    if order1 != order2:
+        differences.append(dict(path=path, change="moved", attribute=None,
+                                before=[key[1] for key in order1], after=[key[1] for key in order2]))
+
+
+# Compares two CIB elements, ignoring attribute order, whitespace and generated ids
+# Returns a list of attribute-level differences, which is empty when the elements are equivalent
+def diff_elements(element1, element2, ignore=GENERATED_ATTRIBUTES):
+    differences = []
+    _diff(element1, element2, _key_label(_element_key(element1, 0)), ignore, differences)
+    return differences
+
+
+# Pairs up the children of two elements the way diff_elements does, or by id where they have one with by_id
+# Returns (paired, removed, added): (child1, child2) pairs, unpaired children of element1,
+# and (position, child2) for the unpaired children of element2
+def pair_children(element1, element2, by_id=False):
+    lookup1 = dict(_keyed_children(element1, by_id))
+    keys2 = set()
+    paired, added = [], []
+    for position, (key, child) in enumerate(_keyed_children(element2, by_id)):
+        keys2.add(key)
+        if key in lookup1:
+            paired.append((lookup1[key], child))
+        else:
+            added.append((position, child))
+    removed = [child for key, child in _keyed_children(element1, by_id) if key not in keys2]
+    return paired, removed, added
+
+
+# Returns the longest common subsequence of two lists
+def _longest_common_subsequence(list1, list2):
+    lengths = [[0] * (len(list2) + 1) for item in range(len(list1) + 1)]
+    for index1 in range(len(list1) - 1, -1, -1):
+        for index2 in range(len(list2) - 1, -1, -1):
+            if list1[index1] == list2[index2]:
+                lengths[index1][index2] = lengths[index1 + 1][index2 + 1] + 1
+            else:
+                lengths[index1][index2] = max(lengths[index1 + 1][index2], lengths[index1][index2 + 1])
+    common, index1, index2 = [], 0, 0
+    while index1 < len(list1) and index2 < len(list2):
+        if list1[index1] == list2[index2]:
+            common.append(list1[index1])
+            index1 += 1
+            index2 += 1
+        elif lengths[index1 + 1][index2] >= lengths[index1][index2 + 1]:
+            index1 += 1
+        else:
+            index2 += 1
+    return common
+
+
+# Returns the minimal edit sequence turning the ordered list current into desired
+# Members of the longest common subsequence are kept in place; every other member is added, removed or moved
+# Each step is dict(action, item, position), position being the final index for keep, add and move
+def edit_plan(current, desired):
+    common = set(_longest_common_subsequence(current, desired))
+    current_items = set(current)
+    steps = [dict(action="remove", item=item, position=None) for item in current if item not in desired]
+    for position, item in enumerate(desired):
+        if item in common:
+            action = "keep"
+        elif item in current_items:
+            action = "move"
+        else:
+            action = "add"
+        steps.append(dict(action=action, item=item, position=position))
+    return steps
@@ -0,0 +1,218 @@
+# ==== Building the elements pcs and crm create, without starting them ====
+#
+# pcs and crm are large interpreted programs, and starting one costs far more than the CIB change it makes.
+# With backend: native, the cluster_resource, cluster_clone, cluster_group, cluster_order and cluster_colocation
+# modules build the element pcs (RedHat) or crm (Suse) would add to the CIB themselves, with the same layout and
+# generated ids, and apply it with one cibadmin patch. Existing elements are compared with diff_elements, which
+# ignores generated ids, so either backend finds an element created by the other already configured as desired.
+# Builders return None for options they cannot render the way the tool would; the module then runs the tool.
+
+from ansible.module_utils.cib_patch import cib_value, unique_id
+from ansible.module_utils.cib_diff import RESOURCE_TAGS
+import xml.etree.ElementTree as ET
+import shlex
+
+BACKEND_CHOICES = ["cli", "native"]
+
+# Words that start a section of resource options, by the attribute set its name=value pairs go to
+OPTION_SECTIONS = dict(params="instance_attributes", meta="meta_attributes")
+
+# Parents of a resource under which constraints cannot reference it directly, but only through its clone
+CLONE_TAGS = ("clone", "master")
+
+# Ids pcs and crm give operations, from the resource id, the operation name and its interval
+PCS_OP_ID   = "%s-%s-interval-%s"
+CRM_OP_ID   = "%s-%s-%s"
+
+
+# Returns the tokens of an options string, split the way the shell splits the tool's command line, or None
+def split_options(options):
+    try:
+        return shlex.split(options or "")
+    except ValueError:
+        return None
+
+# Returns the name=value tokens as a dictionary in the order given, or None if a token is not a name=value pair
+def parse_pairs(tokens):
+    pairs = {}
+    for token in tokens:
+        name, separator, value = token.partition("=")
+        if not separator or not name:
+            return None
+        pairs[name] = value
+    return pairs
+
+# Returns the instance attributes, meta attributes and operations of pcs or crm resource options, or None
+# e.g. "ip=10.0.0.1 meta target-role=Stopped op monitor interval=10s timeout=20s op start timeout=20s"
+# Operations are dictionaries of op attributes, with name first; pcs starts another operation at a bare word
+# Of the pcs flags, --disabled (meta target-role=Stopped) and --no-default-ops are supported
+def parse_resource_options(os, options):
+    tokens = split_options(options)
+    if tokens is None:
+        return None
+    sections = dict(instance_attributes={}, meta_attributes={})
+    operations = []
+    current = sections["instance_attributes"]
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if os == "RedHat" and token == "--disabled":
+            sections["meta_attributes"]["target-role"] = "Stopped"
+        elif os == "RedHat" and token == "--no-default-ops":
+            pass
+        elif token in OPTION_SECTIONS:
+            current = sections[OPTION_SECTIONS[token]]
+        elif token == "op" or (os == "RedHat" and "=" not in token and operations and current is operations[-1]):
+            if token == "op":
+                index += 1
+            if index >= len(tokens) or "=" in tokens[index] or tokens[index].startswith("-") or tokens[index] in OPTION_SECTIONS:
+                return None
+            current = dict(name=tokens[index])
+            operations.append(current)
+        elif not token.startswith("=") and "=" in token:
+            name, value = token.split("=", 1)
+            current[name] = value
+        else:
+            return None
+        index += 1
+    return sections["instance_attributes"], sections["meta_attributes"], operations
+
+# ==== Resource elements, shared with the desired-state documents of cib_apply ====
+
+# Returns an attribute set element with an nvpair for every value that is not None, in the order given,
+# with the ids pcs and crm give them
+def build_attribute_set(tag, set_id, values):
+    attribute_set = ET.Element(tag, id=set_id)
+    for name, value in values.items():
+        if value is not None:
+            ET.SubElement(attribute_set, "nvpair", id="%s-%s" % (set_id, name), name=name, value=cib_value(value))
+    return attribute_set
+
+# Returns a <primitive> element with the given agent, attribute sets and operations
+# Operations are dictionaries of op attributes with a name; None values are left out and the interval defaults to 0s
+def primitive_element(primitive_id, resource_class, resource_provider, resource_type, instance_attributes=None,
+                      meta_attributes=None, operations=None, op_id_format=PCS_OP_ID, description=None):
+    primitive = ET.Element("primitive", id=primitive_id)
+    primitive.set("class", cib_value(resource_class))
+    if resource_provider:
+        primitive.set("provider", cib_value(resource_provider))
+    primitive.set("type", cib_value(resource_type))
+    if description is not None:
+        primitive.set("description", cib_value(description))
+    if instance_attributes:
+        primitive.append(build_attribute_set("instance_attributes", primitive_id + "-instance_attributes", instance_attributes))
+    if meta_attributes:
+        primitive.append(build_attribute_set("meta_attributes", primitive_id + "-meta_attributes", meta_attributes))
+    if operations:
+        operations_element = ET.SubElement(primitive, "operations")
+        for operation in operations:
+            attributes = dict((name, cib_value(value)) for name, value in operation.items() if value is not None)
+            attributes.setdefault("interval", "0s")
+            attributes["id"] = op_id_format % (primitive_id, attributes["name"], attributes["interval"])
+            ET.SubElement(operations_element, "op", attributes)
+    return primitive
+
+# Returns a <group> element holding the member elements in start order, then its meta attributes
+def group_element(group_id, members, meta_attributes=None):
+    group = ET.Element("group", id=group_id)
+    group.extend(members)
+    if meta_attributes:
+        group.append(build_attribute_set("meta_attributes", group_id + "-meta_attributes", meta_attributes))
+    return group
+
+# Returns a <clone> (or, with master, a <master>) element wrapping the resource element, then its meta attributes
+def clone_element(clone_id, resource, meta_attributes=None, master=False):
+    clone = ET.Element("master" if master else "clone", id=clone_id)
+    clone.append(resource)
+    if meta_attributes:
+        clone.append(build_attribute_set("meta_attributes", clone_id + "-meta_attributes", meta_attributes))
+    return clone
+
+
+# ==== Elements pcs and crm create ====
+
+# Returns the <primitive> pcs or crm creates for a resource, or None if it cannot be built natively
+# The agent must be given in full, with its class (and provider for ocf agents): pcs looks a bare type up among
+# the installed agents. pcs also adds the operations the agent's metadata lists, which only pcs reads: all of them
+# without --no-default-ops, and with it still a monitor unless the options give one. So on RedHat a resource is
+# only built natively with --no-default-ops and an op monitor; crm only adds the operations given in options
+def build_primitive(os, name, resource_class, resource_provider, resource_type, options):
+    parsed = parse_resource_options(os, options)
+    if parsed is None or not resource_class or not resource_type:
+        return None
+    instance_attributes, meta_attributes, operations = parsed
+    if os == "RedHat" and ("--no-default-ops" not in split_options(options)
+                           or "monitor" not in [operation["name"] for operation in operations]):
+        return None
+    if os == "RedHat" and resource_class == "stonith":
+        resource_provider = None
+    if (resource_class == "ocf") != bool(resource_provider):
+        return None
+    return primitive_element(name, resource_class, resource_provider, resource_type, instance_attributes, meta_attributes,
+                             operations, PCS_OP_ID if os == "RedHat" else CRM_OP_ID)
+
+# Returns the clone pcs or crm wraps the resource element in, or None if it cannot be built natively
+# pcs names the clone <resource>-clone (a RHEL 7 master gets clone_name), crm gives it clone_name
+# A promotable clone is a <master> on RHEL 7, and a clone with the promotable meta attribute otherwise
+def build_clone(os, version, resource, clone_name, clone_type, options):
+    tokens = split_options(options)
+    if tokens is None:
+        return None
+    meta_attributes = parse_pairs([token for token in tokens if token != "meta"])
+    if meta_attributes is None:
+        return None
+    master = clone_type == "promotable" and os == "RedHat" and version == "7"
+    if os == "RedHat" and not master:
+        clone_name = resource.attrib["id"] + "-clone"
+    if clone_type == "promotable" and not master:
+        meta_attributes = dict([("promotable", "true")] + list(meta_attributes.items()))
+    return clone_element(clone_name, resource, meta_attributes, master)
+
+# Returns the <group> of the member elements crm creates for the given meta attribute options (pcs takes none)
+# Returns None if the options cannot be built natively
+def build_group(os, name, members, options):
+    tokens = split_options(options) if os == "Suse" else []
+    if tokens is None or (tokens and tokens[0] != "meta"):
+        return None
+    meta_attributes = parse_pairs(tokens[1:])
+    if meta_attributes is None:
+        return None
+    return group_element(name, members, meta_attributes)
+
+# Returns the <rsc_order> pcs and crm create
+def build_order(constraint_id, first_resource, first_action, second_resource, second_action, kind, symmetrical):
+    order = ET.Element("rsc_order", id=constraint_id)
+    order.set("first", first_resource)
+    order.set("first-action", first_action)
+    order.set("then", second_resource)
+    order.set("then-action", second_action)
+    order.set("kind", kind)
+    order.set("symmetrical", symmetrical)
+    return order
+
+# Returns the <rsc_colocation> pcs or crm creates; pcs leaves out roles that are Started, crm writes them
+def build_colocation(os, constraint_id, source_resource, source_role, target_resource, target_role, score):
+    colocation = ET.Element("rsc_colocation", id=constraint_id)
+    colocation.set("rsc", source_resource)
+    if os != "RedHat" or source_role != "Started":
+        colocation.set("rsc-role", source_role)
+    colocation.set("with-rsc", target_resource)
+    if os != "RedHat" or target_role != "Started":
+        colocation.set("with-rsc-role", target_role)
+    colocation.set("score", score)
+    return colocation
+
+# Returns True if a configuration element of the snapshot already uses the id
+def id_in_use(snapshot, element_id):
+    return unique_id(snapshot, element_id) != element_id
+
+# Returns True if every resource exists and constraints may reference it directly, i.e. it is not inside a clone
+# pcs refuses constraints on a cloned resource without --force, so those are left to the tool
+def constrainable(snapshot, resource_ids):
+    for resource_id in resource_ids:
+        resource = snapshot.get(resource_id)
+        if resource is None or not id_in_use(snapshot, resource_id) or resource.tag not in RESOURCE_TAGS:
+            return False
+        if snapshot.get_parent(resource).tag in CLONE_TAGS:
+            return False
+    return True
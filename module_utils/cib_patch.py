@@ -0,0 +1,249 @@
+# ==== Building and applying version 2 CIB patches from a live CIB query ====
+
+from ansible.module_utils.helper_functions import run_command
+from ansible.module_utils.cib_snapshot import CibSnapshot
+from ansible.module_utils.cib_query import xpath_literal
+from ansible.module_utils.cib_diff import pair_children, GENERATED_ATTRIBUTES, RESOURCE_TAGS
+import xml.etree.ElementTree as ET
+import copy
+
+# Number of times a patch is rebuilt from a fresh query when the CIB changed underneath it
+PATCH_ATTEMPTS = 3
+
+
+# Queries the live CIB and returns it as a snapshot, or None if it could not be read
+def query_cib(module):
+    rc, out, err = run_command(module, ["cibadmin", "--query"])
+    if rc != 0:
+        return None
+    try:
+        return CibSnapshot.from_string(out)
+    except ET.ParseError:
+        return None
+
+
+# Returns the xpath of an element of the snapshot, addressing each step by id where it has one
+def element_path(snapshot, element):
+    steps = []
+    while element is not None:
+        element_id = element.attrib.get("id")
+        steps.append(element.tag if element_id is None else "%s[@id=%s]" % (element.tag, xpath_literal(element_id)))
+        element = snapshot.get_parent(element)
+    return "/" + "/".join(reversed(steps))
+
+
+# Returns True if an id used by the snapshot element cannot be given to a new configuration element
+# The status section repeats resource ids in its operation history, which do not make them taken
+def _id_taken(snapshot, element, released):
+    if element is None or (released and released(element)):
+        return False
+    while element is not None:
+        if element.tag == "status":
+            return False
+        element = snapshot.get_parent(element)
+    return True
+
+# Returns an id based on the given one that is not used in the snapshot or reserved by the patch
+# Ids of snapshot elements for which released(element) is true, e.g. ones the patch deletes, can be used again
+def unique_id(snapshot, base, reserved=(), released=None):
+    candidate, counter = base, 0
+    while candidate in reserved or _id_taken(snapshot, snapshot.get(candidate), released):
+        counter += 1
+        candidate = "%s-%d" % (base, counter)
+    return candidate
+
+
+# Returns a module parameter value the way the CIB stores it, keeping None (unset) as is
+def cib_value(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+# A set of changes to the configuration of a queried CIB, expressed as a version 2 patch
+# Changes reference elements of the snapshot, so the patch only applies to the exact CIB version queried
+class CibPatch:
+
+    def __init__(self, snapshot):
+        self.snapshot   = snapshot
+        self.changes    = []
+        self.ids        = set()
+        self.appended   = {}    # Parent element -> number of children appended to it by the patch
+        self.deleted    = set() # Elements deleted by the patch, whose descendants are gone as well
+        self.details    = []    # Readable records of the changes, filled in by the caller for the module result
+
+    def __len__(self):
+        return len(self.changes)
+
+    # Reserves and returns an unused id based on the given one, which may be the id of an element the patch deletes
+    def new_id(self, base):
+        element_id = unique_id(self.snapshot, base, self.ids, self.is_deleted)
+        self.ids.add(element_id)
+        return element_id
+
+    # Returns True if the patch deletes the element or one of its ancestors
+    def is_deleted(self, element):
+        while element is not None:
+            if element in self.deleted:
+                return True
+            element = self.snapshot.get_parent(element)
+        return False
+
+    # Returns a copy of a new element whose ids, and those of its descendants, are made unique
+    def copy_with_new_ids(self, element):
+        new_element = copy.deepcopy(element)
+        for descendant in new_element.iter():
+            if descendant.attrib.get("id") is not None:
+                descendant.set("id", self.new_id(descendant.attrib["id"]))
+        return new_element
+
+    # Adds a new element (with its children) under an existing parent, at position or after its last child
+    def create(self, parent, element, position=None):
+        if position is None:
+            position = len(parent) + self.appended.get(parent, 0)
+            self.appended[parent] = self.appended.get(parent, 0) + 1
+        change = ET.Element("change", operation="create", path=element_path(self.snapshot, parent), position=str(position))
+        change.append(element)
+        self.changes.append(change)
+
+    # Sets attributes of an existing element; attributes with a None value are removed
+    def modify(self, element, attributes):
+        change = ET.Element("change", operation="modify", path=element_path(self.snapshot, element))
+        change_list = ET.SubElement(change, "change-list")
+        after = dict(element.attrib)
+        for name, value in sorted(attributes.items()):
+            if value is None:
+                ET.SubElement(change_list, "change-attr", name=name, operation="unset")
+                after.pop(name, None)
+            else:
+                ET.SubElement(change_list, "change-attr", name=name, operation="set", value=value)
+                after[name] = value
+        ET.SubElement(ET.SubElement(change, "change-result"), element.tag, after)
+        self.changes.append(change)
+
+    # Removes an existing element, unless the patch already removes it or one of its ancestors
+    def delete(self, element):
+        if self.is_deleted(element):
+            return
+        self.deleted.add(element)
+        self.changes.append(ET.Element("change", operation="delete", path=element_path(self.snapshot, element)))
+
+    # Moves an existing element to a new position among its siblings
+    def move(self, element, position):
+        self.changes.append(ET.Element("change", operation="move", path=element_path(self.snapshot, element), position=str(position)))
+
+    # Replaces an existing element with a copy of a new one at the same position among its siblings
+    # The ids of the replaced element are free again, so the copy only renames ids used elsewhere
+    def replace(self, element, new_element):
+        parent = self.snapshot.get_parent(element)
+        self.delete(element)
+        self.create(parent, self.copy_with_new_ids(new_element), list(parent).index(element))
+
+    # Adds the changes that turn an existing element into the desired one, e.g. one rendered in a shadow CIB
+    # Children are paired the way diff_elements pairs them, so only what differs is touched and existing ids are kept
+    # New children are copied from the desired element, with ids already used in the CIB made unique
+    # New and reordered member resources are placed in ascending position, so the desired order holds once applied
+    # With by_id, children are paired by id where they have one, for syncing with another version of the same CIB
+    def update_element(self, element, desired, by_id=False):
+        if element.tag != desired.tag:
+            return self.replace(element, desired)
+        attributes = dict((name, value) for name, value in desired.attrib.items()
+                          if name not in GENERATED_ATTRIBUTES and element.attrib.get(name) != value)
+        attributes.update((name, None) for name in element.attrib if name not in GENERATED_ATTRIBUTES and name not in desired.attrib)
+        if attributes:
+            self.modify(element, attributes)
+        paired, removed, added = pair_children(element, desired, by_id)
+        for child in removed:
+            self.delete(child)
+        for child, desired_child in paired:
+            self.update_element(child, desired_child, by_id)
+        placements = [(position, desired_child, None) for position, desired_child in added]
+        members = [(child, desired_child) for child, desired_child in paired if child.tag in RESOURCE_TAGS]
+        if [child for child in element if child in dict(members)] != [child for child, desired_child in members]:
+            desired_children = list(desired)
+            placements.extend((desired_children.index(desired_child), desired_child, child) for child, desired_child in members)
+        for position, desired_child, child in sorted(placements, key=lambda placement: placement[0]):
+            if child is None:
+                self.create(element, self.copy_with_new_ids(desired_child), position)
+            else:
+                self.move(child, position)
+
+    # Adds the changes that bring the nvpairs of an attribute set to the given values, None meaning unset
+    # A new attribute set (one not in the snapshot, to be created by the caller) gets its nvpairs appended directly
+    # Returns dict(name, before, after) for every nvpair that changes
+    def set_nvpairs(self, attribute_set, values, new=False):
+        current = {}
+        if not new:
+            current = dict((nvpair.attrib.get("name"), nvpair) for nvpair in attribute_set.findall("nvpair"))
+        changes = []
+        for name, value in sorted(values.items()):
+            nvpair = current.get(name)
+            before = None if nvpair is None else nvpair.attrib.get("value")
+            after = cib_value(value)
+            if before == after:
+                continue
+            if after is None:
+                self.delete(nvpair)
+            elif nvpair is not None:
+                self.modify(nvpair, {"value": after})
+            else:
+                element = ET.Element("nvpair", id=self.new_id("%s-%s" % (attribute_set.attrib.get("id"), name)), name=name, value=after)
+                if new:
+                    attribute_set.append(element)
+                else:
+                    self.create(attribute_set, element)
+            changes.append(dict(name=name, before=before, after=after))
+        return changes
+
+    # Adds the changes that bring the permanent attributes of a <node> element of the nodes section to the given values
+    # Returns dict(name, before, after) for every attribute that changes
+    def set_node_attributes(self, node, values):
+        attribute_set = node.find("instance_attributes")
+        if attribute_set is not None:
+            return self.set_nvpairs(attribute_set, values)
+        attribute_set = ET.Element("instance_attributes", id=self.new_id("nodes-" + node.attrib.get("id")))
+        changes = self.set_nvpairs(attribute_set, values, new=True)
+        if changes:
+            self.create(node, attribute_set)
+        return changes
+
+    # Returns the patch document, taking the queried CIB version to the next epoch
+    def to_xml(self):
+        admin_epoch, epoch, num_updates = self.snapshot.version
+        diff = ET.Element("diff", format="2")
+        version = ET.SubElement(diff, "version")
+        ET.SubElement(version, "source", admin_epoch=str(admin_epoch), epoch=str(epoch), num_updates=str(num_updates))
+        ET.SubElement(version, "target", admin_epoch=str(admin_epoch), epoch=str(epoch + 1), num_updates="0")
+        diff.extend(self.changes)
+        return ET.tostring(diff).decode()
+
+
+# Applies a patch to the live CIB in a single cibadmin call, with the patch on stdin
+def apply_patch(module, patch):
+    return run_command(module, ["cibadmin", "--patch", "--xml-pipe"], data=patch.to_xml())
+
+
+# Queries the CIB, lets build_patch(snapshot, patch) add the needed changes and applies them in one write
+# A snapshot the caller already queried is used for the first attempt instead of querying again
+# The patch is rebuilt from a fresh query if the CIB changed between the query and the write
+# Returns (patch, rc, out, err); nothing is written in check mode or when no change is needed
+def update_cib(module, build_patch, snapshot=None):
+    failed = None
+    for attempt in range(PATCH_ATTEMPTS):
+        if snapshot is None or attempt > 0:
+            snapshot = query_cib(module)
+        if snapshot is None:
+            return None, 1, "", "Unable to query the CIB"
+        if failed is not None and snapshot.version == failed[0].snapshot.version:
+            return failed
+        patch = CibPatch(snapshot)
+        build_patch(snapshot, patch)
+        if len(patch) == 0 or module.check_mode:
+            return patch, 0, "", ""
+        rc, out, err = apply_patch(module, patch)
+        if rc == 0:
+            return patch, rc, out, err
+        failed = (patch, rc, out, err)
+    return failed
@@ -0,0 +1,118 @@
+# ==== Read-only CIB lookups with lxml and compiled XPath, when lxml is installed ====
+#
+# A module that only looks a few elements up (e.g. cluster_order and cluster_colocation finding an existing
+# constraint) otherwise parses the whole CIB with ElementTree and indexes every element of it. With lxml
+# installed, the CIB is parsed by libxml2 and each lookup is an XPath expression compiled once per module run.
+# Values are passed to the expressions as XPath variables and never formatted into them, so ids containing
+# quotes are matched as they are. Without lxml, lookups are answered by a CibSnapshot, whose indexes compare
+# values as dictionary keys. Either way the lookups have the same methods as CibSnapshot.
+#
+# Only the read-only lookups of get_cib_lookup come here: the existence checks and current values of
+# cluster_resource, cluster_clone, cluster_order, cluster_colocation and single-mode cluster_property.
+# query_cib and ShadowWorkspace.locate keep returning ElementTree elements, because those are copied into CibPatch
+# changes and compared with elements built by the modules, which lxml elements cannot be mixed with. The cache
+# daemon keeps a CibSnapshot, whose indexes pay off over the many lookups it answers per parse.
+
+from ansible.module_utils.cib_snapshot import get_cib_path, get_cib_version, get_cib_snapshot, read_cib_version
+
+try:
+    from lxml import etree as LXML
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+# Lookups by name, taking their values as XPath variables; elements of <status> are never returned, as with CibSnapshot
+# Expressions with a %(tag)s take the element name as well, which XPath cannot take as a variable: they are compiled
+# once per element name, which comes from the module's code (a name test is far faster than comparing name())
+QUERIES = dict(
+    get             = "(/cib/configuration//%(tag)s[@id = $id])[1]",
+    find_all        = "/cib/descendant-or-self::%(tag)s[not(ancestor::status)]",
+    get_orders      = "/cib/configuration/constraints/rsc_order[@first = $first and @then = $then]",
+    get_colocations = "/cib/configuration/constraints/rsc_colocation[@rsc = $rsc and @with-rsc = $with_rsc]",
+    get_locations   = "/cib/configuration/constraints/rsc_location[@rsc = $rsc]",
+    get_node        = "/cib/configuration/nodes/node[@uname = $uname]"
+)
+
+# Lookups already compiled during this module run, keyed by name and element name
+_xpaths = {}
+
+# Lookups already parsed during this module run, keyed by CIB path
+_queries = {}
+
+
+# Returns an XPath string literal for the value, whatever quotes it contains
+# For expressions that cannot take variables, such as the paths of a cibadmin patch
+def xpath_literal(value):
+    if "'" not in value:
+        return "'%s'" % value
+    if '"' not in value:
+        return '"%s"' % value
+    return "concat('%s')" % "', \"'\", '".join(value.split("'"))
+
+
+# Answers the snapshot lookups on a CIB parsed with lxml, with the same methods as CibSnapshot
+# Elements are lxml elements: their tag, attributes and children can be read like ElementTree ones,
+# but they cannot be added to ElementTree elements or patched
+class CibQuery:
+
+    def __init__(self, tree):
+        self.root       = tree.getroot()
+        self.version    = get_cib_version(self.root)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(LXML.parse(path, LXML.XMLParser(huge_tree=True, collect_ids=False)))
+
+    # Returns the elements the named lookup, for elements with the given name, selects with the given variables
+    def select(self, lookup, tag="*", **variables):
+        xpath = _xpaths.get((lookup, tag))
+        if xpath is None:
+            xpath = _xpaths[(lookup, tag)] = LXML.XPath(QUERIES[lookup] % dict(tag=tag))
+        return xpath(self.root, **variables)
+
+    # Returns the first element the named lookup selects, or None
+    def select_one(self, lookup, tag="*", **variables):
+        elements = self.select(lookup, tag, **variables)
+        return elements[0] if elements else None
+
+    def get(self, element_id, tag=None):
+        return self.select_one("get", tag or "*", id=element_id)
+
+    def find_all(self, tag):
+        return self.select("find_all", tag)
+
+    def get_parent(self, element):
+        return element.getparent()
+
+    def get_orders(self, first_resource, second_resource):
+        return self.select("get_orders", first=first_resource, then=second_resource)
+
+    def get_colocations(self, source_resource, target_resource):
+        return self.select("get_colocations", rsc=source_resource, with_rsc=target_resource)
+
+    def get_locations(self, resource):
+        return self.select("get_locations", rsc=resource)
+
+    def get_node(self, uname):
+        return self.select_one("get_node", uname=uname)
+
+    def get_group_members(self, group_name):
+        group = self.get(group_name, "group")
+        if group is None:
+            return None
+        return [child.attrib.get("id") for child in group if child.tag in ("primitive", "clone", "master", "bundle")]
+
+
+# Returns an object answering snapshot lookups on the CIB file, only re-parsing it when its version has changed
+# That is a CibQuery when lxml is installed, and a CibSnapshot otherwise
+def get_cib_query(path=None):
+    if not HAS_LXML:
+        return get_cib_snapshot(path)
+    if path is None:
+        path = get_cib_path()
+    version = read_cib_version(path)
+    query = _queries.get(path)
+    if query is None or query.version != version:
+        query = CibQuery.from_file(path)
+        _queries[path] = query
+    return query
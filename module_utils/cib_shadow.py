@@ -0,0 +1,106 @@
+# ==== Shadow CIB workspace on tmpfs for rendering changes with pcs or crm ====
+
+from ansible.module_utils.helper_functions import run_command
+from ansible.module_utils.cib_snapshot import locate, locate_id
+from ansible.module_utils.cib_patch import query_cib
+import xml.etree.ElementTree as ET
+import tempfile
+import uuid
+import os as OS
+
+# Shadows go to CIB_shadow_dir when set (crm_shadow honours it too), otherwise to tmpfs
+SHADOW_DIR = OS.environ.get("CIB_shadow_dir") or ("/dev/shm" if OS.path.isdir("/dev/shm") else tempfile.gettempdir())
+
+# Sections of an empty CIB configuration
+EMPTY_SECTIONS = ("crm_config", "nodes", "resources", "constraints")
+
+
+# Returns a CIB with the version and schema of the given root but an empty configuration and status
+def empty_cib(root):
+    cib = ET.Element("cib", dict(root.attrib))
+    configuration = ET.SubElement(cib, "configuration")
+    for section in EMPTY_SECTIONS:
+        ET.SubElement(configuration, section)
+    ET.SubElement(cib, "status")
+    return cib
+
+
+# Writes a new shadow CIB file, readable only by the current user; fails if the file already exists
+def write_shadow(path, root):
+    descriptor = OS.open(path, OS.O_WRONLY | OS.O_CREAT | OS.O_EXCL, 0o600)
+    with OS.fdopen(descriptor, "wb") as shadow_file:
+        shadow_file.write(ET.tostring(root))
+
+# Returns the path of the named shadow a cluster_transaction keeps, and the one of the file recording the version
+# of the live CIB it was copied from
+def transaction_paths(name):
+    return OS.path.join(SHADOW_DIR, "shadow." + name), OS.path.join(SHADOW_DIR, "transaction.%s.json" % name)
+
+
+# A shadow CIB that several pcs -f / crm -c edits accumulate in, without touching the live cluster
+# The live CIB is queried once: the shadow starts as a copy of it (or as an empty CIB) and the same
+# snapshot is kept so the rendered changes can be applied to the live CIB as one patch
+# Use as a context manager, so the shadow is removed when the module fails as well
+class ShadowWorkspace:
+
+    def __init__(self, module, os_name, result):
+        self.module     = module
+        self.os_name    = os_name
+        self.result     = result
+        self.name       = "shadow-cib" + str(uuid.uuid4())
+        self.path       = OS.path.join(SHADOW_DIR, "shadow." + self.name)
+        self.snapshot   = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Queries the live CIB and writes the shadow from it, readable only by the current user
+    # Returns the snapshot of the live CIB the shadow was made from
+    def open(self, empty=False):
+        self.snapshot = query_cib(self.module)
+        if self.snapshot is None:
+            self.module.fail_json(msg="Cluster is not running on current node!", **self.result)
+        write_shadow(self.path, empty_cib(self.snapshot.root) if empty else self.snapshot.root)
+        return self.snapshot
+
+    # Returns the command running the given pcs or crm arguments against the shadow
+    def command(self, args):
+        if self.os_name == "Suse":
+            return "crm -F -c %s %s" % (self.name, args)
+        return "pcs -f %s %s" % (self.path, args)
+
+    # Returns the environment the shadow commands run with
+    # CIB_shadow (set inside a cluster_transaction) would take precedence over the file pcs -f points at, so it is blanked
+    def environment(self):
+        if self.os_name == "Suse":
+            return dict(CIB_shadow_dir=SHADOW_DIR)
+        return dict(CIB_shadow="")
+
+    # Runs pcs or crm arguments against the shadow, failing the module with the given message if they fail
+    def edit(self, args, failure):
+        cmd = self.command(args)
+        rc, out, err = run_command(self.module, cmd, environ=self.environment())
+        if rc != 0:
+            self.result["stdout"] = out
+            self.result["error_message"] = err
+            self.result["command_used"] = cmd
+            self.module.fail_json(msg=failure, **self.result)
+        return out
+
+    # Returns the first configuration element of the shadow, with the edits made so far, for which match is true
+    # The shadow is streamed and reading stops at the match, see locate
+    def locate(self, match):
+        return locate(self.path, match)
+
+    # Returns the configuration element of the shadow with the given id (and tag), or None
+    def locate_id(self, element_id, tag=None):
+        return locate_id(self.path, element_id, tag)
+
+    # Removes the shadow
+    def close(self):
+        if OS.path.isfile(self.path):
+            OS.remove(self.path)
@@ -0,0 +1,273 @@
+# ==== Indexed, cached snapshot of the cluster information base (CIB) ====
+
+import xml.etree.ElementTree as ET
+import io
+import re
+import os as OS
+
+CIB_PATH = "/var/lib/pacemaker/cib/cib.xml"
+VERSION_CHUNK = 512     # Bytes read at a time when looking for the opening <cib> tag
+STATUS_CHUNK = 65536    # Bytes read at a time by _WithoutStatus
+
+# The opening tag of <status>, and the end of the section: its closing tag, or the end of an empty <status/> tag
+STATUS_START = re.compile(rb"<status(?=[\s/>])")
+STATUS_END = re.compile(rb"\A<status[^>]*/>|</status\s*>")
+STATUS_TAIL = 64        # Bytes kept between reads, so a tag split over two reads is still found
+
+# Depth of the configuration items (resources, constraints, attribute sets) in <cib><configuration><section>
+ITEM_DEPTH = 3
+
+# Snapshots already parsed during this module run, keyed by CIB path
+_snapshots = {}
+
+
+# Returns the path of the CIB file the pacemaker tools work on: the CIB_shadow shadow if one is in use
+# (e.g. inside a cluster_transaction), otherwise the CIB_file override or the live CIB
+def get_cib_path():
+    if OS.environ.get("CIB_shadow"):
+        return get_shadow_path(OS.environ["CIB_shadow"])
+    return OS.environ.get("CIB_file", CIB_PATH)
+
+# Returns the path of a named shadow CIB, in CIB_shadow_dir like crm_shadow keeps it
+def get_shadow_path(name):
+    return OS.path.join(OS.environ.get("CIB_shadow_dir") or OS.path.dirname(CIB_PATH), "shadow." + name)
+
+
+# Returns the (admin_epoch, epoch, num_updates) triple of a <cib> element
+def get_cib_version(root):
+    return tuple(int(root.attrib.get(attr, "0")) for attr in ("admin_epoch", "epoch", "num_updates"))
+
+
+# Reads only the opening <cib> tag of a CIB file and returns its version triple
+# The file is read unbuffered in small chunks, so usually only its first chunk is read
+def read_cib_version(path):
+    parser = ET.XMLPullParser(events=("start",))
+    with open(path, "rb", buffering=0) as cib_file:
+        while True:
+            chunk = cib_file.read(VERSION_CHUNK)
+            if not chunk:
+                return None
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                return get_cib_version(element)
+
+
+# Returns a binary file object reading CIB XML given as a path, a string or bytes
+def _open_source(source, is_path):
+    if is_path:
+        return open(source, "rb")
+    return io.BytesIO(source.encode() if isinstance(source, str) else source)
+
+
+# Reads a CIB file object with the contents of its <status> section replaced by an empty <status/>
+# The operation history in <status> can be far larger than the configuration and no lookup uses it, so its bytes are
+# only searched for the closing tag and never parsed; whatever follows <status> is read as it is
+class _WithoutStatus:
+
+    def __init__(self, cib_file):
+        self.file   = cib_file
+        self.buffer = b""
+        self.state  = "before"      # before <status>, inside it or after it
+
+    def read(self, size=-1):
+        while True:
+            chunk = self.file.read(STATUS_CHUNK)
+            data, self.buffer = self.buffer + chunk, b""
+            if self.state == "after":
+                return data
+            if self.state == "before":
+                start = STATUS_START.search(data)
+                if start is not None:
+                    self.state, self.buffer = "inside", data[start.start():]
+                    return data[:start.start()] + b"<status/>"
+                if not chunk:
+                    return data
+                cut = max(len(data) - STATUS_TAIL, 0)
+                self.buffer = data[cut:]
+                if cut:
+                    return data[:cut]
+                continue
+            end = STATUS_END.search(data)
+            if end is not None:
+                self.state, self.buffer = "after", data[end.end():]
+            elif not chunk:
+                return b""          # An unterminated <status>, which the parser reports
+            else:
+                self.buffer = data[-STATUS_TAIL:]
+
+
+# Parses a CIB, given as a path or (with is_path False) as XML text, without the contents of its <status> section,
+# which is kept as an empty element, see _WithoutStatus
+def parse_configuration(source, is_path=True):
+    with _open_source(source, is_path) as cib_file:
+        return ET.parse(_WithoutStatus(cib_file)).getroot()
+
+
+# Returns the first configuration element of a CIB file (a path) for which match(element) is true, or None
+# The file is streamed instead of parsed as a whole: each configuration item is dropped once it is complete and
+# does not match, reading stops at the first match, and the contents of <status> are never parsed
+# match is called with complete elements, from the innermost out
+def locate(path, match):
+    stack = []
+    with open(path, "rb") as cib_file:
+        for event, element in ET.iterparse(_WithoutStatus(cib_file), events=("start", "end")):
+            if event == "start":
+                stack.append(element)
+                continue
+            stack.pop()
+            if len(stack) < 2 or stack[1].tag != "configuration":
+                continue
+            if match(element):
+                return element
+            if len(stack) == ITEM_DEPTH:
+                element.clear()
+                stack[-1].remove(element)
+    return None
+
+# Returns the configuration element of a CIB file with the given id (optionally only if it has the given tag), or None
+def locate_id(path, element_id, tag=None):
+    return locate(path, lambda element: element.attrib.get("id") == element_id and (tag is None or element.tag == tag))
+
+
+# A parsed CIB with lookup indexes, each built the second time a lookup needs it, so later lookups are a dictionary access
+# The first lookup of a kind scans the elements instead, which costs less than indexing them all: a module run that
+# makes a single lookup (e.g. cluster_order finding its constraint) pays for no index, and one that makes several
+# pays for one pass over the elements each index covers
+# The contents of <status> are left out, see parse_configuration
+class CibSnapshot:
+
+    def __init__(self, root):
+        self.root           = root
+        self.version        = get_cib_version(root)
+        self._indexes       = {}
+        self._scanned       = set()     # Indexes whose lookup was answered by a scan once
+
+    @classmethod
+    def from_string(cls, xml):
+        return cls(parse_configuration(xml, is_path=False))
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(parse_configuration(path))
+
+    # Returns the named index, building it with its _index_<name> method the first time it is used
+    def _index(self, name):
+        index = self._indexes.get(name)
+        if index is None:
+            index = self._indexes[name] = getattr(self, "_index_" + name)()
+        return index
+
+    # Returns the value the named index holds under key (or default), answered by scan() if the index was never asked for
+    def _lookup(self, name, key, scan, default=None):
+        if name not in self._indexes and name not in self._scanned:
+            self._scanned.add(name)
+            return scan()
+        return self._index(name).get(key, default)
+
+    # Every element with an id, by id; the first one in document order wins
+    def _index_by_id(self):
+        by_id = {}
+        for element in self.root.iter():
+            element_id = element.attrib.get("id")
+            if element_id is not None:
+                by_id.setdefault(element_id, element)
+        return by_id
+
+    # Every element, by tag
+    def _index_by_type(self):
+        by_type = {}
+        for element in self.root.iter():
+            by_type.setdefault(element.tag, []).append(element)
+        return by_type
+
+    # The parent of every element but the root
+    def _index_parents(self):
+        return dict((child, parent) for parent in self.root.iter() for child in parent)
+
+    # Returns the constraints of the given tag, in document order
+    def _constraints(self, tag):
+        constraints = self.root.find("configuration/constraints")
+        return constraints.findall(tag) if constraints is not None else []
+
+    # Constraints of the given tag, by the values of the given attributes
+    def _index_constraints(self, tag, *attributes):
+        index = {}
+        for element in self._constraints(tag):
+            key = tuple(element.attrib.get(attribute) for attribute in attributes)
+            index.setdefault(key if len(key) > 1 else key[0], []).append(element)
+        return index
+
+    # Returns the constraints of the given tag whose attributes have the given values, without an index
+    def _scan_constraints(self, tag, **values):
+        return [element for element in self._constraints(tag)
+                if all(element.attrib.get(attribute) == value for attribute, value in values.items())]
+
+    def _index_orders(self):
+        return self._index_constraints("rsc_order", "first", "then")
+
+    def _index_colocations(self):
+        return self._index_constraints("rsc_colocation", "rsc", "with-rsc")
+
+    def _index_locations(self):
+        return self._index_constraints("rsc_location", "rsc")
+
+    # The <node> elements of the nodes section, by uname
+    def _index_nodes(self):
+        return dict((node.attrib.get("uname"), node) for node in self._nodes())
+
+    # Returns the <node> elements of the nodes section
+    def _nodes(self):
+        return [node for nodes in self.root.iter("nodes") for node in nodes.findall("node")]
+
+    # Returns the element with the given id (optionally only if it has the given tag), or None
+    def get(self, element_id, tag=None):
+        element = self._lookup("by_id", element_id,
+                               lambda: next((element for element in self.root.iter() if element.attrib.get("id") == element_id), None))
+        if element is None or (tag is not None and element.tag != tag):
+            return None
+        return element
+
+    # Returns all elements with the given tag
+    def find_all(self, tag):
+        return self._lookup("by_type", tag, lambda: list(self.root.iter(tag)), [])
+
+    # Returns the parent element of the given element, or None for the root
+    def get_parent(self, element):
+        return self._index("parents").get(element)
+
+    # Returns all rsc_order constraints ordering first_resource before second_resource
+    def get_orders(self, first_resource, second_resource):
+        return self._lookup("orders", (first_resource, second_resource),
+                            lambda: self._scan_constraints("rsc_order", first=first_resource, then=second_resource), [])
+
+    # Returns all rsc_colocation constraints placing source_resource with target_resource
+    def get_colocations(self, source_resource, target_resource):
+        return self._lookup("colocations", (source_resource, target_resource),
+                            lambda: self._scan_constraints("rsc_colocation", **{"rsc": source_resource, "with-rsc": target_resource}), [])
+
+    # Returns all rsc_location constraints for the given resource
+    def get_locations(self, resource):
+        return self._lookup("locations", resource, lambda: self._scan_constraints("rsc_location", rsc=resource), [])
+
+    # Returns the <node> element of the nodes section with the given uname, or None
+    def get_node(self, uname):
+        return self._lookup("nodes", uname, lambda: next((node for node in self._nodes() if node.attrib.get("uname") == uname), None))
+
+    # Returns the ids of the resources that are direct members of a group, in order
+    def get_group_members(self, group_name):
+        group = self.get(group_name, "group")
+        if group is None:
+            return None
+        return [child.attrib.get("id") for child in group if child.tag in ("primitive", "clone", "master", "bundle")]
+
+
+# Returns a snapshot of the CIB file, only re-parsing it when its version has changed
+def get_cib_snapshot(path=None):
+    if path is None:
+        path = get_cib_path()
+    version = read_cib_version(path)
+    snapshot = _snapshots.get(path)
+    if snapshot is None or snapshot.version != version:
+        snapshot = CibSnapshot.from_file(path)
+        _snapshots[path] = snapshot
+    return snapshot
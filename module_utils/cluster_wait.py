@@ -0,0 +1,56 @@
+# ==== Waiting on structured cluster state with adaptive polling ====
+
+from ansible.module_utils.helper_functions import run_command
+import xml.etree.ElementTree as ET
+from time import sleep, time
+
+POLL_STRATEGIES = ["backoff", "interval"]
+INITIAL_DELAY   = 0.1   # First delay of the backoff strategy, in seconds
+MAX_DELAY       = 5     # Largest delay of the backoff strategy, in seconds
+INTERVAL        = 5     # Fixed delay of the interval strategy, in seconds
+
+
+# Yields the delays to sleep between polls for the given strategy
+def poll_delays(strategy):
+    delay = INITIAL_DELAY if strategy == "backoff" else INTERVAL
+    while True:
+        yield delay
+        if strategy == "backoff":
+            delay = min(delay * 2, MAX_DELAY)
+
+# Returns a dictionary of node name -> node attributes from crm_mon's XML output
+# e.g. {"node1": {"online": "true", "standby": "false", "resources_running": "2", ...}}
+# Returns an empty dictionary if the cluster state could not be read
+def get_node_states(module):
+    rc, out, err = run_command(module, ["crm_mon", "--one-shot", "--as-xml"])
+    if rc != 0:
+        return {}
+    try:
+        root = ET.fromstring(out)
+    except ET.ParseError:
+        return {}
+    return dict((node.attrib.get("name"), dict(node.attrib)) for node in root.iter("node") if "online" in node.attrib)
+
+# Polls the node states until every node satisfies the predicate or the timeout expires
+# Returns a dictionary of node -> seconds taken until the node first satisfied the predicate
+def wait_for_nodes(module, nodes, predicate, timeout, strategy="backoff"):
+    start   = time()
+    reached = {}
+    delays  = poll_delays(strategy)
+    while True:
+        states  = get_node_states(module)
+        elapsed = time() - start
+        for node in nodes:
+            if node not in reached and node in states and predicate(states[node]):
+                reached[node] = round(elapsed, 3)
+        if len(reached) == len(nodes) or elapsed >= timeout:
+            return reached
+        sleep(min(next(delays), timeout - elapsed))
+
+# Returns True if the node state reports the node as online
+def is_online(state):
+    return state.get("online") == "true"
+
+# Returns True if the node state reports no resources running on the node
+def is_drained(state):
+    return state.get("resources_running") == "0"
@@ -0,0 +1,92 @@
+# ==== Memo of desired states already found converged, keyed by CIB version ====
+#
+# A module run that changes nothing records a hash of its desired state together with the version of the
+# CIB file it observed. A later run with the same desired state, while the CIB still has that version, cannot
+# find anything to change either, so it exits with changed: false before reading the CIB or starting pcs or crm.
+# Only the opening tag of the CIB file is read to look the run up. Pacemaker writes the file some time after the
+# live CIB changed, so a match is only trusted once the live CIB, queried without its children, has the same
+# version: one cibadmin run for the <cib> element alone. verify: full forces the full check.
+
+from ansible.module_utils.helper_functions import CACHE_DIR, run_command
+from ansible.module_utils.cib_snapshot import get_cib_path, read_cib_version, get_cib_version
+import xml.etree.ElementTree as ET
+import hashlib
+import json
+import os as OS
+
+MEMO_PATH       = OS.path.join(CACHE_DIR, "converged.json")
+VERIFY_CHOICES  = ["memo", "full"]
+
+# Parameters that do not describe the desired state
+IGNORED_PARAMS  = ("trace", "trace_file", "verify", "cib_cache")
+
+# Key of the desired state and CIB version seen at the start of this module run
+_memo           = dict(key=None, version=None)
+
+
+# Returns the hash identifying a module's desired state, independent of the parameter order
+def desired_state_key(module_name, params):
+    desired = dict((name, value) for name, value in params.items() if name not in IGNORED_PARAMS)
+    return hashlib.sha256((module_name + "\0" + json.dumps(desired, sort_keys=True, default=str)).encode()).hexdigest()
+
+# Returns the (admin_epoch, epoch, num_updates) of the CIB file as a list, or None if it cannot be read
+def current_version():
+    try:
+        version = read_cib_version(get_cib_path())
+    except (IOError, OSError, SyntaxError):
+        return None
+    return list(version) if version is not None else None
+
+# Returns the (admin_epoch, epoch, num_updates) of the live CIB as a list, or None if it cannot be queried
+def live_version(module):
+    rc, out, err = run_command(module, ["cibadmin", "--query", "--xpath", "/cib", "--no-children"])
+    if rc != 0:
+        return None
+    try:
+        return list(get_cib_version(ET.fromstring(out)))
+    except ET.ParseError:
+        return None
+
+# Returns the memo as a dictionary of desired state key -> CIB version
+def read_memo():
+    try:
+        with open(MEMO_PATH, "r") as memo_file:
+            return json.load(memo_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+# Exits the module with changed: false if the same desired state was found converged at the version of the CIB
+# file, and the live CIB still has that version
+# Otherwise remembers the desired state and version, for record_if_converged at the end of the run
+# Runs against a CIB_shadow shadow (inside a cluster_transaction) are never memoized: a shadow's version says
+# nothing about its content once it is created again under the same name
+def skip_if_converged(module, result, module_name):
+    if OS.environ.get("CIB_shadow"):
+        return
+    _memo["key"]        = desired_state_key(module_name, module.params)
+    _memo["version"]    = current_version()
+    if module.params.get("verify") == "full" or _memo["version"] is None:
+        return
+    if read_memo().get(_memo["key"]) == _memo["version"] and live_version(module) == _memo["version"]:
+        result["memo"] = True
+        result["message"] += "No changes needed: desired state already applied at CIB epoch %d. " % _memo["version"][1]
+        module.exit_json(**result)
+
+# Records the desired state as converged if the run changed nothing and the CIB did not change during the run
+# Entries for other CIB versions can never match again, so they are dropped
+def record_if_converged(module, result):
+    if result.get("changed") or _memo["key"] is None or _memo["version"] is None:
+        return
+    if current_version() != _memo["version"]:
+        return
+    memo = dict((key, version) for key, version in read_memo().items() if version == _memo["version"])
+    memo[_memo["key"]] = _memo["version"]
+    try:
+        if not OS.path.isdir(CACHE_DIR):
+            OS.makedirs(CACHE_DIR)
+        temp_path = "%s.%d" % (MEMO_PATH, OS.getpid())
+        with open(temp_path, "w") as memo_file:
+            json.dump(memo, memo_file)
+        OS.rename(temp_path, MEMO_PATH)
+    except (IOError, OSError):
+        pass
@@ -1,32 +1,153 @@
 # ==== Helper functions to be used across the cluster modules ====
 
+import json
+import os as OS
+import threading
+from time import time
+
+OS_RELEASE_PATH = OS.environ.get("CLUSTER_OS_RELEASE", "/etc/os-release")
+CACHE_DIR       = OS.environ.get("CLUSTER_MODULES_CACHE_DIR", "/var/cache/cluster_modules")
+OS_CACHE_PATH   = OS.path.join(CACHE_DIR, "os_release.json")
+PROBE_TIMEOUT   = int(OS.environ.get("CLUSTER_PROBE_TIMEOUT", "10"))
+
+TRACE_ENV       = "CLUSTER_MODULES_TRACE"       # set to 1/true/yes to trace every module run
+TRACE_FILE_ENV  = "CLUSTER_MODULES_TRACE_FILE"  # JSONL file the trace records are appended to
+
+# Results of the cluster liveness probe made during this module run
+_probe_results  = {}
+
+# Command trace of this module run: "perf" is shared with result["perf"] while tracing is enabled
+_trace          = dict(perf=None, start=None, file=None, module_name=None)
+_trace_lock     = threading.Lock()  # commands may be run from several threads of a node fan-out
+
+
+# Returns the key/value pairs of an os-release file, with quotes removed
+def parse_os_release(path=OS_RELEASE_PATH):
+    fields = {}
+    with open(path, "r") as os_release:
+        for line in os_release:
+            line = line.strip()
+            if "=" not in line or line.startswith("#"):
+                continue
+            key, value = line.split("=", 1)
+            fields[key] = value.strip().strip("\"'")
+    return fields
+
+# Maps an os family (os-release NAME or ansible_os_family fact) and version to the names used by the modules
+def normalize_os_name_and_version(os_family, os_version):
+    os_family = "".join(os_family.split())
+    if "SLES" in os_family or os_family == "Suse":
+        return "Suse", "all"
+    if "RedHat" in os_family:
+        return "RedHat", str(os_version).split('.')[0]
+    return None, None
+
+# Returns the cached (os_name, os_version) if the os-release file has not changed since it was cached
+def read_os_cache(mtime):
+    try:
+        with open(OS_CACHE_PATH, "r") as cache_file:
+            cache = json.load(cache_file)
+        if cache.get("path") == OS_RELEASE_PATH and cache.get("mtime") == mtime:
+            return cache["os_name"], cache["os_version"]
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    return None
+
+# Stores the detected (os_name, os_version) keyed by the os-release file's modification time
+def write_os_cache(mtime, os_name, os_version):
+    try:
+        if not OS.path.isdir(CACHE_DIR):
+            OS.makedirs(CACHE_DIR)
+        temp_path = "%s.%d" % (OS_CACHE_PATH, OS.getpid())
+        with open(temp_path, "w") as cache_file:
+            json.dump(dict(path=OS_RELEASE_PATH, mtime=mtime, os_name=os_name, os_version=os_version), cache_file)
+        OS.rename(temp_path, OS_CACHE_PATH)
+    except (IOError, OSError):
+        pass
+
 # Returns the operating system name (e.g. Suse, RedHat) and major version (e.g. 8)
+# Uses the os_family / os_version module parameters (ansible_os_family / ansible_distribution_major_version facts) when given
 def get_os_name_and_version(module, result):
-    cmd = "egrep '^NAME=' /etc/os-release | awk -F'[=]' '{print $2}' | tr -d '\"[:space:]'"
-    rc, out, err = module.run_command(cmd, use_unsafe_shell=True)
-    if rc != 0:
-        module.fail_json("Could not identify an OS distribution", **result)
-    else:
-        if "SLES" in out:
-            os_name = "Suse"
-        elif "RedHat" in out:
-            os_name = "RedHat"
-        else:
-            module.fail_json("Unrecognized linux distribution", **result)
-    if os_name == "Suse":
-        os_version = "all"
-    else:
-        cmd = "egrep '^VERSION_ID=' /etc/os-release | awk -F'[=]' '{print $2}' | tr -d '\"[:space:]'"
-        rc, out, err = module.run_command(cmd, use_unsafe_shell=True)
-        if rc != 0:
-            module.fail_json("Could not identify OS version", **result)
-        else:
-            os_version = out.split('.')[0]
+    os_family  = module.params.get("os_family")
+    os_version = module.params.get("os_version")
+    if os_family is not None:
+        os_name, os_version = normalize_os_name_and_version(os_family, os_version or "")
+        if os_name is None:
+            module.fail_json(msg="Unrecognized linux distribution", **result)
+        if os_name == "RedHat" and not os_version:
+            module.fail_json(msg="Must specify os_version along with os_family for RedHat", **result)
+        return os_name, os_version
+
+    try:
+        mtime = OS.stat(OS_RELEASE_PATH).st_mtime
+    except OSError:
+        module.fail_json(msg="Could not identify an OS distribution", **result)
+    cached = read_os_cache(mtime)
+    if cached is not None:
+        return cached
+
+    try:
+        fields = parse_os_release(OS_RELEASE_PATH)
+    except (IOError, OSError):
+        module.fail_json(msg="Could not identify an OS distribution", **result)
+    os_name, os_version = normalize_os_name_and_version(fields.get("NAME", ""), fields.get("VERSION_ID", ""))
+    if os_name is None:
+        module.fail_json(msg="Unrecognized linux distribution", **result)
+    if not os_version:
+        module.fail_json(msg="Could not identify OS version", **result)
+    write_os_cache(mtime, os_name, os_version)
     return os_name, os_version
 
+# Enables command tracing when the trace option or the CLUSTER_MODULES_TRACE environment variable is set
+# The trace is reported under result["perf"] and, with trace_file / CLUSTER_MODULES_TRACE_FILE, appended as JSONL
+def start_trace(module, result):
+    enabled = module.params.get("trace") or OS.environ.get(TRACE_ENV, "").lower() in ("1", "true", "yes")
+    if not enabled:
+        return
+    _trace["start"]         = time()
+    _trace["file"]          = module.params.get("trace_file") or OS.environ.get(TRACE_FILE_ENV)
+    _trace["module_name"]   = getattr(module, "_name", None)
+    _trace["perf"]          = dict(commands=[], command_count=0, command_time=0.0)
+    result["perf"]          = _trace["perf"]
+
+# Adds a command to the trace, if tracing is enabled
+def record_command(cmd, started, duration, rc, out, err):
+    perf = _trace["perf"]
+    if perf is None:
+        return
+    record = dict(command=cmd if isinstance(cmd, str) else " ".join(cmd),
+                  start=round(started - _trace["start"], 6),
+                  duration=round(duration, 6),
+                  rc=rc,
+                  stdout_bytes=len(out or ""),
+                  stderr_bytes=len(err or ""))
+    with _trace_lock:
+        perf["commands"].append(record)
+        perf["command_count"] += 1
+        perf["command_time"] = round(perf["command_time"] + duration, 6)
+        if _trace["file"]:
+            try:
+                with open(_trace["file"], "a") as trace_file:
+                    trace_file.write(json.dumps(dict(record, module=_trace["module_name"], pid=OS.getpid(), time=started)) + "\n")
+            except (IOError, OSError):
+                pass
+
+# Runs a command through the module, recording it in the trace
+# environ adds to (or, with empty values, blanks out) the environment variables of the command
+def run_command(module, cmd, unsafe=False, data=None, environ=None):
+    started = time()
+    options = dict(use_unsafe_shell=unsafe)
+    if data is not None:
+        options["data"] = data
+    if environ is not None:
+        options["environ_update"] = environ
+    rc, out, err = module.run_command(cmd, **options)
+    record_command(cmd, started, time() - started, rc, out, err)
+    return rc, out, err
+
 # Executes a command and handles the success or failure
 def execute_command(module, result, cmd, success, failure, unsafe=False):
-    rc, out, err = module.run_command(cmd, use_unsafe_shell=unsafe)
+    rc, out, err = run_command(module, cmd, unsafe)
     if rc == 0:
         result["message"] += success
         return out
@@ -35,4 +156,16 @@ def execute_command(module, result, cmd, success, failure, unsafe=False):
         result["stdout"] = out
         result["error_message"] = err
         result["command_used"] = cmd
-        module.fail_json(msg=failure, **result)
\ No newline at end of file
+        module.fail_json(msg=failure, **result)
+
+# Returns True if pacemaker is running on the current node and its CIB answers a query
+# Only asks for the nodes section, so the cost does not grow with the number of resources
+# The answer is cached for the rest of the module run
+def cluster_running(module, timeout=None):
+    if "running" not in _probe_results:
+        if timeout is None:
+            timeout = PROBE_TIMEOUT
+        cmd = ["cibadmin", "--query", "--scope", "nodes", "--timeout", str(timeout)]
+        rc, out, err = run_command(module, cmd)
+        _probe_results["running"] = rc == 0
+    return _probe_results["running"]
@@ -0,0 +1,28 @@
+# ==== Running per-node work concurrently on a bounded thread pool ====
+
+from concurrent.futures import ThreadPoolExecutor
+import socket
+
+MAX_WORKERS     = 16    # Upper bound on the threads started for one fan-out
+PCSD_PORT       = 2224  # Default port pcsd listens on
+SSH_PORT        = 22    # Port crmsh reaches the other nodes on
+
+
+# Runs function(node) for every node on at most max_workers threads
+# Returns a dictionary of node -> return value; an exception raised for any node is re-raised
+def fan_out(nodes, function, max_workers=MAX_WORKERS):
+    if len(nodes) == 0:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(nodes))) as executor:
+        futures = dict((node, executor.submit(function, node)) for node in nodes)
+    return dict((node, future.result()) for node, future in futures.items())
+
+
+# Returns None if a TCP connection to address:port succeeds within timeout seconds, otherwise the reason it failed
+def check_reachable(address, port, timeout):
+    try:
+        connection = socket.create_connection((address, port), timeout)
+    except (socket.error, OSError) as error:
+        return str(error) or error.__class__.__name__
+    connection.close()
+    return None
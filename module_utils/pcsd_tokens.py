@@ -0,0 +1,44 @@
+# ==== Reading the local pcsd token store ====
+
+from ansible.module_utils.node_fanout import PCSD_PORT
+import json
+import os as OS
+
+PCSD_DIR            = OS.environ.get("CLUSTER_PCSD_DIR", "/var/lib/pcsd")
+KNOWN_HOSTS_PATH    = OS.path.join(PCSD_DIR, "known-hosts")    # pcs 0.10 and later (RHEL 8)
+TOKENS_PATH         = OS.path.join(PCSD_DIR, "tokens")         # pcs 0.9 (RHEL 7)
+
+
+# Returns the nodes the local pcsd holds a token for, as a dictionary of node -> (address, port) of its pcsd
+# Returns an empty dictionary if the token store does not exist or cannot be read
+# A token being held does not mean the node still accepts it: check that with parse_pcsd_status
+def read_known_hosts(version):
+    try:
+        with open(TOKENS_PATH if version == "7" else KNOWN_HOSTS_PATH, "r") as store_file:
+            store = json.load(store_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    known = {}
+    if version == "7":
+        ports = store.get("ports") or {}
+        for node, token in (store.get("tokens") or {}).items():
+            if token:
+                known[node] = (node, int(ports.get(node) or PCSD_PORT))
+        return known
+    for node, host in (store.get("known_hosts") or {}).items():
+        if not host.get("token"):
+            continue
+        destinations = host.get("dest_list") or [{}]
+        known[node] = (destinations[0].get("addr", node), int(destinations[0].get("port", PCSD_PORT)))
+    return known
+
+
+# Returns the nodes the output of pcs cluster pcsd-status reports as anything but Online, e.g. "Unable to authenticate"
+# Nodes missing from the output are reported as well, so an output that cannot be read means every token is checked again
+def parse_pcsd_status(out, nodes):
+    online = set()
+    for line in out.splitlines():
+        node, separator, status = line.strip().partition(":")
+        if separator and status.strip() == "Online":
+            online.add(node.strip())
+    return [node for node in nodes if node not in online]
@@ -0,0 +1,1081 @@
+#!/usr/bin/env python3
+
+# ==== Local stand-in for the pacemaker command line tools ====
+#
+# Mimics the subset of pcs, crm, cibadmin, crm_attribute, crm_mon and crm_verify that the
+# modules in library/ emit, against a CIB kept as an XML file, so the modules and playbooks
+# can run on a machine without a cluster. The tool to emulate is chosen by the name the
+# script is called with (see the symlinks in simulator/bin).
+#
+# Environment:
+#   CIB_file                the live CIB (created with FAKE_PCMK_NODES if missing)
+#   CIB_shadow_dir          where "crm cib new" shadows are kept (defaults to the CIB_file directory)
+#   CIB_shadow              name of a shadow every tool works on instead of the live CIB, unless given -f / -c
+#   FAKE_PCMK_NODES         space-separated node names used when creating a new CIB
+#   FAKE_PCMK_OS_VERSION    RedHat major version whose pcs output format to mimic (default 8)
+#   FAKE_PCMK_LATENCY       JSON object (or path to one) of command prefix -> seconds of latency
+#                           e.g. {"pcs": 0.8, "crm": 1.2, "cibadmin": 0.02, "pcs status": 2}
+#   CLUSTER_PCSD_DIR        where the pcsd token store written by pcs host/cluster auth is kept
+#                           (defaults to the CIB_file directory)
+#   FAKE_PCMK_LOG           JSONL file each invocation is appended to, with its rc, duration
+#                           and the bytes of CIB read and written
+
+import json
+import os
+import shlex
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+EMPTY_CIB = ('<cib admin_epoch="0" epoch="1" num_updates="0" validate-with="pacemaker-3.0" crm_feature_set="3.0.14">'
+             '<configuration><crm_config/><nodes/><resources/><constraints/></configuration><status/></cib>')
+
+RESOURCE_TAGS = ("primitive", "group", "clone", "master", "bundle")
+
+# Bytes of CIB read and written during this invocation, for the invocation log
+io_counters = dict(read=0, written=0)
+
+
+class CommandError(Exception):
+
+    def __init__(self, message, rc=1):
+        Exception.__init__(self, message)
+        self.rc = rc
+
+
+# ==== CIB storage ====
+
+# Returns the path of the live CIB
+def live_cib_path():
+    return os.environ.get("CIB_file", "/var/lib/pacemaker/cib/cib.xml")
+
+# Returns the path of a crm shadow CIB
+def shadow_path(name):
+    shadow_dir = os.environ.get("CIB_shadow_dir", os.path.dirname(live_cib_path()))
+    return os.path.join(shadow_dir, "shadow." + name)
+
+# Returns the path of the CIB the tools work on: the CIB_shadow shadow if one is in use, else the live CIB
+def current_cib_path():
+    if os.environ.get("CIB_shadow"):
+        return shadow_path(os.environ["CIB_shadow"])
+    return live_cib_path()
+
+# Returns a new CIB containing only the nodes from FAKE_PCMK_NODES
+def new_cib():
+    root = ET.fromstring(EMPTY_CIB)
+    nodes = root.find("configuration/nodes")
+    for index, node in enumerate(os.environ.get("FAKE_PCMK_NODES", "").split()):
+        ET.SubElement(nodes, "node", id=str(index + 1), uname=node)
+    return root
+
+# Loads a CIB file, creating it if create is set and it does not exist
+def load_cib(path, create=True):
+    if not os.path.isfile(path):
+        if not create:
+            raise CommandError("Unable to read CIB file '%s'" % path, 105)
+        root = new_cib()
+        save_cib(path, root, bump=False)
+        return root
+    with open(path, "rb") as cib_file:
+        data = cib_file.read()
+    io_counters["read"] += len(data)
+    return ET.fromstring(data)
+
+# Writes a CIB file, bumping its epoch like the CIB manager does on configuration changes
+def save_cib(path, root, bump=True):
+    if bump:
+        root.set("epoch", str(int(root.get("epoch", "0")) + 1))
+        root.set("num_updates", "0")
+    data = ET.tostring(root)
+    io_counters["written"] += len(data)
+    temp_path = "%s.%d" % (path, os.getpid())
+    with open(temp_path, "wb") as cib_file:
+        cib_file.write(data)
+    os.rename(temp_path, path)
+
+# Returns the path of the sidecar file keeping simulator state that is not part of the CIB
+def state_path():
+    return live_cib_path() + ".sim.json"
+
+def load_state():
+    try:
+        with open(state_path()) as state_file:
+            return json.load(state_file)
+    except (IOError, OSError, ValueError):
+        return dict(running=True)
+
+def save_state(state):
+    with open(state_path(), "w") as state_file:
+        json.dump(state, state_file)
+
+# Fails the way the pacemaker tools do when the cluster is not running; a shadow needs no running cluster
+def require_running():
+    if current_cib_path() == live_cib_path() and not load_state().get("running", True):
+        raise CommandError("Could not connect to the CIB: Transport endpoint is not connected", 102)
+
+
+# ==== CIB helpers ====
+
+def section(root, name):
+    return root.find("configuration/" + name)
+
+def parent_map(root):
+    return dict((child, parent) for parent in root.iter() for child in parent)
+
+def find_id(root, element_id, tags=None):
+    for element in root.iter():
+        if element.get("id") == element_id and (tags is None or element.tag in tags):
+            return element
+    return None
+
+def remove(root, element):
+    parent_map(root)[element].remove(element)
+
+# Returns a unique id based on the given one
+def unique_id(root, base):
+    candidate, counter = base, 0
+    existing = set(element.get("id") for element in root.iter())
+    while candidate in existing:
+        counter += 1
+        candidate = "%s-%d" % (base, counter)
+    return candidate
+
+# Sets (or with value None, removes) an nvpair inside a set element
+def set_nvpair(root, attribute_set, name, value):
+    for nvpair in attribute_set.findall("nvpair"):
+        if nvpair.get("name") == name:
+            if value is None or value == "":
+                attribute_set.remove(nvpair)
+            else:
+                nvpair.set("value", value)
+            return
+    if value is not None and value != "":
+        ET.SubElement(attribute_set, "nvpair", id=unique_id(root, "%s-%s" % (attribute_set.get("id"), name)), name=name, value=value)
+
+# Returns the nvpair values of a set element as a dictionary
+def nvpairs(attribute_set):
+    if attribute_set is None:
+        return {}
+    return dict((nvpair.get("name"), nvpair.get("value")) for nvpair in attribute_set.findall("nvpair"))
+
+# Returns (creating if needed) the attribute set with the given tag and id under parent
+def get_set(root, parent, tag, set_id):
+    for attribute_set in parent.findall(tag):
+        if set_id is None or attribute_set.get("id") == set_id:
+            return attribute_set
+    return ET.SubElement(parent, tag, id=unique_id(root, set_id or "%s-%s" % (parent.get("id"), tag)))
+
+# Splits "k=v" tokens into a dictionary
+def parse_pairs(tokens):
+    pairs = {}
+    for token in tokens:
+        if "=" not in token:
+            raise CommandError("Invalid option '%s', expected name=value" % token)
+        name, value = token.split("=", 1)
+        pairs[name] = value
+    return pairs
+
+# Splits resource options into instance attributes, operations and meta attributes
+def parse_resource_options(tokens):
+    params, ops, meta = {}, [], {}
+    current = params
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token == "op":
+            op = dict(name=tokens[index + 1])
+            ops.append(op)
+            current = op
+            index += 2
+            continue
+        if token in ("meta", "params"):
+            current = meta if token == "meta" else params
+        elif "=" in token:
+            name, value = token.split("=", 1)
+            current[name] = value
+        elif not token.startswith("--"):
+            raise CommandError("Unable to parse resource option '%s'" % token)
+        index += 1
+    return params, ops, meta
+
+# Operations pcs takes from the agent metadata: the monitor always, unless the options give one, and the others
+# only without --no-default-ops; crm adds none
+PCS_DEFAULT_OPS = (dict(name="monitor", interval="10s", timeout="20s"),
+                   dict(name="start", interval="0s", timeout="20s"),
+                   dict(name="stop", interval="0s", timeout="20s"))
+
+# Builds a primitive element the way pcs names its generated ids, with the pcs default operations if pcs_defaults
+def build_primitive(root, name, agent, options, pcs_defaults=False):
+    parts = agent.split(":")
+    if len(parts) == 1:
+        parts = ["stonith", parts[0]] if parts[0].startswith("fence_") else ["ocf", "heartbeat", parts[0]]
+    primitive = ET.Element("primitive", id=name)
+    primitive.set("class", parts[0])
+    if len(parts) == 3:
+        primitive.set("provider", parts[1])
+    primitive.set("type", parts[-1])
+    params, ops, meta = parse_resource_options(options)
+    if pcs_defaults:
+        given = set(op["name"] for op in ops)
+        defaults = PCS_DEFAULT_OPS if "--no-default-ops" not in options else PCS_DEFAULT_OPS[:1]
+        ops = ops + [dict(op) for op in defaults if op["name"] not in given]
+    if params:
+        instance = ET.SubElement(primitive, "instance_attributes", id=name + "-instance_attributes")
+        for key, value in params.items():
+            ET.SubElement(instance, "nvpair", id="%s-instance_attributes-%s" % (name, key), name=key, value=value)
+    if meta:
+        meta_set = ET.SubElement(primitive, "meta_attributes", id=name + "-meta_attributes")
+        for key, value in meta.items():
+            ET.SubElement(meta_set, "nvpair", id="%s-meta_attributes-%s" % (name, key), name=key, value=value)
+    if ops:
+        operations = ET.SubElement(primitive, "operations")
+        for op in ops:
+            interval = op.get("interval", "0s")
+            op_element = ET.SubElement(operations, "op", id="%s-%s-interval-%s" % (name, op["name"], interval))
+            for key, value in sorted(op.items()):
+                op_element.set(key, value)
+            op_element.set("interval", interval)
+    return primitive
+
+# Adds a resource element, failing if the id is already used
+def add_resource(root, element):
+    if find_id(root, element.get("id")) is not None:
+        raise CommandError("Error: '%s' already exists" % element.get("id"))
+    section(root, "resources").append(element)
+
+# Wraps a resource in a clone element
+def clone_resource(root, resource_name, clone_name, meta, promotable=False, tag="clone"):
+    resource = find_id(root, resource_name, ("primitive", "group"))
+    if resource is None:
+        raise CommandError("Error: unable to find resource '%s'" % resource_name)
+    parents = parent_map(root)
+    if parents[resource].tag in ("clone", "master"):
+        raise CommandError("Error: %s is already a clone resource" % resource_name)
+    clone = ET.Element(tag, id=clone_name)
+    if promotable and tag == "clone":
+        meta = dict(meta, promotable="true")
+    parents[resource].remove(resource)
+    clone.append(resource)
+    if meta:
+        meta_set = ET.SubElement(clone, "meta_attributes", id=clone_name + "-meta_attributes")
+        for key, value in meta.items():
+            ET.SubElement(meta_set, "nvpair", id="%s-meta_attributes-%s" % (clone_name, key), name=key, value=value)
+    section(root, "resources").append(clone)
+
+# Replaces a clone by the resource it wraps
+def unclone_resource(root, name):
+    element = find_id(root, name)
+    if element is None:
+        raise CommandError("Error: could not find resource: %s" % name)
+    parents = parent_map(root)
+    clone = element if element.tag in ("clone", "master") else parents[element]
+    if clone.tag not in ("clone", "master"):
+        raise CommandError("Error: '%s' is not a clone resource" % name)
+    inner = [child for child in clone if child.tag in RESOURCE_TAGS][0]
+    resources = section(root, "resources")
+    index = list(resources).index(clone) if clone in list(resources) else len(resources)
+    parents[clone].remove(clone)
+    resources.insert(index, inner)
+
+# Deletes a resource, unwrapping or dropping its clone or group as pcs does
+def delete_resource(root, name):
+    element = find_id(root, name, RESOURCE_TAGS)
+    if element is None:
+        raise CommandError("Error: Resource '%s' does not exist." % name)
+    parents = parent_map(root)
+    parent = parents[element]
+    parent.remove(element)
+    if parent.tag in ("clone", "master") or (parent.tag == "group" and len(parent.findall("primitive")) == 0):
+        parents[parent].remove(parent)
+    resource_ids = set([name] + [child.get("id") for child in element.iter() if child.tag in RESOURCE_TAGS])
+    constraints = section(root, "constraints")
+    for constraint in list(constraints):
+        if resource_ids & set([constraint.get("rsc"), constraint.get("with-rsc"), constraint.get("first"), constraint.get("then")]):
+            constraints.remove(constraint)
+
+# Adds resources to a group (creating it), optionally before another member
+def group_add(root, group_name, members, before=None):
+    group = find_id(root, group_name)
+    if group is None:
+        group = ET.SubElement(section(root, "resources"), "group", id=group_name)
+    elif group.tag != "group":
+        raise CommandError("Error: '%s' is not a group" % group_name)
+    parents = parent_map(root)
+    for member in members:
+        resource = find_id(root, member, ("primitive",))
+        if resource is None:
+            raise CommandError("Error: Unable to find resource: %s" % member)
+        parents[resource].remove(resource)
+        if before is not None:
+            position = [child.get("id") for child in group].index(before)
+            group.insert(position, resource)
+        else:
+            group.append(resource)
+
+# Removes resources from a group, dropping the group once it is empty
+def group_remove(root, group_name, members):
+    group = find_id(root, group_name, ("group",))
+    if group is None:
+        raise CommandError("Error: Group '%s' does not exist" % group_name)
+    resources = section(root, "resources")
+    for member in members:
+        resource = find_id(group, member, ("primitive",))
+        if resource is None:
+            raise CommandError("Error: Resource '%s' is not in group '%s'" % (member, group_name))
+        group.remove(resource)
+        resources.append(resource)
+    if len(group.findall("primitive")) == 0:
+        parent_map(root)[group].remove(group)
+
+# Returns the <node> element for a node name
+def get_node(root, uname):
+    for node in section(root, "nodes").findall("node"):
+        if node.get("uname") == uname:
+            return node
+    raise CommandError("Error: Unable to find a node: %s" % uname)
+
+# Sets or removes a node attribute
+def set_node_attribute(root, uname, name, value):
+    node = get_node(root, uname)
+    set_nvpair(root, get_set(root, node, "instance_attributes", "nodes-" + node.get("id")), name, value)
+
+def get_node_attributes(root, uname):
+    return nvpairs(get_node(root, uname).find("instance_attributes"))
+
+# Returns the attribute set for a cluster property or defaults section
+def property_set(root, set_id="cib-bootstrap-options"):
+    return get_set(root, section(root, "crm_config"), "cluster_property_set", set_id)
+
+def defaults_set(root, dtype, set_id=None):
+    defaults = section(root, dtype + "_defaults")
+    if defaults is None:
+        defaults = ET.SubElement(root.find("configuration"), dtype + "_defaults")
+    return get_set(root, defaults, "meta_attributes", set_id or dtype + "_defaults-meta_attributes")
+
+def add_order(root, constraint_id, first, first_action, then, then_action, options):
+    constraint = ET.SubElement(section(root, "constraints"), "rsc_order", id=unique_id(root, constraint_id))
+    constraint.set("first", first)
+    constraint.set("first-action", first_action)
+    constraint.set("then", then)
+    constraint.set("then-action", then_action)
+    for key, value in options.items():
+        constraint.set(key, value)
+
+def add_colocation(root, constraint_id, rsc, rsc_role, with_rsc, with_rsc_role, score):
+    constraint = ET.SubElement(section(root, "constraints"), "rsc_colocation", id=unique_id(root, constraint_id))
+    constraint.set("rsc", rsc)
+    if rsc_role != "Started":
+        constraint.set("rsc-role", rsc_role)
+    constraint.set("with-rsc", with_rsc)
+    if with_rsc_role != "Started":
+        constraint.set("with-rsc-role", with_rsc_role)
+    constraint.set("score", score)
+
+def delete_constraint(root, constraint_id):
+    constraint = find_id(section(root, "constraints"), constraint_id)
+    if constraint is None:
+        raise CommandError("Error: Unable to find constraint - '%s'" % constraint_id)
+    section(root, "constraints").remove(constraint)
+
+# Returns the online, non-standby nodes a resource could run on
+def active_nodes(root):
+    return [node.get("uname") for node in section(root, "nodes").findall("node")
+            if get_node_attributes(root, node.get("uname")).get("standby") != "on"]
+
+# Returns the crm_mon XML status document for the CIB
+def crm_mon_xml(root):
+    running = active_nodes(root)
+    primitives = [element.get("id") for element in section(root, "resources").iter("primitive")]
+    placement = dict((node, 0) for node in running)
+    for index, primitive in enumerate(primitives):
+        if running:
+            placement[running[index % len(running)]] += 1
+    status = ET.Element("crm_mon", version="2.0.5")
+    nodes = ET.SubElement(status, "nodes")
+    for node in section(root, "nodes").findall("node"):
+        name = node.get("uname")
+        standby = "false" if name in running else "true"
+        ET.SubElement(nodes, "node", name=name, id=node.get("id"), online="true", standby=standby,
+                      resources_running=str(placement.get(name, 0)), type="member")
+    return ET.tostring(status, "unicode")
+
+
+# ==== crm style configuration output ====
+
+def crm_show_element(element):
+    if element.tag == "primitive":
+        agent = ":".join(part for part in (element.get("class"), element.get("provider"), element.get("type")) if part)
+        line = "primitive %s %s" % (element.get("id"), agent)
+        params = nvpairs(element.find("instance_attributes"))
+        if params:
+            line += " \\\n\tparams " + " ".join("%s=%s" % item for item in params.items())
+        for op in element.iter("op"):
+            line += " \\\n\top %s " % op.get("name") + " ".join("%s=%s" % (key, value) for key, value in op.attrib.items() if key not in ("id", "name"))
+        return line
+    if element.tag == "group":
+        return "group %s %s" % (element.get("id"), " ".join(child.get("id") for child in element if child.tag == "primitive"))
+    if element.tag in ("clone", "master"):
+        inner = [child.get("id") for child in element if child.tag in RESOURCE_TAGS]
+        meta = nvpairs(element.find("meta_attributes"))
+        return "clone %s %s" % (element.get("id"), " ".join(inner)) + (" \\\n\tmeta " + " ".join("%s=%s" % item for item in meta.items()) if meta else "")
+    if element.tag == "node":
+        line = "node %s: %s" % (element.get("id"), element.get("uname"))
+        attributes = nvpairs(element.find("instance_attributes"))
+        if attributes:
+            line += " \\\n\tattributes " + " ".join("%s=%s" % item for item in attributes.items())
+        return line
+    if element.tag == "cluster_property_set":
+        return "property %s: \\\n\t" % element.get("id") + " \\\n\t".join("%s=%s" % item for item in nvpairs(element).items())
+    if element.tag == "rsc_order":
+        return "order %s %s: %s:%s %s:%s" % (element.get("id"), element.get("kind", "Mandatory"), element.get("first"),
+                                           element.get("first-action", "start"), element.get("then"), element.get("then-action", "start"))
+    if element.tag == "rsc_colocation":
+        return "colocation %s %s: %s %s" % (element.get("id"), element.get("score"), element.get("rsc"), element.get("with-rsc"))
+    return ""
+
+def crm_show(root, args):
+    kinds = dict(group=["group"], property=["cluster_property_set"], node=["node"], primitive=["primitive"])
+    selected = []
+    for element in root.find("configuration").iter():
+        if element.tag not in ("primitive", "group", "clone", "master", "node", "cluster_property_set", "rsc_order", "rsc_colocation"):
+            continue
+        if not args:
+            selected.append(element)
+        for arg in args:
+            if arg.startswith("type:") and element.tag in kinds.get(arg[5:], []):
+                selected.append(element)
+            elif element.get("id") == arg or (element.tag == "node" and element.get("uname") == arg):
+                selected.append(element)
+    if args and not selected:
+        raise CommandError("ERROR: object %s does not exist" % " ".join(args))
+    return "\n".join(crm_show_element(element) for element in selected)
+
+
+# ==== pcs ====
+
+def pcs(args):
+    cib_path = current_cib_path()
+    if len(args) >= 2 and args[0] == "-f":
+        cib_path = args[1]
+        args = args[2:]
+    elif args[0] == "host" or (args[0] == "cluster" and args[1] in ("setup", "start", "destroy", "pcsd-status", "auth", "deauth")):
+        pass
+    else:
+        require_running()
+    version = os.environ.get("FAKE_PCMK_OS_VERSION", "8")
+    command, rest = args[0], args[1:]
+
+    # pcsd commands do not touch the CIB
+    if command == "host" and rest[0] in ("auth", "deauth"):
+        return host_auth(rest[0], rest[1:])
+    if command == "cluster" and rest[0] in ("auth", "deauth"):
+        return host_auth(rest[0], rest[1:])
+    if command == "cluster" and rest[0] == "pcsd-status":
+        authenticated = [node for node, token in read_tokens().items() if token_of(token) == "token-" + node]
+        missing = [node for node in rest[1:] if node not in authenticated]
+        for node in rest[1:]:
+            print("  %s: %s" % (node, "Unable to authenticate" if node in missing else "Online"))
+        return 1 if missing else 0
+
+    root = load_cib(cib_path)
+
+    def save():
+        save_cib(cib_path, root)
+
+    if command == "status":
+        names = " ".join(node.get("uname") for node in section(root, "nodes").findall("node"))
+        print("Cluster name: simulated\n\nNode List:\n" + ("Online: [ %s ]" % names if version == "7" else "  * Online: [ %s ]" % names))
+        return 0
+
+    if command in ("resource", "stonith"):
+        sub = rest[0]
+        if sub in ("show", "config") and len(rest) > 1:
+            element = find_id(root, rest[1], RESOURCE_TAGS)
+            if element is None:
+                raise CommandError("Error: unable to find resource '%s'" % rest[1])
+            print(ET.tostring(element, "unicode"))
+            return 0
+        if sub == "create":
+            name = rest[1]
+            agent = rest[2] if command == "resource" else "stonith:" + rest[2]
+            add_resource(root, build_primitive(root, name, agent, rest[3:], pcs_defaults=True))
+            return save()
+        if sub == "delete":
+            delete_resource(root, rest[1])
+            return save()
+        if sub == "clone":
+            name = rest[1]
+            options = [token for token in rest[2:] if "=" in token]
+            clone_resource(root, name, name + "-clone", parse_pairs(options))
+            return save()
+        if sub == "promotable":
+            name = rest[1]
+            clone_resource(root, name, name + "-clone", parse_pairs(rest[2:]), promotable=True)
+            return save()
+        if sub == "master":
+            clone_resource(root, rest[2], rest[1], parse_pairs(rest[3:]), tag="master")
+            return save()
+        if sub == "unclone":
+            unclone_resource(root, rest[1])
+            return save()
+        if sub == "group":
+            action = rest[1]
+            if action == "list":
+                for group in section(root, "resources").findall("group"):
+                    print("%s: %s" % (group.get("id"), " ".join(child.get("id") for child in group if child.tag == "primitive")))
+                return 0
+            if action == "add":
+                members = rest[3:]
+                before = None
+                if "--before" in members:
+                    before = members[members.index("--before") + 1]
+                    members = members[:members.index("--before")]
+                group_add(root, rest[2], members, before)
+                return save()
+            if action == "remove":
+                group_remove(root, rest[2], rest[3:])
+                return save()
+        if sub in ("defaults", "op"):
+            dtype = "rsc"
+            if sub == "op":
+                dtype, rest = "op", rest[1:]
+            pairs = parse_pairs(rest[1:])
+            attribute_set = defaults_set(root, dtype)
+            if not pairs:
+                values = nvpairs(attribute_set)
+                if version == "7":
+                    print("\n".join("%s: %s" % item for item in values.items()) or "No defaults set")
+                else:
+                    print("Meta Attrs: %s\n" % attribute_set.get("id") + "\n".join("  %s=%s" % item for item in values.items()))
+                return 0
+            for key, value in pairs.items():
+                set_nvpair(root, attribute_set, key, value)
+            return save()
+
+    if command == "constraint":
+        sub = rest[0]
+        if sub == "order":
+            tokens = rest[1:]
+            then = tokens.index("then")
+            first_part, then_part = tokens[:then], tokens[then + 1:]
+            first_action, first = (first_part if len(first_part) == 2 else ["start"] + first_part)
+            if len(then_part) > 1 and "=" not in then_part[1]:
+                then_action, then_rsc = then_part[0], then_part[1]
+                options = then_part[2:]
+            else:
+                then_action, then_rsc = "start", then_part[0]
+                options = then_part[1:]
+            pairs = parse_pairs(options)
+            constraint_id = pairs.pop("id", "order-%s-%s-%s" % (first, then_rsc, pairs.get("kind", "mandatory")))
+            add_order(root, constraint_id, first, first_action, then_rsc, then_action, pairs)
+            return save()
+        if sub == "colocation" and rest[1] == "add":
+            tokens = rest[2:]
+            with_index = tokens.index("with")
+            source, target = tokens[:with_index], tokens[with_index + 1:]
+            rsc_role, rsc = source if len(source) == 2 else ("Started", source[0])
+            if len(target) > 1 and "=" not in target[1] and not target[1].lstrip("-+").isdigit() and "INFINITY" not in target[1]:
+                with_rsc_role, with_rsc, extra = target[0], target[1], target[2:]
+            else:
+                with_rsc_role, with_rsc, extra = "Started", target[0], target[1:]
+            score = "INFINITY"
+            pairs = {}
+            for token in extra:
+                if "=" in token:
+                    pairs.update(parse_pairs([token]))
+                else:
+                    score = token
+            constraint_id = pairs.get("id", "colocation-%s-%s-%s" % (rsc, with_rsc, score))
+            add_colocation(root, constraint_id, rsc, rsc_role, with_rsc, with_rsc_role, score)
+            return save()
+        if sub in ("delete", "remove"):
+            for constraint_id in rest[1:]:
+                delete_constraint(root, constraint_id)
+            return save()
+
+    if command == "property":
+        sub = rest[0]
+        if sub == "set":
+            for key, value in parse_pairs(rest[1:]).items():
+                set_nvpair(root, property_set(root), key, value)
+            return save()
+        if sub == "unset":
+            for key in rest[1:]:
+                set_nvpair(root, property_set(root), key, None)
+            return save()
+        if sub in ("list", "show", "config"):
+            values = nvpairs(property_set(root))
+            names = [arg for arg in rest[1:] if not arg.startswith("--")]
+            print("Cluster Properties:")
+            for key, value in values.items():
+                if not names or key in names:
+                    print(" %s: %s" % (key, value))
+            return 0
+
+    if command == "node":
+        sub = rest[0]
+        if sub in ("standby", "unstandby"):
+            for node in rest[1:]:
+                set_node_attribute(root, node, "standby", "on" if sub == "standby" else None)
+            return save()
+        if sub == "attribute":
+            if len(rest) >= 3 and rest[1] != "--name":
+                for key, value in parse_pairs(rest[2:]).items():
+                    set_node_attribute(root, rest[1], key, value)
+                return save()
+            name = rest[2] if len(rest) >= 3 else None
+            print("Node Attributes:")
+            for node in section(root, "nodes").findall("node"):
+                attributes = get_node_attributes(root, node.get("uname"))
+                shown = " ".join("%s=%s" % item for item in attributes.items() if name is None or item[0] == name)
+                if shown:
+                    print(" %s: %s" % (node.get("uname"), shown))
+            return 0
+
+    if command == "cluster":
+        sub = rest[0]
+        if sub == "cib":
+            if len(rest) > 1:
+                save_cib(rest[1], load_cib(live_cib_path()), bump=False)
+            else:
+                print(ET.tostring(load_cib(live_cib_path()), "unicode"))
+            return 0
+        if sub == "cib-push":
+            pushed = load_cib(rest[-1], create=False)
+            live = load_cib(live_cib_path())
+            live.remove(live.find("configuration"))
+            live.insert(0, pushed.find("configuration"))
+            save_cib(live_cib_path(), live)
+            print("CIB updated")
+            return 0
+        if sub in ("start", "stop"):
+            state = load_state()
+            state["running"] = sub == "start"
+            save_state(state)
+            return 0
+        if sub == "setup":
+            tokens = [token for token in rest[1:] if token != "--name"]
+            nodes = []
+            for token in tokens[1:]:
+                if token.startswith("-") or "=" in token or token == "totem":
+                    break
+                nodes.append(token)
+            root = ET.fromstring(EMPTY_CIB)
+            for index, node in enumerate(nodes):
+                ET.SubElement(section(root, "nodes"), "node", id=str(index + 1), uname=node)
+            save_cib(cib_path, root, bump=False)
+            state = load_state()
+            state["running"] = False
+            save_state(state)
+            return 0
+        if sub == "destroy":
+            for path in (cib_path, state_path()):
+                if os.path.isfile(path):
+                    os.remove(path)
+            return 0
+        if sub == "node" and rest[1] in ("add", "remove"):
+            nodes = section(root, "nodes")
+            for name in [token for token in rest[2:] if not token.startswith("-")]:
+                if rest[1] == "add":
+                    ET.SubElement(nodes, "node", id=unique_id(root, str(len(nodes) + 1)), uname=name)
+                else:
+                    nodes.remove(get_node(root, name))
+            return save()
+
+    raise CommandError("Error: unsupported command for the simulator: pcs %s" % " ".join(args))
+
+# Returns the path of the pcsd token store: known-hosts for pcs 0.10 (RHEL 8), tokens for pcs 0.9 (RHEL 7)
+def tokens_path():
+    directory = os.environ.get("CLUSTER_PCSD_DIR") or os.path.dirname(live_cib_path())
+    return os.path.join(directory, "tokens" if os.environ.get("FAKE_PCMK_OS_VERSION", "8") == "7" else "known-hosts")
+
+# Returns the nodes holding a token in the pcsd token store
+def read_tokens():
+    try:
+        with open(tokens_path()) as store_file:
+            store = json.load(store_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    return store.get("tokens") or store.get("known_hosts") or {}
+
+# Returns the token of a token store entry, which pcs 0.10 keeps along with the node's addresses
+# The simulated pcsd only accepts the token pcs host auth recorded, "token-<node>"
+def token_of(entry):
+    return entry.get("token") if isinstance(entry, dict) else entry
+
+# Records the nodes given to pcs host auth / deauth in the pcsd token store, in the format of the pcs version
+def host_auth(action, tokens):
+    nodes = []
+    for token in tokens:
+        if token.startswith("-"):
+            break
+        nodes.append(token)
+    known = read_tokens()
+    for node in nodes:
+        if action == "deauth":
+            known.pop(node, None)
+        elif os.environ.get("FAKE_PCMK_OS_VERSION", "8") == "7":
+            known[node] = "token-" + node
+        else:
+            known[node] = dict(dest_list=[dict(addr=node, port=2224)], token="token-" + node)
+    if os.environ.get("FAKE_PCMK_OS_VERSION", "8") == "7":
+        store = dict(format_version=2, data_version=1, tokens=known, ports=dict((node, 2224) for node in known))
+    else:
+        store = dict(format_version=1, data_version=1, known_hosts=known)
+    with open(tokens_path(), "w") as store_file:
+        json.dump(store, store_file)
+    return 0
+
+
+# ==== crm ====
+
+def crm(args):
+    cib_path = current_cib_path()
+    while args and args[0].startswith("-"):
+        if args[0] == "-c":
+            cib_path = shadow_path(args[1])
+            args = args[2:]
+        else:
+            args = args[1:]
+    if cib_path == current_cib_path():
+        require_running()
+    command, rest = args[0], args[1:]
+
+    if command == "cib":
+        sub, name = rest[0], rest[1]
+        if sub == "new":
+            root = new_cib() if "empty" in rest[2:] else load_cib(live_cib_path())
+            save_cib(shadow_path(name), root, bump=False)
+            return 0
+        if sub == "commit":
+            pushed = load_cib(shadow_path(name), create=False)
+            live = load_cib(live_cib_path())
+            live.remove(live.find("configuration"))
+            live.insert(0, pushed.find("configuration"))
+            save_cib(live_cib_path(), live)
+            return 0
+        if sub == "delete":
+            if os.path.isfile(shadow_path(name)):
+                os.remove(shadow_path(name))
+            return 0
+
+    root = load_cib(cib_path)
+
+    def save():
+        save_cib(cib_path, root)
+
+    if command == "status":
+        print("Node List:\n  * Online: [ %s ]" % " ".join(active_nodes(root)))
+        return 0
+
+    if command in ("configure", "config"):
+        sub, rest = rest[0], rest[1:]
+        if sub == "show":
+            print(crm_show(root, rest))
+            return 0
+        if sub == "primitive":
+            add_resource(root, build_primitive(root, rest[0], rest[1], rest[2:]))
+            return save()
+        if sub == "clone":
+            tokens = rest[2:]
+            meta = parse_pairs([token for token in tokens if token != "meta"])
+            clone_resource(root, rest[1], rest[0], meta)
+            return save()
+        if sub == "group":
+            members = [token for token in rest[1:] if "=" not in token and token != "meta"]
+            group_add(root, rest[0], members)
+            return save()
+        if sub == "modgroup":
+            group_name, action = rest[0], rest[1]
+            members = rest[2].split()
+            if action == "add":
+                before = rest[4] if len(rest) > 4 and rest[3] == "before" else None
+                group_add(root, group_name, members, before)
+            else:
+                group_remove(root, group_name, members)
+            return save()
+        if sub == "delete":
+            for name in [token for token in rest if not token.startswith("--")]:
+                element = find_id(root, name)
+                if element is None:
+                    raise CommandError("ERROR: object %s does not exist" % name)
+                if element.tag in RESOURCE_TAGS:
+                    if element.tag in ("clone", "master"):
+                        unclone_resource(root, name)
+                    else:
+                        delete_resource(root, name)
+                else:
+                    remove(root, element)
+            return save()
+        if sub == "order":
+            kind = rest[1].rstrip(":")
+            first, first_action = (rest[2].split(":") + ["start"])[:2]
+            then, then_action = (rest[3].split(":") + ["start"])[:2]
+            options = parse_pairs(rest[4:])
+            options["kind"] = kind
+            add_order(root, rest[0], first, first_action, then, then_action, options)
+            return save()
+        if sub == "colocation":
+            score = rest[1].rstrip(":")
+            rsc, rsc_role = (rest[2].split(":") + ["Started"])[:2]
+            with_rsc, with_rsc_role = (rest[3].split(":") + ["Started"])[:2]
+            add_colocation(root, rest[0], rsc, rsc_role, with_rsc, with_rsc_role, score)
+            return save()
+        if sub in ("property", "rsc_defaults", "op_defaults"):
+            set_id = None
+            pairs = {}
+            for token in rest:
+                if token.startswith("$id="):
+                    set_id = token[4:]
+                else:
+                    pairs.update(parse_pairs([token]))
+            if sub == "property":
+                attribute_set = property_set(root, set_id or "cib-bootstrap-options")
+            else:
+                attribute_set = defaults_set(root, sub.split("_")[0], set_id)
+            for key, value in pairs.items():
+                set_nvpair(root, attribute_set, key, value)
+            return save()
+
+    if command == "node":
+        sub = rest[0]
+        if sub in ("online", "standby"):
+            set_node_attribute(root, rest[1], "standby", "on" if sub == "standby" else None)
+            return save()
+        if sub == "show":
+            node = get_node(root, rest[1])
+            print("%s(%s): member" % (node.get("uname"), node.get("id")))
+            for item in get_node_attributes(root, rest[1]).items():
+                print("\t%s=%s" % item)
+            return 0
+        if sub == "attribute":
+            uname, action, name = rest[1], rest[2], rest[3]
+            if action == "set":
+                set_node_attribute(root, uname, name, rest[4])
+                return save()
+            if action == "delete":
+                set_node_attribute(root, uname, name, None)
+                return save()
+            value = get_node_attributes(root, uname).get(name)
+            if value is None:
+                raise CommandError("Could not map name=%s to a UUID" % name, 105)
+            print("scope=nodes  name=%s value=%s" % (name, value))
+            return 0
+
+    if command == "cluster" and rest[0] in ("start", "stop"):
+        state = load_state()
+        state["running"] = rest[0] == "start"
+        save_state(state)
+        return 0
+
+    raise CommandError("ERROR: unsupported command for the simulator: crm %s" % " ".join(args))
+
+
+# ==== cibadmin, crm_attribute, crm_mon, crm_verify ====
+
+# Splits "--name value", "--name=value" and "-x value" style options into a dictionary
+def parse_options(args, with_values):
+    options, positional = {}, []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg.startswith("-"):
+            name, has_value, value = arg.partition("=")
+            if not has_value and name in with_values and index + 1 < len(args):
+                index += 1
+                value = args[index]
+            options[name] = value if (has_value or name in with_values) else True
+        else:
+            positional.append(arg)
+        index += 1
+    return options, positional
+
+# Returns the element of the CIB addressed by a patch path such as /cib/configuration/nodes/node[@id='1']
+def patch_target(root, path):
+    steps = path.strip("/").split("/")
+    if not steps or steps[0] != "cib":
+        return None
+    if len(steps) == 1:
+        return root
+    return root.find("/".join(steps[1:]))
+
+# Applies a version 2 patch the way the CIB manager does: only to the exact source version
+# Like pacemaker's apply_v2_patchset, deletes and modifies are applied in patch order as the changes are read,
+# moved elements are set aside after their last sibling, and the creates and moves are then applied in ascending
+# position (in patch order for equal positions), each inserted before the sibling at its position
+def apply_patch(root, diff):
+    version = diff.find("version")
+    source, target = version.find("source"), version.find("target")
+    fields = ("admin_epoch", "epoch", "num_updates")
+    if any(int(root.get(field, "0")) != int(source.get(field, "0")) for field in fields):
+        raise CommandError("Call cib_apply_diff failed (-205): Update was older than existing configuration", 103)
+    changes = []
+    for change in diff.findall("change"):
+        target_element = patch_target(root, change.get("path"))
+        if target_element is None:
+            raise CommandError("Call cib_apply_diff failed (-206): Application of an update diff failed: "
+                               "no element at %s" % change.get("path"), 104)
+        changes.append((change, target_element))
+    parents = parent_map(root)
+    placements = []
+    for change, element in changes:
+        operation = change.get("operation")
+        if operation == "delete":
+            parents[element].remove(element)
+        elif operation == "modify":
+            for change_attr in change.find("change-list"):
+                if change_attr.get("operation") == "set":
+                    element.set(change_attr.get("name"), change_attr.get("value"))
+                else:
+                    element.attrib.pop(change_attr.get("name"), None)
+        elif operation == "move":
+            parent = parents[element]
+            parent.remove(element)
+            parent.append(element)
+            placements.append((change, element))
+        elif operation == "create":
+            placements.append((change, element))
+        else:
+            raise CommandError("Call cib_apply_diff failed (-206): unknown operation %s" % operation, 104)
+    for change, element in sorted(placements, key=lambda placement: int(placement[0].get("position", "0"))):
+        position = int(change.get("position", "0"))
+        if change.get("operation") == "create":
+            element.insert(min(position, len(element)), list(change)[0])
+        else:
+            parent = parents[element]
+            parent.remove(element)
+            parent.insert(min(position, len(parent)), element)
+    for field in fields:
+        root.set(field, target.get(field))
+
+# Returns the XML given to cibadmin with --xml-text, --xml-file or --xml-pipe
+def read_xml_input(options):
+    if "--xml-text" in options or "-X" in options:
+        return options.get("--xml-text", options.get("-X"))
+    if "--xml-file" in options or "-x" in options:
+        with open(options.get("--xml-file", options.get("-x"))) as xml_file:
+            return xml_file.read()
+    if "--xml-pipe" in options or "-p" in options:
+        return sys.stdin.read()
+    raise CommandError("cibadmin: no XML input given", 64)
+
+def cibadmin(args):
+    options, positional = parse_options(args, ("--scope", "-o", "--timeout", "-t", "--xpath", "-A", "--xml-text", "-X", "--xml-file", "-x"))
+    require_running()
+    root = load_cib(current_cib_path())
+    scope = options.get("--scope", options.get("-o"))
+    if "--query" in options or "-Q" in options:
+        target = root
+        if scope is not None:
+            target = root.find(scope) if scope == "status" else root.find("configuration/" + scope)
+            if target is None and scope == "configuration":
+                target = root.find("configuration")
+        xpath = options.get("--xpath", options.get("-A"))
+        if xpath is not None:
+            target = patch_target(root, xpath)
+        if target is None:
+            raise CommandError("Call cib_query failed (-6): No such device or address", 105)
+        if "--no-children" in options:
+            target = ET.Element(target.tag, target.attrib)
+        print(ET.tostring(target, "unicode"))
+        return 0
+    if "--patch" in options or "-P" in options:
+        apply_patch(root, ET.fromstring(read_xml_input(options)))
+        save_cib(current_cib_path(), root, bump=False)
+        return 0
+    raise CommandError("cibadmin: unsupported operation for the simulator: %s" % " ".join(args))
+
+def crm_attribute(args):
+    options, positional = parse_options(args, ("--type", "-t", "--node", "-N", "--set-name", "-s", "--name", "-n", "--update", "-v"))
+    require_running()
+    root = load_cib(current_cib_path())
+    dtype = options.get("--type", options.get("-t", "crm_config"))
+    node = options.get("--node", options.get("-N"))
+    set_name = options.get("--set-name", options.get("-s"))
+    name = options.get("--name", options.get("-n"))
+    if node is not None:
+        node_element = get_node(root, node)
+        attribute_set = get_set(root, node_element, "instance_attributes", "nodes-" + node_element.get("id"))
+    elif dtype in ("rsc_defaults", "op_defaults"):
+        attribute_set = defaults_set(root, dtype.split("_")[0], set_name)
+    else:
+        attribute_set = property_set(root, set_name or "cib-bootstrap-options")
+    if "--delete" in options or "-D" in options:
+        set_nvpair(root, attribute_set, name, None)
+        save_cib(current_cib_path(), root)
+        return 0
+    update = options.get("--update", options.get("-v"))
+    if update is not None:
+        set_nvpair(root, attribute_set, name, update)
+        save_cib(current_cib_path(), root)
+        return 0
+    value = nvpairs(attribute_set).get(name)
+    if value is None:
+        raise CommandError("Error performing operation: No such device or address", 105)
+    print(value if ("--quiet" in options or "-q" in options) else "scope=%s  name=%s value=%s" % (dtype, name, value))
+    return 0
+
+def crm_mon(args):
+    require_running()
+    print(crm_mon_xml(load_cib(current_cib_path())))
+    return 0
+
+def crm_verify(args):
+    options, positional = parse_options(args, ("--xml-file", "-x"))
+    path = options.get("--xml-file", options.get("-x"))
+    load_cib(path, create=False) if path else load_cib(current_cib_path())
+    return 0
+
+
+TOOLS = dict(pcs=pcs, crm=crm, cibadmin=cibadmin, crm_attribute=crm_attribute, crm_mon=crm_mon, crm_verify=crm_verify)
+
+
+# ==== Latency model and invocation log ====
+
+# Returns the configured latency for a command line, using the longest matching prefix
+def latency(argv):
+    setting = os.environ.get("FAKE_PCMK_LATENCY")
+    if not setting:
+        return 0
+    if os.path.isfile(setting):
+        with open(setting) as latency_file:
+            setting = latency_file.read()
+    latencies = json.loads(setting)
+    command_line = " ".join(argv)
+    best = ""
+    for prefix in latencies:
+        if (command_line == prefix or command_line.startswith(prefix + " ")) and len(prefix) > len(best):
+            best = prefix
+    return latencies.get(best, 0)
+
+def log_invocation(argv, rc, elapsed):
+    log_path = os.environ.get("FAKE_PCMK_LOG")
+    if not log_path:
+        return
+    entry = dict(argv=argv, rc=rc, elapsed=round(elapsed, 6), cib_read=io_counters["read"], cib_written=io_counters["written"])
+    with open(log_path, "a") as log_file:
+        log_file.write(json.dumps(entry) + "\n")
+
+
+def main():
+    start = time.time()
+    tool = os.path.basename(sys.argv[0])
+    if tool not in TOOLS:
+        tool, sys.argv = sys.argv[1], sys.argv[1:]
+    argv = [tool] + sys.argv[1:]
+    time.sleep(latency(argv))
+    try:
+        rc = TOOLS[tool](sys.argv[1:]) or 0
+    except CommandError as error:
+        sys.stderr.write(str(error) + "\n")
+        rc = error.rc
+    except (IndexError, ValueError):
+        sys.stderr.write("Error: unable to parse command: %s\n" % " ".join(shlex.quote(arg) for arg in argv))
+        rc = 1
+    sys.stdout.flush()
+    log_invocation(argv, rc, time.time() - start)
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main())
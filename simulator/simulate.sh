@@ -0,0 +1,55 @@
+#!/bin/sh
+
+# ==== Runs playbooks against the simulated pacemaker toolchain ====
+#
+# usage: simulator/simulate.sh [RedHat 7|RedHat 8|Suse] main.yaml [ansible-playbook options]
+#
+# A fresh simulated CIB is created in a temporary directory (or in $SIMULATOR_DIR when set,
+# which is kept afterwards). Latencies can be modelled with FAKE_PCMK_LATENCY, see
+# simulator/fake_pacemaker.py. Each tool invocation is logged to $SIMULATOR_DIR/commands.jsonl.
+
+set -e
+
+repo=$(cd "$(dirname "$0")/.." && pwd)
+
+os_family=RedHat
+os_version=8
+case "$1" in
+    RedHat) os_family=RedHat; os_version=$2; shift 2 ;;
+    Suse)   os_family=Suse; os_version=15; shift ;;
+esac
+
+if [ -z "$SIMULATOR_DIR" ]; then
+    SIMULATOR_DIR=$(mktemp -d)
+    trap 'rm -rf "$SIMULATOR_DIR"' EXIT
+fi
+
+# Node names used by the test playbooks for each operating system
+case "$os_family$os_version" in
+    RedHat8) nodes="x0rapp00leb7 x0rapp01leb7" ;;
+    RedHat7) nodes="x7rapp00l1ed x7rapp01l1ed" ;;
+    *)       nodes="x00app00l650 x00app01l650" ;;
+esac
+
+if [ "$os_family" = "Suse" ]; then
+    printf 'NAME="SLES"\nVERSION_ID="%s"\n' "$os_version" > "$SIMULATOR_DIR/os-release"
+else
+    printf 'NAME="Red Hat Enterprise Linux"\nVERSION_ID="%s.0"\n' "$os_version" > "$SIMULATOR_DIR/os-release"
+fi
+
+export PATH="$repo/simulator/bin:$PATH"
+export CIB_file="$SIMULATOR_DIR/cib.xml"
+export CIB_shadow_dir="$SIMULATOR_DIR"
+export CLUSTER_OS_RELEASE="$SIMULATOR_DIR/os-release"
+export CLUSTER_PCSD_DIR="$SIMULATOR_DIR"
+export FAKE_PCMK_NODES="${FAKE_PCMK_NODES:-$nodes}"
+export FAKE_PCMK_OS_VERSION="$os_version"
+export FAKE_PCMK_LOG="${FAKE_PCMK_LOG:-$SIMULATOR_DIR/commands.jsonl}"
+export ANSIBLE_LIBRARY="$repo/library"
+export ANSIBLE_MODULE_UTILS="$repo/module_utils"
+
+ansible-playbook -i localhost, -c local \
+    -e ansible_become=false \
+    -e ansible_os_family="$os_family" \
+    -e ansible_distribution_major_version="$os_version" \
+    "$@"
@@ -70,4 +70,28 @@
       
     - name: "Bring nodes online idempotence: Output"
       debug:
-        msg: '{{ resultobj }}'
\ No newline at end of file
+        msg: '{{ resultobj }}'
+    - name: "Put all nodes on standby at once and wait for them to drain"
+      node_online:
+        online: "false"
+        nodes:
+          - "{{node1}}"
+          - "{{node2}}"
+        wait: drained
+      register: resultobj
+
+    - name: "Put all nodes on standby at once and wait for them to drain: Output"
+      debug:
+        msg: '{{ resultobj }}'
+
+    - name: "Bring all nodes online at once"
+      node_online:
+        online: "true"
+        nodes:
+          - "{{node1}}"
+          - "{{node2}}"
+      register: resultobj
+
+    - name: "Bring all nodes online at once: Output"
+      debug:
+        msg: '{{ resultobj }}'
@@ -0,0 +1,53 @@
+# ==== Shared setup of the unit tests of module_utils ====
+#
+# The module_utils are imported the way Ansible imports them, as ansible.module_utils.<name>, so the tests need
+# ansible installed; the repository's module_utils directory is added to that package, as the benchmarks do.
+# Without ansible, no test is collected.
+#
+# usage: python -m pytest tests
+
+import os
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import ansible.module_utils
+except ImportError:
+    collect_ignore_glob = ["test_*.py"]
+else:
+    if os.path.join(REPO, "module_utils") not in ansible.module_utils.__path__:
+        ansible.module_utils.__path__.append(os.path.join(REPO, "module_utils"))
+
+
+# A CIB with a configuration item of each kind the lookups index, and a <status> section after the configuration
+CIB = ('<cib admin_epoch="0" epoch="7" num_updates="3">'
+       '<configuration>'
+       '<crm_config><cluster_property_set id="cib-bootstrap-options">'
+       '<nvpair id="cib-bootstrap-options-stonith-enabled" name="stonith-enabled" value="false"/>'
+       '</cluster_property_set></crm_config>'
+       '<nodes><node id="1" uname="node1"/><node id="2" uname="node2"/></nodes>'
+       '<resources>'
+       '<primitive id="a" class="ocf" provider="heartbeat" type="Dummy"/>'
+       '<group id="g"><primitive id="b" class="ocf" provider="heartbeat" type="Dummy"/>'
+       '<primitive id="c" class="ocf" provider="heartbeat" type="Dummy"/></group>'
+       '</resources>'
+       '<constraints>'
+       '<rsc_order id="order-a-g" first="a" then="g"/>'
+       '<rsc_colocation id="colocation-g-a" rsc="g" with-rsc="a" score="INFINITY"/>'
+       '<rsc_location id="location-a-node1" rsc="a" node="node1" score="100"/>'
+       '</constraints>'
+       '</configuration>'
+       '<status><node_state id="1" uname="node1"><lrm id="1"><lrm_resources>'
+       '<lrm_resource id="a" type="Dummy" class="ocf" provider="heartbeat"/>'
+       '</lrm_resources></lrm></node_state></status>'
+       '</cib>')
+
+
+# Returns the path of a file holding CIB, in a temporary directory
+@pytest.fixture
+def cib_file(tmp_path):
+    path = tmp_path / "cib.xml"
+    path.write_text(CIB)
+    return str(path)
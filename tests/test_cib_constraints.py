@@ -0,0 +1,108 @@
+import pytest
+
+from ansible.module_utils.cib_constraints import normalize_constraint, plan_constraints
+from ansible.module_utils.cib_patch import CibPatch
+from ansible.module_utils.cib_snapshot import CibSnapshot
+
+RESOURCES = "".join('<primitive id="%s" class="ocf" provider="heartbeat" type="Dummy"/>' % name for name in ("a", "b", "c"))
+
+
+# Returns a snapshot of a CIB with primitives a, b and c and the given constraints
+def snapshot(constraints=""):
+    return CibSnapshot.from_string('<cib admin_epoch="0" epoch="1" num_updates="0"><configuration><crm_config/><nodes/>'
+                                   '<resources>%s</resources><constraints>%s</constraints></configuration><status/></cib>'
+                                   % (RESOURCES, constraints))
+
+# Returns the (change, type, id) of every change plan_constraints makes for the declared constraints
+def plan(constraints, declared, **options):
+    cib = snapshot(constraints)
+    patch = CibPatch(cib)
+    plan_constraints(cib, patch, declared, **options)
+    return [(detail["change"], detail["type"], detail["id"]) for detail in patch.details]
+
+ORDER = dict(type="order", first_resource="a", second_resource="b")
+
+
+# ==== normalize_constraint ====
+
+def test_defaults_are_filled_in():
+    constraint = normalize_constraint(ORDER)
+    assert constraint["key"] == ("order", "a", "start", "b", "start")
+    assert constraint["settings"] == [("kind", "Mandatory", "Mandatory"), ("symmetrical", "true", "true")]
+    assert constraint["resources"] == ["a", "b"]
+    assert constraint["id"] == "order-start-a-start-b-Mandatory-true"
+
+def test_name_is_used_as_id_and_values_are_converted():
+    constraint = normalize_constraint(dict(ORDER, name="my-order", symmetrical=False))
+    assert constraint["id"] == "my-order"
+    assert ("symmetrical", "false", "true") in constraint["settings"]
+
+def test_location_role_is_optional():
+    constraint = normalize_constraint(dict(type="location", resource="a", node="node1", score="-INFINITY"))
+    assert constraint["key"] == ("location", "a", "node1", None)
+    assert constraint["identity"] == [("rsc", "a"), ("node", "node1"), ("role", None)]
+
+@pytest.mark.parametrize("declared, message", [
+    (dict(type="ticket"), "constraint type must be one of"),
+    (dict(), "constraint type must be one of"),
+    (dict(type="order", first_resource="a"), "order constraint is missing second_resource"),
+    (dict(ORDER, kind="Sometimes"), "kind of order constraint must be one of"),
+    (dict(ORDER, score="100"), "unsupported fields for order constraint: score"),
+])
+def test_invalid_declarations(declared, message):
+    with pytest.raises(ValueError, match=message):
+        normalize_constraint(declared)
+
+
+# ==== plan_constraints ====
+
+def test_missing_constraint_is_created():
+    assert plan("", [ORDER]) == [("created", "order", "order-start-a-start-b-Mandatory-true")]
+
+def test_existing_constraint_matching_under_another_id_is_left_alone():
+    assert plan('<rsc_order id="o1" first="a" then="b"/>', [ORDER]) == []
+
+def test_changed_setting_is_modified_in_place():
+    assert plan('<rsc_order id="o1" first="a" then="b" kind="Optional"/>', [ORDER]) == [("modified", "order", "o1")]
+
+def test_new_constraint_id_taken_by_another_element_gets_a_unique_id():
+    existing = '<rsc_colocation id="order-start-a-start-b-Mandatory-true" rsc="a" with-rsc="c" score="INFINITY"/>'
+    assert plan(existing, [ORDER]) == [("created", "order", "order-start-a-start-b-Mandatory-true-1")]
+
+def test_absent_removes_every_matching_constraint():
+    existing = '<rsc_order id="o1" first="a" then="b"/><rsc_order id="o2" first="a" then="b" first-action="start"/>'
+    assert plan(existing, [ORDER], state="absent") == [("removed", "order", "o1"), ("removed", "order", "o2")]
+
+def test_purge_removes_undeclared_constraints_and_duplicates():
+    existing = ('<rsc_order id="o1" first="a" then="b"/><rsc_order id="o2" first="a" then="b"/>'
+                '<rsc_colocation id="c1" rsc="b" with-rsc="c" score="INFINITY"/>')
+    assert plan(existing, [ORDER], purge=True) == [("removed", "order", "o2"), ("removed", "colocation", "c1")]
+
+def test_constraints_that_cannot_be_declared_are_never_purged():
+    existing = ('<rsc_order id="set1"><resource_set id="set1-set"><resource_ref id="a"/><resource_ref id="b"/>'
+                '</resource_set></rsc_order>'
+                '<rsc_location id="rule1" rsc="a"><rule id="rule1-rule" score="-INFINITY">'
+                '<expression id="rule1-expr" attribute="#uname" operation="eq" value="node1"/></rule></rsc_location>'
+                '<rsc_location id="pattern1" rsc-pattern="^a" node="node1" score="100"/>')
+    assert plan(existing, [ORDER]) == [("created", "order", "order-start-a-start-b-Mandatory-true")]
+    assert plan(existing, [ORDER], purge=True) == [("created", "order", "order-start-a-start-b-Mandatory-true")]
+    assert plan(existing, [], purge=True) == []
+
+def test_empty_declaration():
+    existing = '<rsc_order id="o1" first="a" then="b"/>'
+    assert plan(existing, []) == []
+    assert plan(existing, [], purge=True) == [("removed", "order", "o1")]
+
+def test_unknown_resource_is_rejected():
+    with pytest.raises(ValueError, match="resource d of order constraint"):
+        plan("", [dict(ORDER, second_resource="d")])
+
+def test_resource_ids_replace_the_resources_of_the_snapshot():
+    assert plan("", [dict(ORDER, second_resource="d")], resource_ids=["a", "d"]) == [
+        ("created", "order", "order-start-a-start-d-Mandatory-true")]
+    with pytest.raises(ValueError, match="resource b of order constraint"):
+        plan("", [ORDER], resource_ids=["a"])
+
+def test_duplicate_declarations_are_rejected():
+    with pytest.raises(ValueError, match="constraints declared more than once"):
+        plan("", [ORDER, dict(ORDER, name="other")])
@@ -0,0 +1,167 @@
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.cib_diff import diff_elements, edit_plan, pair_children
+
+PRIMITIVE = ('<primitive id="vip" class="ocf" provider="heartbeat" type="IPaddr2">'
+             '<instance_attributes id="vip-instance_attributes">'
+             '<nvpair id="vip-instance_attributes-ip" name="ip" value="10.0.0.1"/>'
+             '<nvpair id="vip-instance_attributes-cidr_netmask" name="cidr_netmask" value="24"/>'
+             '</instance_attributes>'
+             '<operations><op id="vip-monitor-interval-10s" name="monitor" interval="10s"/></operations>'
+             '</primitive>')
+
+
+# ==== diff_elements ====
+
+def test_equivalent_elements_have_no_differences():
+    assert diff_elements(ET.fromstring(PRIMITIVE), ET.fromstring(PRIMITIVE)) == []
+
+def test_generated_ids_attribute_order_and_whitespace_are_ignored():
+    other = ('<primitive type="IPaddr2" provider="heartbeat" class="ocf" id="vip">\n'
+             '  <instance_attributes id="vip-params">\n'
+             '    <nvpair id="a" name="cidr_netmask" value="24"/>\n'
+             '    <nvpair id="b" name="ip" value="10.0.0.1"/>\n'
+             '  </instance_attributes>\n'
+             '  <operations><op id="vip-monitor-10s" interval="10s" name="monitor"/></operations>\n'
+             '</primitive>')
+    assert diff_elements(ET.fromstring(PRIMITIVE), ET.fromstring(other)) == []
+
+def test_changed_nvpair_value_is_reported_by_name():
+    other = PRIMITIVE.replace('value="10.0.0.1"', 'value="10.0.0.2"')
+    assert diff_elements(ET.fromstring(PRIMITIVE), ET.fromstring(other)) == [
+        dict(path="primitive[@id='vip']/instance_attributes/nvpair[@name='ip']", change="modified",
+             attribute="value", before="10.0.0.1", after="10.0.0.2")]
+
+def test_added_and_removed_children():
+    other = PRIMITIVE.replace('<nvpair id="vip-instance_attributes-cidr_netmask" name="cidr_netmask" value="24"/>',
+                              '<nvpair id="vip-instance_attributes-nic" name="nic" value="eth0"/>')
+    differences = diff_elements(ET.fromstring(PRIMITIVE), ET.fromstring(other))
+    assert [(difference["path"], difference["change"], difference["before"], difference["after"]) for difference in differences] == [
+        ("primitive[@id='vip']/instance_attributes/nvpair[@name='cidr_netmask']", "removed", "24", None),
+        ("primitive[@id='vip']/instance_attributes/nvpair[@name='nic']", "added", None, "eth0")]
+
+def test_operations_are_paired_by_name_and_interval():
+    other = PRIMITIVE.replace('interval="10s"', 'interval="20s"')
+    differences = diff_elements(ET.fromstring(PRIMITIVE), ET.fromstring(other))
+    assert [(difference["path"], difference["change"]) for difference in differences] == [
+        ("primitive[@id='vip']/operations/op[@name='monitor'][@interval='10s']", "removed"),
+        ("primitive[@id='vip']/operations/op[@name='monitor'][@interval='20s']", "added")]
+
+def test_reordered_nvpairs_are_not_a_difference():
+    other = ('<instance_attributes id="x"><nvpair id="b" name="b" value="2"/><nvpair id="a" name="a" value="1"/></instance_attributes>')
+    original = ('<instance_attributes id="x"><nvpair id="a" name="a" value="1"/><nvpair id="b" name="b" value="2"/></instance_attributes>')
+    assert diff_elements(ET.fromstring(original), ET.fromstring(other)) == []
+
+def test_reordered_group_members_are_a_move():
+    group = '<group id="g"><primitive id="a" class="ocf" type="Dummy"/><primitive id="b" class="ocf" type="Dummy"/></group>'
+    reordered = '<group id="g"><primitive id="b" class="ocf" type="Dummy"/><primitive id="a" class="ocf" type="Dummy"/></group>'
+    assert diff_elements(ET.fromstring(group), ET.fromstring(reordered)) == [
+        dict(path="group[@id='g']", change="moved", attribute=None, before=["a", "b"], after=["b", "a"])]
+
+def test_resources_with_different_ids_are_not_paired():
+    differences = diff_elements(ET.fromstring('<group id="g"><primitive id="a"/></group>'),
+                                ET.fromstring('<group id="g"><primitive id="b"/></group>'))
+    assert [difference["change"] for difference in differences] == ["removed", "added"]
+
+def test_changed_tag_is_reported_without_comparing_children():
+    differences = diff_elements(ET.fromstring('<clone id="c"><primitive id="a"/></clone>'),
+                                ET.fromstring('<master id="c"><primitive id="b"/></master>'))
+    assert differences == [dict(path="clone[@id='c']", change="modified", attribute="#tag", before="clone", after="master")]
+
+def test_empty_elements():
+    assert diff_elements(ET.fromstring("<operations/>"), ET.fromstring("<operations></operations>")) == []
+    assert diff_elements(ET.fromstring("<operations/>"), ET.fromstring('<operations><op id="x" name="start" interval="0s"/></operations>')) == [
+        dict(path="operations/op[@name='start'][@interval='0s']", change="added", attribute=None, before=None, after=None)]
+
+
+# ==== pair_children ====
+
+def ids(elements):
+    return [element.attrib.get("id") for element in elements]
+
+def test_pair_children_pairs_nvpairs_by_name():
+    element1 = ET.fromstring('<meta_attributes id="m"><nvpair id="m-a" name="a" value="1"/><nvpair id="m-b" name="b" value="2"/></meta_attributes>')
+    element2 = ET.fromstring('<meta_attributes id="m"><nvpair id="other" name="b" value="3"/><nvpair id="m-c" name="c" value="4"/></meta_attributes>')
+    paired, removed, added = pair_children(element1, element2)
+    assert [(child1.attrib["id"], child2.attrib["id"]) for child1, child2 in paired] == [("m-b", "other")]
+    assert ids(removed) == ["m-a"]
+    assert [(position, child.attrib["id"]) for position, child in added] == [(1, "m-c")]
+
+def test_pair_children_follows_the_order_of_the_second_element():
+    element1 = ET.fromstring('<group id="g"><primitive id="a"/><primitive id="b"/><primitive id="c"/></group>')
+    element2 = ET.fromstring('<group id="g"><primitive id="c"/><primitive id="a"/><primitive id="b"/></group>')
+    paired, removed, added = pair_children(element1, element2)
+    assert [(child1.attrib["id"], child2.attrib["id"]) for child1, child2 in paired] == [("c", "c"), ("a", "a"), ("b", "b")]
+    assert removed == [] and added == []
+
+def test_pair_children_by_id_pairs_elements_with_the_same_id():
+    element1 = ET.fromstring('<constraints><rsc_order id="o1" first="a" then="b"/><rsc_order id="o2" first="b" then="c"/></constraints>')
+    element2 = ET.fromstring('<constraints><rsc_order id="o2" first="b" then="d"/><rsc_order id="o3" first="a" then="b"/></constraints>')
+    paired, removed, added = pair_children(element1, element2, by_id=True)
+    assert [(child1.attrib["id"], child2.attrib["id"]) for child1, child2 in paired] == [("o2", "o2")]
+    assert ids(removed) == ["o1"]
+    assert [(position, child.attrib["id"]) for position, child in added] == [(1, "o3")]
+
+def test_pair_children_without_id_pairs_other_elements_by_occurrence():
+    element1 = ET.fromstring('<constraints><rsc_order id="o1" first="a" then="b"/><rsc_order id="o2" first="b" then="c"/></constraints>')
+    element2 = ET.fromstring('<constraints><rsc_order id="x" first="a" then="b"/></constraints>')
+    paired, removed, added = pair_children(element1, element2)
+    assert [(child1.attrib["id"], child2.attrib["id"]) for child1, child2 in paired] == [("o1", "x")]
+    assert ids(removed) == ["o2"]
+    assert added == []
+
+def test_pair_children_of_empty_elements():
+    assert pair_children(ET.fromstring("<group id='g'/>"), ET.fromstring("<group id='g'/>")) == ([], [], [])
+    paired, removed, added = pair_children(ET.fromstring("<group id='g'/>"), ET.fromstring("<group id='g'><primitive id='a'/></group>"))
+    assert paired == [] and removed == [] and [(position, child.attrib["id"]) for position, child in added] == [(0, "a")]
+
+
+# ==== edit_plan ====
+
+# Applies the steps of an edit plan to a copy of current the way cluster_group does: removed items go first,
+# then every added or moved item is placed right after the item preceding it in the desired order
+def apply_plan(current, desired, plan):
+    result = [item for item in current if item not in [step["item"] for step in plan if step["action"] == "remove"]]
+    for step in plan:
+        if step["action"] in ("add", "move"):
+            if step["item"] in result:
+                result.remove(step["item"])
+            position = result.index(desired[step["position"] - 1]) + 1 if step["position"] > 0 else 0
+            result.insert(position, step["item"])
+    return result
+
+def actions(plan):
+    return [(step["action"], step["item"], step["position"]) for step in plan]
+
+def test_unchanged_list_is_only_kept():
+    assert actions(edit_plan(["a", "b", "c"], ["a", "b", "c"])) == [("keep", "a", 0), ("keep", "b", 1), ("keep", "c", 2)]
+
+def test_added_and_removed_items():
+    assert actions(edit_plan(["a", "b", "c"], ["a", "c", "d"])) == [
+        ("remove", "b", None), ("keep", "a", 0), ("keep", "c", 1), ("add", "d", 2)]
+
+def test_reordering_moves_only_the_items_outside_the_longest_common_subsequence():
+    plan = edit_plan(["a", "b", "c", "d"], ["b", "c", "d", "a"])
+    assert actions(plan) == [("keep", "b", 0), ("keep", "c", 1), ("keep", "d", 2), ("move", "a", 3)]
+
+def test_reversal_keeps_one_item():
+    plan = edit_plan(["a", "b", "c"], ["c", "b", "a"])
+    assert [step["action"] for step in plan].count("keep") == 1
+    assert [step["action"] for step in plan].count("move") == 2
+
+def test_empty_lists():
+    assert edit_plan([], []) == []
+    assert actions(edit_plan([], ["a", "b"])) == [("add", "a", 0), ("add", "b", 1)]
+    assert actions(edit_plan(["a", "b"], [])) == [("remove", "a", None), ("remove", "b", None)]
+
+def test_plans_turn_current_into_desired():
+    cases = [
+        (["a", "b", "c", "d"], ["d", "c", "b", "a"]),
+        (["x", "k"], ["k", "y", "x"]),
+        (["c", "b", "a"], ["a", "b", "c"]),
+        (["a", "b", "c", "d"], ["b", "a", "x", "y", "d"]),
+        (["a", "b", "c", "d"], ["y", "x", "c", "a", "b", "d"]),
+        (["a"], ["b"]),
+    ]
+    for current, desired in cases:
+        assert apply_plan(current, desired, edit_plan(current, desired)) == desired
@@ -0,0 +1,28 @@
+from ansible.module_utils.cib_native import build_primitive
+
+OPTIONS = "ip=10.0.0.1 cidr_netmask=24"
+MONITOR = " op monitor interval=10s timeout=20s"
+
+
+def build(os, options):
+    return build_primitive(os, "vip", "ocf", "heartbeat", "IPaddr2", options)
+
+def operation_ids(primitive):
+    return [op.attrib["id"] for op in primitive.iter("op")]
+
+
+def test_pcs_default_ops_are_left_to_pcs():
+    assert build("RedHat", OPTIONS + MONITOR) is None
+
+def test_pcs_monitor_is_left_to_pcs_without_op_monitor():
+    # pcs resource create --no-default-ops still adds the monitor of the agent metadata
+    assert build("RedHat", OPTIONS + " --no-default-ops") is None
+    assert build("RedHat", OPTIONS + " op start timeout=20s --no-default-ops") is None
+
+def test_pcs_resource_with_op_monitor_is_built():
+    primitive = build("RedHat", OPTIONS + MONITOR + " --no-default-ops")
+    assert operation_ids(primitive) == ["vip-monitor-interval-10s"]
+
+def test_crm_resource_is_built_with_the_given_operations_only():
+    assert operation_ids(build("Suse", OPTIONS)) == []
+    assert operation_ids(build("Suse", OPTIONS + MONITOR)) == ["vip-monitor-10s"]
@@ -0,0 +1,126 @@
+import itertools
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.cib_diff import diff_elements
+from ansible.module_utils.cib_patch import CibPatch
+from ansible.module_utils.cib_snapshot import CibSnapshot
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "simulator"))
+import fake_pacemaker
+
+VIP = ('<primitive id="vip" class="ocf" provider="heartbeat" type="IPaddr2">'
+       '<instance_attributes id="vip-instance_attributes">'
+       '<nvpair id="vip-instance_attributes-ip" name="ip" value="10.0.0.1"/>'
+       '</instance_attributes>'
+       '</primitive>')
+GROUP = ('<group id="g"><primitive id="a" class="ocf" provider="heartbeat" type="Dummy"/>'
+         '<primitive id="b" class="ocf" provider="heartbeat" type="Dummy"/>'
+         '<primitive id="c" class="ocf" provider="heartbeat" type="Dummy"/></group>')
+
+
+# Returns a CIB with the given content of its resources section
+def cib(resources):
+    return ('<cib admin_epoch="0" epoch="5" num_updates="2"><configuration><crm_config/><nodes/>'
+            '<resources>%s</resources><constraints/></configuration><status/></cib>' % resources)
+
+# Returns the patch update_element makes to turn the resource with the given id into desired, and the CIB
+# the patch turns the original into, applied the way the CIB manager applies it
+def update(resources, resource_id, desired):
+    snapshot = CibSnapshot.from_string(cib(resources))
+    patch = CibPatch(snapshot)
+    patch.update_element(snapshot.get(resource_id), ET.fromstring(desired))
+    root = ET.fromstring(cib(resources))
+    fake_pacemaker.apply_patch(root, ET.fromstring(patch.to_xml()))
+    return patch, root
+
+def operations(patch):
+    return [change.attrib["operation"] for change in patch.changes]
+
+
+def test_equivalent_element_needs_no_change():
+    patch, root = update(VIP, "vip", VIP.replace('id="vip-instance_attributes-ip"', 'id="other"'))
+    assert len(patch) == 0
+
+def test_changed_attribute_is_modified_in_place():
+    desired = VIP.replace('type="IPaddr2"', 'type="IPaddr3"')
+    patch, root = update(VIP, "vip", desired)
+    assert operations(patch) == ["modify"]
+    assert diff_elements(root.find(".//primitive[@id='vip']"), ET.fromstring(desired)) == []
+
+def test_changed_nvpair_keeps_its_id():
+    desired = VIP.replace('value="10.0.0.1"', 'value="10.0.0.2"').replace('id="vip-instance_attributes-ip"', 'id="new-id"')
+    patch, root = update(VIP, "vip", desired)
+    assert operations(patch) == ["modify"]
+    nvpair = root.find(".//nvpair[@name='ip']")
+    assert (nvpair.attrib["id"], nvpair.attrib["value"]) == ("vip-instance_attributes-ip", "10.0.0.2")
+
+def test_removed_attribute_and_child():
+    desired = '<primitive id="vip" class="ocf" type="IPaddr2"/>'
+    patch, root = update(VIP, "vip", desired)
+    assert sorted(operations(patch)) == ["delete", "modify"]
+    assert diff_elements(root.find(".//primitive[@id='vip']"), ET.fromstring(desired)) == []
+
+def test_new_child_with_an_id_used_elsewhere_gets_a_unique_id():
+    other = '<primitive id="other" class="ocf" provider="heartbeat" type="Dummy"><meta_attributes id="vip-meta_attributes"/></primitive>'
+    desired = VIP.replace("</primitive>", '<meta_attributes id="vip-meta_attributes">'
+                                          '<nvpair id="vip-meta_attributes-target-role" name="target-role" value="Stopped"/>'
+                                          '</meta_attributes></primitive>')
+    patch, root = update(VIP + other, "vip", desired)
+    assert operations(patch) == ["create"]
+    created = root.find(".//primitive[@id='vip']/meta_attributes")
+    assert created.attrib["id"] == "vip-meta_attributes-1"
+    assert len(root.findall(".//*[@id='vip-meta_attributes']")) == 1
+    assert diff_elements(root.find(".//primitive[@id='vip']"), ET.fromstring(desired)) == []
+
+def test_reordered_group_members_are_moved_into_the_desired_order():
+    for order in (["c", "b", "a"], ["b", "c", "a"], ["c", "a", "b"]):
+        desired = '<group id="g">%s</group>' % "".join(
+            '<primitive id="%s" class="ocf" provider="heartbeat" type="Dummy"/>' % member for member in order)
+        patch, root = update(GROUP, "g", desired)
+        assert set(operations(patch)) == {"move"}
+        assert [member.attrib["id"] for member in root.find(".//group[@id='g']")] == order
+
+def test_added_and_reordered_members():
+    desired = ('<group id="g"><primitive id="d" class="ocf" provider="heartbeat" type="Dummy"/>'
+               '<primitive id="c" class="ocf" provider="heartbeat" type="Dummy"/>'
+               '<primitive id="a" class="ocf" provider="heartbeat" type="Dummy"/></group>')
+    patch, root = update(GROUP, "g", desired)
+    assert [member.attrib["id"] for member in root.find(".//group[@id='g']")] == ["d", "c", "a"]
+
+def test_moves_and_creates_in_one_group_give_the_desired_order():
+    # The CIB manager applies creates and moves after the deletes, in ascending position
+    meta = '<meta_attributes id="g-meta_attributes"/>'
+    for order in itertools.permutations("abc"):
+        for index in range(4):
+            members = list(order[:index]) + ["d"] + list(order[index:])
+            desired = '<group id="g">%s%s</group>' % ("".join(
+                '<primitive id="%s" class="ocf" provider="heartbeat" type="Dummy"/>' % member for member in members), meta)
+            patch, root = update(GROUP.replace("</group>", meta + "</group>"), "g", desired)
+            assert "create" in operations(patch)
+            assert [child.attrib["id"] for child in root.find(".//group[@id='g']")] == members + ["g-meta_attributes"]
+
+def test_moves_are_applied_after_deletes_whatever_their_place_in_the_patch():
+    snapshot = CibSnapshot.from_string(cib(GROUP))
+    patch = CibPatch(snapshot)
+    patch.move(snapshot.get("c"), 0)
+    patch.create(snapshot.get("g"), ET.fromstring('<primitive id="d" class="ocf" provider="heartbeat" type="Dummy"/>'), 1)
+    patch.delete(snapshot.get("a"))
+    root = ET.fromstring(cib(GROUP))
+    fake_pacemaker.apply_patch(root, ET.fromstring(patch.to_xml()))
+    assert [child.attrib["id"] for child in root.find(".//group[@id='g']")] == ["c", "d", "b"]
+
+def test_changed_tag_replaces_the_element():
+    desired = '<clone id="g"><primitive id="a" class="ocf" provider="heartbeat" type="Dummy"/></clone>'
+    patch, root = update(GROUP, "g", desired)
+    assert operations(patch) == ["delete", "create"]
+    assert root.find(".//group") is None
+    assert diff_elements(root.find(".//clone[@id='g']"), ET.fromstring(desired)) == []
+
+def test_patch_applies_to_the_queried_version_only():
+    snapshot = CibSnapshot.from_string(cib(VIP))
+    patch = CibPatch(snapshot)
+    version = ET.fromstring(patch.to_xml()).find("version")
+    assert version.find("source").attrib == dict(admin_epoch="0", epoch="5", num_updates="2")
+    assert version.find("target").attrib == dict(admin_epoch="0", epoch="6", num_updates="0")
@@ -0,0 +1,37 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from ansible.module_utils.cib_query import HAS_LXML, xpath_literal
+
+VALUES = ["plain", "", "it's", 'say "hi"', "it's \"both\"", "'", '"', "'\"'", "a''b", "'leading and trailing'"]
+
+
+def test_values_without_single_quotes_are_single_quoted():
+    assert xpath_literal("plain") == "'plain'"
+    assert xpath_literal('say "hi"') == "'say \"hi\"'"
+    assert xpath_literal("") == "''"
+
+def test_values_with_single_quotes_only_are_double_quoted():
+    assert xpath_literal("it's") == '"it\'s"'
+
+def test_values_with_both_quotes_are_concatenated():
+    assert xpath_literal("it's \"both\"") == "concat('it', \"'\", 's \"both\"')"
+
+@pytest.mark.parametrize("value", [value for value in VALUES if "'" not in value or '"' not in value])
+def test_literals_match_the_value_in_elementtree(value):
+    root = ET.Element("resources")
+    ET.SubElement(root, "primitive", id=value)
+    ET.SubElement(root, "primitive", id=value + "x")
+    matches = root.findall("primitive[@id=%s]" % xpath_literal(value))
+    assert [match.attrib["id"] for match in matches] == [value]
+
+@pytest.mark.skipif(not HAS_LXML, reason="lxml is not installed")
+@pytest.mark.parametrize("value", VALUES)
+def test_literals_evaluate_to_the_value_in_xpath(value):
+    from lxml import etree
+    root = etree.Element("resources")
+    etree.SubElement(root, "primitive", id=value)
+    etree.SubElement(root, "primitive", id=value + "x")
+    assert root.xpath("string(%s)" % xpath_literal(value)) == value
+    assert [match.get("id") for match in root.xpath("primitive[@id=%s]" % xpath_literal(value))] == [value]
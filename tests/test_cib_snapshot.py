@@ -0,0 +1,146 @@
+from ansible.module_utils import cib_snapshot
+from ansible.module_utils.cib_snapshot import CibSnapshot, get_cib_snapshot, locate_id, parse_configuration, read_cib_version
+
+from conftest import CIB
+
+
+# Returns the ids of elements
+def ids(elements):
+    return [element.attrib.get("id") for element in elements]
+
+# Rewrites the CIB file with another version and, if given, other content
+def rewrite(path, epoch, old="", new=""):
+    with open(path, "w") as cib_file:
+        cib_file.write(CIB.replace('epoch="7"', 'epoch="%d"' % epoch).replace(old, new))
+
+# Returns CIB with its <status> section, or the given one, placed before its configuration
+def status_first(status=None):
+    head, rest = CIB.split("<configuration>")
+    configuration, rest = rest.split("<status>")
+    return head + (status or "<status>" + rest[:-len("</cib>")]) + "<configuration>" + configuration + "</cib>"
+
+
+# ==== Lazy indexes ====
+
+def test_first_lookup_of_a_kind_scans_and_builds_no_index():
+    snapshot = CibSnapshot.from_string(CIB)
+    assert snapshot.get("b").tag == "primitive"
+    assert ids(snapshot.get_orders("a", "g")) == ["order-a-g"]
+    assert snapshot._indexes == {}
+
+def test_second_lookup_of_a_kind_builds_only_its_index():
+    snapshot = CibSnapshot.from_string(CIB)
+    snapshot.get("a")
+    snapshot.get("b")
+    snapshot.get_orders("a", "g")
+    assert list(snapshot._indexes) == ["by_id"]
+    snapshot.get_orders("g", "a")
+    assert sorted(snapshot._indexes) == ["by_id", "orders"]
+
+def test_scans_and_indexes_give_the_same_answers():
+    lookups = [("get", "b", None), ("get", "b", "group"), ("get", "missing", None), ("get", "g", "group"),
+               ("find_all", "primitive"), ("find_all", "clone"),
+               ("get_orders", "a", "g"), ("get_orders", "g", "a"),
+               ("get_colocations", "g", "a"), ("get_colocations", "a", "g"),
+               ("get_locations", "a"), ("get_locations", "g"),
+               ("get_node", "node2"), ("get_node", "node3")]
+    indexed = CibSnapshot.from_string(CIB)
+    for lookup in lookups:
+        getattr(indexed, lookup[0])(*lookup[1:])
+    for lookup in lookups:
+        scanned_answer = getattr(CibSnapshot.from_string(CIB), lookup[0])(*lookup[1:])
+        indexed_answer = getattr(indexed, lookup[0])(*lookup[1:])
+        if isinstance(indexed_answer, list):
+            assert ids(scanned_answer) == ids(indexed_answer), lookup
+        else:
+            assert (scanned_answer is None) == (indexed_answer is None), lookup
+            assert scanned_answer is None or scanned_answer.attrib == indexed_answer.attrib, lookup
+
+def test_status_is_left_out_of_the_lookups():
+    snapshot = CibSnapshot.from_string(CIB)
+    assert snapshot.find_all("lrm_resource") == []
+    assert snapshot.get("a").tag == "primitive"
+    assert snapshot.get("a").tag == "primitive"
+
+def test_group_members_and_parents():
+    snapshot = CibSnapshot.from_string(CIB)
+    assert snapshot.get_group_members("g") == ["b", "c"]
+    assert snapshot.get_group_members("a") is None
+    assert snapshot.get_parent(snapshot.get("b")) is snapshot.get("g")
+    assert snapshot.get_parent(snapshot.root) is None
+
+
+# ==== Version-keyed reuse ====
+
+def test_version_is_read_from_the_opening_tag(cib_file):
+    assert read_cib_version(cib_file) == (0, 7, 3)
+    assert CibSnapshot.from_file(cib_file).version == (0, 7, 3)
+
+def test_snapshot_is_reused_while_the_version_is_unchanged(cib_file):
+    snapshot = get_cib_snapshot(cib_file)
+    # Content changed without a new version is not seen: the version stands for the content
+    rewrite(cib_file, 7, 'id="a"', 'id="renamed"')
+    assert get_cib_snapshot(cib_file) is snapshot
+    assert get_cib_snapshot(cib_file).get("a") is not None
+
+def test_snapshot_is_parsed_again_when_the_version_changes(cib_file):
+    snapshot = get_cib_snapshot(cib_file)
+    rewrite(cib_file, 8, 'id="a"', 'id="renamed"')
+    reparsed = get_cib_snapshot(cib_file)
+    assert reparsed is not snapshot
+    assert reparsed.version == (0, 8, 3)
+    assert reparsed.get("a") is None and reparsed.get("renamed") is not None
+
+def test_snapshots_are_kept_per_path(cib_file, tmp_path):
+    other = str(tmp_path / "other.xml")
+    rewrite(other, 9)
+    assert get_cib_snapshot(cib_file).version == (0, 7, 3)
+    assert get_cib_snapshot(other).version == (0, 9, 3)
+    assert set([cib_file, other]) <= set(cib_snapshot._snapshots)
+
+
+# ==== Streaming parse ====
+
+def test_parse_stops_at_status(cib_file):
+    root = parse_configuration(cib_file)
+    assert [child.tag for child in root] == ["configuration", "status"]
+    assert len(root.find("status")) == 0
+
+def test_contents_of_status_are_never_parsed(cib_file):
+    # Not even well-formed: parsing them would fail
+    rewrite(cib_file, 7, "<lrm_resources>", "<lrm_resources><unclosed>")
+    assert len(parse_configuration(cib_file).find("status")) == 0
+    assert locate_id(cib_file, "c").tag == "primitive"
+
+def test_located_elements_come_from_the_configuration(cib_file):
+    assert locate_id(cib_file, "b", "primitive").attrib["type"] == "Dummy"
+    assert locate_id(cib_file, "order-a-g").tag == "rsc_order"
+    assert locate_id(cib_file, "g", "primitive") is None
+    # lrm_resource "a" of <status> is skipped over, but primitive "a" is found
+    assert locate_id(cib_file, "a").tag == "primitive"
+    assert locate_id(cib_file, "a", "lrm_resource") is None
+
+def test_element_after_status_is_still_found(cib_file):
+    with open(cib_file, "w") as status_first_file:
+        status_first_file.write(status_first())
+    assert locate_id(cib_file, "location-a-node1").tag == "rsc_location"
+    assert locate_id(cib_file, "a", "lrm_resource") is None
+    snapshot = CibSnapshot.from_file(cib_file)
+    assert [child.tag for child in snapshot.root] == ["status", "configuration"]
+    assert snapshot.get("c").tag == "primitive"
+    assert len(snapshot.root.find("status")) == 0
+
+def test_status_split_over_reads_is_skipped(cib_file, monkeypatch):
+    with open(cib_file, "w") as status_first_file:
+        status_first_file.write(status_first())
+    for chunk in (1, 5, 13, 64, 100):
+        monkeypatch.setattr(cib_snapshot, "STATUS_CHUNK", chunk)
+        root = parse_configuration(cib_file)
+        assert [child.tag for child in root] == ["status", "configuration"], chunk
+        assert len(root.find("status")) == 0, chunk
+        assert locate_id(cib_file, "c").tag == "primitive", chunk
+
+def test_empty_status_is_kept():
+    root = parse_configuration(status_first("<status/>"), is_path=False)
+    assert [child.tag for child in root] == ["status", "configuration"]
+    assert root.find("configuration/resources/group").attrib["id"] == "g"
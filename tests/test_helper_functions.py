@@ -0,0 +1,30 @@
+from ansible.module_utils.helper_functions import parse_os_release, normalize_os_name_and_version
+
+
+def write(tmp_path, text):
+    path = tmp_path / "os-release"
+    path.write_text(text)
+    return str(path)
+
+
+def test_quoted_and_unquoted_values(tmp_path):
+    path = write(tmp_path, 'NAME="Red Hat Enterprise Linux"\nVERSION_ID="8.6"\nID=rhel\nPRETTY_NAME=\'RHEL 8.6\'\n')
+    assert parse_os_release(path) == dict(NAME="Red Hat Enterprise Linux", VERSION_ID="8.6", ID="rhel", PRETTY_NAME="RHEL 8.6")
+
+def test_comments_blank_lines_and_surrounding_whitespace_are_skipped(tmp_path):
+    path = write(tmp_path, '# generated\n\n  NAME="SLES"  \nnot a field\n')
+    assert parse_os_release(path) == dict(NAME="SLES")
+
+def test_values_may_contain_equal_signs(tmp_path):
+    path = write(tmp_path, 'HOME_URL="https://example.com/?a=b"\n')
+    assert parse_os_release(path) == dict(HOME_URL="https://example.com/?a=b")
+
+def test_empty_file(tmp_path):
+    assert parse_os_release(write(tmp_path, "")) == {}
+
+def test_os_names_map_to_the_module_names():
+    assert normalize_os_name_and_version("Red Hat Enterprise Linux", "8.6") == ("RedHat", "8")
+    assert normalize_os_name_and_version("RedHat", "7") == ("RedHat", "7")
+    assert normalize_os_name_and_version("SLES", "15.4") == ("Suse", "all")
+    assert normalize_os_name_and_version("Suse", "12") == ("Suse", "all")
+    assert normalize_os_name_and_version("Debian", "12") == (None, None)